@@ -14,12 +14,71 @@ class Config:
     # Path to annotation status JSON file
     ANNOTATION_STATUS_FILE = os.path.join(MRI_ROOT_DIR, 'annotation_status.json')
     
+    # Annotation status backend: 'json' (ANNOTATION_STATUS_FILE, fine for a single
+    # worker), 'journal' (ANNOTATION_STATUS_FILE as a snapshot plus the append-only
+    # STATUS_JOURNAL_FILE) or 'sqlite' (STATUS_STORE_FILE, safe with several gunicorn
+    # workers). Move existing data with scripts/migrate_status_store.py. The journal
+    # lives outside MRI_ROOT_DIR, whose mtime signals a patient list change.
+    STATUS_STORE_BACKEND = os.environ.get('STATUS_STORE_BACKEND') or 'json'
+    STATUS_STORE_FILE = os.environ.get('STATUS_STORE_FILE') or os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'instance', 'annotation_status.db')
+    STATUS_JOURNAL_FILE = os.environ.get('STATUS_JOURNAL_FILE') or os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'instance', 'annotation_status.journal.jsonl')
+    # Journal size that triggers a background compaction into the snapshot
+    STATUS_JOURNAL_COMPACT_BYTES = int(os.environ.get('STATUS_JOURNAL_COMPACT_BYTES') or 4 * 1024 ** 2)
+    
     # Annotations data directory
     ANNOTATION_DATA_DIR = os.environ.get('ANNOTATION_DATA_DIR') or os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'annotations_data')
     
+    # Annotation backend: 'files' (one JSON file per series under ANNOTATION_DATA_DIR)
+    # or 'sqlite' (indexed ANNOTATION_DB_FILE). Convert between them with
+    # scripts/convert_annotations.py.
+    ANNOTATION_BACKEND = os.environ.get('ANNOTATION_BACKEND') or 'files'
+    ANNOTATION_DB_FILE = os.environ.get('ANNOTATION_DB_FILE') or os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'instance', 'annotations.db')
+    # Inverted index of annotations by finding, value, level, side, annotator and date,
+    # kept current by every annotation write and built from the store on first use
+    ANNOTATION_INDEX_FILE = os.environ.get('ANNOTATION_INDEX_FILE') or os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'instance', 'annotation_index.db')
+    # Append-only log of every annotation write (who, when, what changed), one
+    # segment per day; past series states can be rebuilt from it (scripts/audit_log.py)
+    AUDIT_LOG_ENABLED = os.environ.get('AUDIT_LOG_ENABLED', '1') != '0'
+    AUDIT_LOG_DIR = os.environ.get('AUDIT_LOG_DIR') or os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'instance', 'audit')
+    
     # SpineNet results file
     SPINENET_RESULTS_FILE = os.environ.get('SPINENET_RESULTS_FILE') or os.path.join(ANNOTATION_DATA_DIR, 'spinenet_results.json')
     
+    # Rendered image cache (JPEGs rendered from DICOM files)
+    RENDER_CACHE_ENABLED = os.environ.get('RENDER_CACHE_ENABLED', '1') != '0'
+    RENDER_CACHE_DIR = os.environ.get('RENDER_CACHE_DIR') or os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'render_cache')
+    RENDER_CACHE_MAX_BYTES = int(os.environ.get('RENDER_CACHE_MAX_BYTES') or 2 * 1024 ** 3)
+    # Image widths rendered ahead of time by the bulk pre-render script
+    RENDER_PREVIEW_WIDTHS = [int(w) for w in (os.environ.get('RENDER_PREVIEW_WIDTHS') or '300').split(',')]
+    
+    # Persisted per-series intensity statistics used for the default display window
+    SERIES_STATS_DIR = os.environ.get('SERIES_STATS_DIR') or os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'series_stats')
+    
+    # SQLite catalog of the patient/study/series/instance tree under MRI_ROOT_DIR
+    CATALOG_ENABLED = os.environ.get('CATALOG_ENABLED', '1') != '0'
+    CATALOG_FILE = os.environ.get('CATALOG_FILE') or os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'instance', 'catalog.db')
+    # Seconds between incremental refreshes of the catalog by a background thread of each serving
+    # process; one process claims each refresh (0 leaves them to the watcher or scripts/scan_archive.py)
+    CATALOG_REFRESH_INTERVAL = int(os.environ.get('CATALOG_REFRESH_INTERVAL') or 300)
+    # Concurrent stat/list/header-read operations while scanning the archive
+    CATALOG_SCAN_WORKERS = int(os.environ.get('CATALOG_SCAN_WORKERS') or 8)
+    
+    # Filesystem watcher keeping the catalog and annotation status in sync with MRI_ROOT_DIR.
+    # Run it in a single process, scripts/watch_archive.py, and set
+    # CATALOG_REFRESH_INTERVAL=0 so serving processes no longer refresh the catalog themselves.
+    # WATCHER_ENABLED only makes the development server (run.py) start one itself.
+    WATCHER_ENABLED = os.environ.get('WATCHER_ENABLED', '0') == '1'
+    WATCHER_MODE = os.environ.get('WATCHER_MODE') or 'auto'  # 'auto', 'inotify' or 'poll'
+    WATCHER_BATCH_INTERVAL = float(os.environ.get('WATCHER_BATCH_INTERVAL') or 2.0)
+    WATCHER_POLL_INTERVAL = float(os.environ.get('WATCHER_POLL_INTERVAL') or 60.0)
+    
+    # Background pre-rendering of the patients selected on the dashboard
+    PRERENDER_ENABLED = os.environ.get('PRERENDER_ENABLED', '1') != '0'
+    PRERENDER_WORKERS = int(os.environ.get('PRERENDER_WORKERS') or 2)
+    PRERENDER_MAX_IN_FLIGHT = int(os.environ.get('PRERENDER_MAX_IN_FLIGHT') or 4)
+    # Render every slice of the selected patients' studies instead of only the series previews
+    PRERENDER_WHOLE_STUDIES = os.environ.get('PRERENDER_WHOLE_STUDIES', '0') == '1'
+    
     # Session configuration
     
 class DevelopmentConfig(Config):
@@ -31,7 +90,16 @@ class TestingConfig(Config):
     TESTING = True
     MRI_ROOT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'tests', 'test_data')
     ANNOTATION_STATUS_FILE = os.path.join(MRI_ROOT_DIR, 'annotation_status.json')
+    STATUS_STORE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'tests', 'test_annotation_status.db')
+    STATUS_JOURNAL_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'tests', 'test_annotation_status.journal.jsonl')
     ANNOTATION_DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'tests', 'test_annotations')
+    ANNOTATION_DB_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'tests', 'test_annotations.db')
+    ANNOTATION_INDEX_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'tests', 'test_annotation_index.db')
+    AUDIT_LOG_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'tests', 'test_audit')
+    RENDER_CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'tests', 'test_render_cache')
+    SERIES_STATS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'tests', 'test_series_stats')
+    PRERENDER_ENABLED = False
+    CATALOG_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'tests', 'test_catalog.db')
 
 class ProductionConfig(Config):
     """Production configuration"""
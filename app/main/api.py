@@ -9,16 +9,246 @@ from app.main.utils import (
     STATUS_COMPLETE
 )
 from app.models.annotation import (
-    get_series_annotations, 
+    get_annotation, 
+    get_series_annotations_versioned, 
+    diff_since, 
+    SeriesVersionConflict, 
     save_series_annotations, 
     add_annotation, 
+    update_annotation, 
     delete_annotation, 
+    import_annotations, 
+    get_study_annotation_summary, 
     validate_annotation,
     ANNOTATION_TYPES, 
     VERTEBRAL_LEVELS, 
     SIDE_OPTIONS
 )
 
+@bp.route('/api/annotations/export', methods=['GET'])
+@login_required
+def export_annotations():
+    """
+    Stream every annotation joined with patient, study and series metadata
+    
+    Query parameters: format (parquet, csv or jsonl), finding, level,
+    annotator, since and until (ISO dates or datetimes, inclusive).
+    """
+    from flask import Response, stream_with_context
+    from app.models.annotation_store import get_annotation_store
+    from app.utils.annotation_export import (
+        iter_export, iter_export_rows, parse_bound, default_format, EXPORT_MIMETYPES
+    )
+    from app.utils.catalog import get_catalog
+    from app.utils.status_store import get_status_store
+    
+    fmt = request.args.get('format') or default_format()
+    finding = request.args.get('finding') or None
+    level = request.args.get('level') or None
+    if finding is not None and finding not in ANNOTATION_TYPES:
+        return jsonify({'error': f'Invalid finding type: {finding}'}), 400
+    if level is not None and level not in VERTEBRAL_LEVELS:
+        return jsonify({'error': f'Invalid vertebral level: {level}'}), 400
+    try:
+        since = parse_bound(request.args.get('since'))
+        until = parse_bound(request.args.get('until'))
+    except ValueError as e:
+        return jsonify({'error': f'Invalid date: {e}'}), 400
+    
+    rows = iter_export_rows(get_annotation_store(), get_status_store(), get_catalog(),
+                            finding=finding, level=level, annotator=request.args.get('annotator') or None,
+                            since=since, until=until)
+    stats = {}
+    try:
+        chunks = iter_export(rows, fmt, stats=stats)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    def generate():
+        yield from chunks
+        current_app.logger.info(f"Annotation export ({fmt}): {stats['rows']} rows, {stats['bytes']} bytes "
+                                f"in {stats['seconds']:.2f}s ({stats['rows_per_second']:.0f} rows/s)")
+    
+    return Response(
+        stream_with_context(generate()),
+        mimetype=EXPORT_MIMETYPES[fmt],
+        headers={'Content-Disposition': f'attachment; filename=annotations.{fmt}'}
+    )
+
+@bp.route('/api/annotations/import', methods=['POST'])
+@login_required
+def bulk_import_annotations():
+    """
+    Add many annotations across series in one request
+    
+    Body: {'annotations': [annotation + patient_id, study_id, series_name],
+    'skip_invalid': false}. Without skip_invalid, any invalid record rejects
+    the whole request.
+    """
+    data = request.json
+    if not isinstance(data, dict) or not isinstance(data.get('annotations'), list):
+        return jsonify({'error': 'No annotations provided'}), 400
+    
+    summary = import_annotations(data['annotations'], session['username'],
+                                 skip_invalid=bool(data.get('skip_invalid')))
+    
+    if summary['errors'] and not data.get('skip_invalid'):
+        return jsonify({
+            'error': 'Invalid annotation data',
+            'validation_errors': summary['errors']
+        }), 400
+    
+    return jsonify({'success': not summary['failed'], **summary})
+
+@bp.route('/api/annotations/query', methods=['GET'])
+@login_required
+def query_annotations():
+    """
+    Query annotations across the cohort through the annotation index
+    
+    Query parameters: finding, value, level, side, annotator, since and until
+    (ISO dates or datetimes, inclusive), group_by ('study' for one result per
+    study), page and per_page.
+    """
+    import time
+    from app.models.annotation_index import get_annotation_index, MAX_PER_PAGE
+    from app.utils.annotation_export import parse_bound
+    
+    args = request.args
+    finding = args.get('finding') or None
+    level = args.get('level') or None
+    side = args.get('side') or None
+    group_by = args.get('group_by') or None
+    if finding is not None and finding not in ANNOTATION_TYPES:
+        return jsonify({'error': f'Invalid finding type: {finding}'}), 400
+    if level is not None and level not in VERTEBRAL_LEVELS:
+        return jsonify({'error': f'Invalid vertebral level: {level}'}), 400
+    if side is not None and side not in SIDE_OPTIONS:
+        return jsonify({'error': f'Invalid side: {side}'}), 400
+    if group_by not in (None, 'study'):
+        return jsonify({'error': f'Invalid group_by: {group_by}'}), 400
+    try:
+        since = parse_bound(args.get('since'))
+        until = parse_bound(args.get('until'))
+        page = int(args.get('page', 1))
+        per_page = int(args.get('per_page', 50))
+    except ValueError as e:
+        return jsonify({'error': f'Invalid query parameter: {e}'}), 400
+    
+    index = get_annotation_index()
+    if not index.is_built():
+        return jsonify({'error': 'The annotation index is being built, try again shortly'}), 503
+    
+    start = time.time()
+    result = index.query(
+        finding=finding, value=args.get('value') or None, level=level, side=side,
+        annotator=args.get('annotator') or None, since=since, until=until,
+        group_by=group_by, page=page, per_page=per_page
+    )
+    
+    return jsonify({
+        **result,
+        'page': max(page, 1),
+        'per_page': max(1, min(per_page, MAX_PER_PAGE)),
+        'elapsed_ms': round((time.time() - start) * 1000, 2)
+    })
+
+@bp.route('/api/annotation-summary/<patient_id>/<study_id>', methods=['GET'])
+@login_required
+def get_annotation_summary(patient_id, study_id):
+    """Get annotation counts of a study per series and per finding"""
+    return jsonify(get_study_annotation_summary(patient_id, study_id))
+
+@bp.route('/api/annotations/agreement', methods=['GET'])
+@login_required
+def get_annotation_agreement():
+    """
+    Inter-rater agreement (Cohen's and Fleiss' kappa) per finding and level
+
+    Query parameters: raters and findings, comma-separated (default: all).
+    Only studies read by at least two of the raters are compared.
+    """
+    import time
+    from app.models.annotation_agreement import get_agreement_engine
+    from app.models.annotation_index import get_annotation_index
+
+    raters = [rater for rater in request.args.get('raters', '').split(',') if rater] or None
+    findings = [finding for finding in request.args.get('findings', '').split(',') if finding] or None
+    for finding in findings or []:
+        if finding not in ANNOTATION_TYPES:
+            return jsonify({'error': f'Invalid finding type: {finding}'}), 400
+
+    if not get_annotation_index().is_built():
+        return jsonify({'error': 'The annotation index is being built, try again shortly'}), 503
+
+    start = time.time()
+    result = get_agreement_engine().agreement(raters=raters, findings=findings)
+    return jsonify({**result, 'elapsed_ms': round((time.time() - start) * 1000, 2)})
+
+@bp.route('/api/audit', methods=['GET'])
+@login_required
+def get_audit_entries():
+    """
+    List annotation audit log entries, oldest first
+
+    Query parameters: since and until (ISO dates or datetimes, inclusive),
+    patient_id, study_id, series_name, user, op and limit (default 1000).
+    """
+    from itertools import islice
+    from app.models.annotation_audit import get_audit_log, AUDIT_OPERATIONS
+    from app.utils.annotation_export import parse_bound
+
+    audit_log = get_audit_log()
+    if audit_log is None:
+        return jsonify({'error': 'Audit log is disabled'}), 404
+
+    args = request.args
+    op = args.get('op') or None
+    if op is not None and op not in AUDIT_OPERATIONS:
+        return jsonify({'error': f'Invalid op: {op}'}), 400
+    try:
+        since = parse_bound(args.get('since'))
+        until = parse_bound(args.get('until'))
+        limit = max(1, int(args.get('limit', 1000)))
+    except ValueError as e:
+        return jsonify({'error': f'Invalid query parameter: {e}'}), 400
+
+    entries = list(islice(audit_log.iter_entries(
+        since=since, until=until, patient_id=args.get('patient_id') or None,
+        study_id=args.get('study_id') or None, series_name=args.get('series_name') or None,
+        username=args.get('user') or None, op=op
+    ), limit + 1))
+    return jsonify({'entries': entries[:limit], 'truncated': len(entries) > limit})
+
+@bp.route('/api/audit/state/<patient_id>/<study_id>/<series_name>', methods=['GET'])
+@login_required
+def get_audit_state(patient_id, study_id, series_name):
+    """
+    Reconstruct the annotations of a series as they were at a past time or version
+
+    Query parameters: at (ISO date or datetime) or version.
+    """
+    from app.models.annotation_audit import get_audit_log, AuditHistoryGap
+    from app.utils.annotation_export import parse_bound
+
+    audit_log = get_audit_log()
+    if audit_log is None:
+        return jsonify({'error': 'Audit log is disabled'}), 404
+
+    try:
+        at = parse_bound(request.args.get('at'))
+        at_version = int(request.args['version']) if request.args.get('version') else None
+    except ValueError as e:
+        return jsonify({'error': f'Invalid query parameter: {e}'}), 400
+
+    annotations, version = get_series_annotations_versioned(patient_id, study_id, series_name)
+    try:
+        annotations, version = audit_log.state_at(patient_id, study_id, series_name, annotations, version,
+                                                  at=at, at_version=at_version)
+    except AuditHistoryGap as e:
+        return jsonify({'error': str(e)}), 409
+    return jsonify({'annotations': annotations, 'version': version})
+
 @bp.route('/api/annotations/types', methods=['GET'])
 @login_required
 def get_annotation_types():
@@ -29,12 +259,62 @@ def get_annotation_types():
         'sides': SIDE_OPTIONS
     })
 
+def _expected_version(data=None):
+    """
+    Series version a write was based on, from the If-Match header or a
+    'version' field of the request body (which is removed from data)
+
+    Returns:
+        The version, or None for an unconditional write (no version given, or If-Match: *)
+
+    Raises:
+        ValueError: the version is not a single integer
+    """
+    if request.if_match:
+        if request.if_match.star_tag:
+            return None
+        tags = request.if_match.as_set(include_weak=True)
+        if len(tags) != 1:
+            raise ValueError('If-Match must name a single series version')
+        return int(tags.pop())
+    if data is not None and 'version' in data:
+        version = data.pop('version')
+        # int() would also take null (TypeError), floats and booleans
+        if isinstance(version, bool) or not isinstance(version, (int, str)):
+            raise ValueError('version must be an integer')
+        return int(version)
+    return None
+
+def _versioned(payload, version, status=200):
+    """JSON response carrying the series version in its body and ETag"""
+    response = jsonify({**payload, 'version': version})
+    response.status_code = status
+    response.set_etag(str(version))
+    return response
+
+def _conflict(conflict, patient_id, study_id, series_name, expected_version):
+    """
+    409 response with the series as stored and, when the audit log covers it,
+    a diff of what was changed on the server since expected_version
+    """
+    payload = {
+        'error': 'Annotations were changed by someone else',
+        'annotations': conflict.annotations
+    }
+    diff = None
+    if expected_version is not None:
+        diff = diff_since(patient_id, study_id, series_name, conflict.annotations, conflict.version,
+                          expected_version)
+    if diff is not None:
+        payload['diff'] = diff
+    return _versioned(payload, conflict.version, 409)
+
 @bp.route('/api/annotations/<patient_id>/<study_id>/<series_name>', methods=['GET'])
 @login_required
 def get_annotations(patient_id, study_id, series_name):
-    """Get all annotations for a specific series"""
-    annotations = get_series_annotations(patient_id, study_id, series_name)
-    return jsonify({'annotations': annotations})
+    """Get all annotations for a specific series, with the series version (also sent as ETag)"""
+    annotations, version = get_series_annotations_versioned(patient_id, study_id, series_name)
+    return _versioned({'annotations': annotations}, version)
 
 @bp.route('/api/annotations/<patient_id>/<study_id>/<series_name>', methods=['POST'])
 @login_required
@@ -46,6 +326,11 @@ def create_annotations(patient_id, study_id, series_name):
     
     annotations = data.get('annotations', [])
     
+    try:
+        expected_version = _expected_version(data)
+    except ValueError as e:
+        return jsonify({'error': f'Invalid version: {e}'}), 400
+    
     # Validate each annotation
     all_errors = []
     for i, annotation in enumerate(annotations):
@@ -63,16 +348,21 @@ def create_annotations(patient_id, study_id, series_name):
         }), 400
     
     # Save annotations
-    success = save_series_annotations(
-        patient_id, 
-        study_id, 
-        series_name, 
-        annotations, 
-        session['username']
-    )
+    try:
+        version = save_series_annotations(
+            patient_id, 
+            study_id, 
+            series_name, 
+            annotations, 
+            session['username'],
+            expected_version
+        )
+    except SeriesVersionConflict as conflict:
+        return _conflict(conflict, patient_id, study_id, series_name, expected_version)
     
-    if success:
-        return jsonify({'success': True, 'message': 'Annotations saved successfully'})
+    if version:
+        return _versioned({'success': True, 'message': 'Annotations saved successfully', 'annotations': annotations},
+                          version)
     else:
         return jsonify({'error': 'Failed to save annotations'}), 500
 
@@ -84,6 +374,11 @@ def add_single_annotation(patient_id, study_id, series_name):
     if not data:
         return jsonify({'error': 'No data provided'}), 400
     
+    try:
+        expected_version = _expected_version(data)
+    except ValueError as e:
+        return jsonify({'error': f'Invalid version: {e}'}), 400
+    
     # Validate the annotation
     errors = validate_annotation(data)
     if errors:
@@ -93,32 +388,96 @@ def add_single_annotation(patient_id, study_id, series_name):
         }), 400
     
     # Add the annotation
-    success = add_annotation(
-        patient_id, 
-        study_id, 
-        series_name, 
-        data, 
-        session['username']
-    )
+    try:
+        result = add_annotation(
+            patient_id, 
+            study_id, 
+            series_name, 
+            data, 
+            session['username'],
+            expected_version
+        )
+    except SeriesVersionConflict as conflict:
+        return _conflict(conflict, patient_id, study_id, series_name, expected_version)
     
-    if success:
-        return jsonify({'success': True, 'message': 'Annotation added successfully'})
+    if result:
+        annotation, version = result
+        return _versioned({'success': True, 'message': 'Annotation added successfully', 'annotation': annotation},
+                          version)
     else:
         return jsonify({'error': 'Failed to add annotation'}), 500
 
+@bp.route('/api/annotations/<patient_id>/<study_id>/<series_name>/<annotation_id>', methods=['PATCH'])
+@login_required
+def edit_annotation(patient_id, study_id, series_name, annotation_id):
+    """Change fields of a single annotation"""
+    data = request.json
+    if not data:
+        return jsonify({'error': 'No data provided'}), 400
+    
+    try:
+        expected_version = _expected_version(data)
+    except ValueError as e:
+        return jsonify({'error': f'Invalid version: {e}'}), 400
+    
+    current = get_annotation(patient_id, study_id, series_name, annotation_id)
+    if current is None:
+        return jsonify({'error': 'Annotation not found'}), 404
+    
+    # Validate the annotation as it will be after the change
+    errors = validate_annotation({**current, **data})
+    if errors:
+        return jsonify({
+            'error': 'Invalid annotation data',
+            'validation_errors': errors
+        }), 400
+    
+    try:
+        result = update_annotation(
+            patient_id, 
+            study_id, 
+            series_name, 
+            annotation_id, 
+            data, 
+            session['username'],
+            expected_version
+        )
+    except SeriesVersionConflict as conflict:
+        return _conflict(conflict, patient_id, study_id, series_name, expected_version)
+    
+    if result:
+        annotation, version = result
+        return _versioned({'success': True, 'message': 'Annotation updated successfully', 'annotation': annotation},
+                          version)
+    elif result is None:
+        return jsonify({'error': 'Annotation not found'}), 404
+    else:
+        return jsonify({'error': 'Failed to update annotation'}), 500
+
 @bp.route('/api/annotations/<patient_id>/<study_id>/<series_name>/<annotation_id>', methods=['DELETE'])
 @login_required
 def remove_annotation(patient_id, study_id, series_name, annotation_id):
     """Delete a single annotation from a series"""
-    success = delete_annotation(
-        patient_id, 
-        study_id, 
-        series_name, 
-        annotation_id, 
-        session['username']
-    )
+    try:
+        expected_version = _expected_version()
+    except ValueError as e:
+        return jsonify({'error': f'Invalid version: {e}'}), 400
+    
+    try:
+        version = delete_annotation(
+            patient_id, 
+            study_id, 
+            series_name, 
+            annotation_id, 
+            session['username'],
+            expected_version
+        )
+    except SeriesVersionConflict as conflict:
+        return _conflict(conflict, patient_id, study_id, series_name, expected_version)
     
-    if success:
-        return jsonify({'success': True, 'message': 'Annotation deleted successfully'})
+    if version:
+        return _versioned({'success': True, 'message': 'Annotation deleted successfully'}, version)
+    elif version is None:
+        return jsonify({'error': 'Annotation not found'}), 404
     else:
         return jsonify({'error': 'Failed to delete annotation'}), 500
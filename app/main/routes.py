@@ -2,6 +2,7 @@ from flask import render_template, redirect, url_for, request, jsonify, current_
 from app.main import bp
 from app.auth.utils import login_required
 from app.utils.spinenet_utils import get_spinenet_findings_for_study, get_finding_description
+from app.utils.prerender import get_prerender_service, prerender_patients, prerender_study
 from app.main.utils import (
     get_random_patients_for_annotation,
     get_patient_studies,
@@ -10,8 +11,7 @@ from app.main.utils import (
     get_study_annotation_status,
     update_patient_annotation_status,
     update_study_annotation_status,
-    check_and_update_study_status,
-    check_and_update_patient_status,
+    update_annotation_statuses,
     get_dicom_preview,
     get_series_info,
     STATUS_NOT_ANNOTATED,
@@ -19,6 +19,14 @@ from app.main.utils import (
     STATUS_COMPLETE
 )
 
+def _get_request_window():
+    """Get an explicit (center, width) display window from the wc/ww query parameters"""
+    center = request.args.get('wc', type=float)
+    width = request.args.get('ww', type=float)
+    if center is None or width is None or width <= 0:
+        return None
+    return center, width
+
 @bp.route('/')
 def index():
     """Redirect to dashboard if logged in, otherwise to login page"""
@@ -44,6 +52,9 @@ def dashboard():
         patients = get_random_patients_for_annotation(count=patient_count)
         # Store in session for persistence
         session['selected_patients'] = patients
+        
+        # Warm the render cache for the newly selected patients in the background
+        prerender_patients(patients)
     
     # Get detailed information about each patient
     patient_data = []
@@ -72,10 +83,7 @@ def patient_detail(patient_id):
         flash(f"Patient {patient_id} not found or has no MRI studies.", "warning")
         return redirect(url_for('main.dashboard'))
     
-    # Check and update patient status based on actual annotations
-    check_and_update_patient_status(patient_id, session['username'])
-    
-    # Get updated patient status
+    # Statuses are kept current by annotation writes; page views only read them
     patient_status = get_patient_annotation_status(patient_id)
     
     # For each study, get information about series and status
@@ -83,9 +91,6 @@ def patient_detail(patient_id):
     for study in studies:
         study_id = study['id']
         
-        # Check and update study status based on actual annotations
-        check_and_update_study_status(patient_id, study_id, session['username'])
-        
         series_list = get_study_series(patient_id, study_id)
         study_status = get_study_annotation_status(patient_id, study_id)
         
@@ -114,10 +119,10 @@ def study_detail(patient_id, study_id):
         flash(f"Study {study_id} not found or has no MRI series.", "warning")
         return redirect(url_for('main.patient_detail', patient_id=patient_id))
     
-    # Check and update study status based on actual annotations
-    check_and_update_study_status(patient_id, study_id, session['username'])
+    # The user is about to open these series; render them ahead of other queued work
+    prerender_study(patient_id, study_id)
     
-    # Get updated study status
+    # Statuses are kept current by annotation writes; page views only read them
     study_status = get_study_annotation_status(patient_id, study_id)
     
     # Study date information
@@ -132,16 +137,16 @@ def study_detail(patient_id, study_id):
     # For each series, get information and sample image
     series_data = []
     
-    # Import annotation functions
-    from app.models.annotation import get_series_annotations
+    # Annotation counts come from the per-study summary, not the annotation lists
+    from app.models.annotation import get_study_annotation_summary
+    annotation_summary = get_study_annotation_summary(patient_id, study_id)
     
     for series_name in series_list:
         dicom_count, sample_path = get_dicom_preview([patient_id, study_id, series_name])
         series_info = get_series_info(patient_id, study_id, series_name)
         
         # Get number of annotations for this series
-        series_annotations = get_series_annotations(patient_id, study_id, series_name)
-        annotation_count = len(series_annotations)
+        annotation_count = annotation_summary['series'].get(series_name, {}).get('total', 0)
         
         series_data.append({
             'name': series_name,
@@ -204,15 +209,51 @@ def update_study_status():
     update_study_annotation_status(patient_id, study_id, status, session['username'])
     return jsonify({'success': True})
 
+@bp.route('/api/update_statuses', methods=['POST'])
+@login_required
+def update_statuses():
+    """
+    API endpoint to update many patient and study statuses at once
+    
+    Expects {"updates": [{"patient_id", "status", "study_id" (optional)}, ...]}.
+    All updates are applied in a single status store transaction, or none of
+    them if any is invalid.
+    """
+    data = request.json
+    if not isinstance(data, dict) or not isinstance(data.get('updates'), list):
+        return jsonify({'error': 'Invalid request data'}), 400
+    
+    updates = data['updates']
+    
+    # Validate every update before applying any
+    all_errors = []
+    for i, update in enumerate(updates):
+        if not isinstance(update, dict) or not update.get('patient_id') or not update.get('status'):
+            all_errors.append({'index': i, 'error': 'Missing required fields'})
+        elif (not isinstance(update['patient_id'], str) or not isinstance(update['status'], str)
+              or not isinstance(update.get('study_id') or '', str)):
+            all_errors.append({'index': i, 'error': 'patient_id, study_id and status must be strings'})
+        elif update['status'] not in [STATUS_NOT_ANNOTATED, STATUS_PARTIAL, STATUS_COMPLETE]:
+            all_errors.append({'index': i, 'error': 'Invalid status value'})
+    
+    if all_errors:
+        return jsonify({
+            'error': 'Invalid status updates',
+            'validation_errors': all_errors
+        }), 400
+    
+    patients = update_annotation_statuses(updates, session['username'])
+    return jsonify({'success': True, 'updated': len(updates), 'patients': patients})
+
 @bp.route('/dicom/<path:dicom_path>')
 @login_required
 def serve_dicom(dicom_path):
-    """Serve a DICOM file as a JPEG image"""
+    """Serve a DICOM file as a JPEG image, optionally windowed with the wc/ww query parameters"""
     from flask import send_file
     import io
     
     try:
-        image_bytes = get_dicom_preview(dicom_path, as_bytes=True)
+        image_bytes = get_dicom_preview(dicom_path, as_bytes=True, window=_get_request_window())
         if not image_bytes:
             abort(404)
             
@@ -226,6 +267,103 @@ def serve_dicom(dicom_path):
         current_app.logger.error(f"Error serving DICOM image: {e}")
         abort(404)
 
+@bp.route('/dicom-series/<patient_id>/<study_id>/<series_name>')
+@login_required
+def serve_dicom_series(patient_id, study_id, series_name):
+    """Stream every slice of a series as JPEGs in a single series bundle response
+    
+    Accepts the same wc/ww window query parameters as serve_dicom.
+    """
+    from flask import Response, stream_with_context
+    from app.main.utils import get_dicom_files, iter_series_bundle
+    
+    dicom_files = get_dicom_files(patient_id, study_id, series_name)
+    if not dicom_files:
+        abort(404)
+    
+    # Let the pre-render workers fill the cache ahead of this request
+    service = get_prerender_service()
+    if service is not None:
+        service.prioritize(patient_id, study_id, series_name)
+    
+    response = Response(
+        stream_with_context(iter_series_bundle(patient_id, study_id, series_name, dicom_files,
+                                               window=_get_request_window())),
+        mimetype='application/octet-stream'
+    )
+    response.headers['X-Slice-Count'] = str(len(dicom_files))
+    response.headers['Cache-Control'] = 'private, no-transform'
+    return response
+
+@bp.route('/api/dicom-volume/<patient_id>/<study_id>/<series_name>')
+@login_required
+def serve_dicom_volume(patient_id, study_id, series_name):
+    """Stream a series as a raw 16-bit volume for client-side window/level"""
+    from flask import Response, stream_with_context
+    from app.main.utils import get_dicom_files, build_volume_header, iter_series_volume
+    
+    dicom_files = get_dicom_files(patient_id, study_id, series_name)
+    if not dicom_files:
+        abort(404)
+    
+    try:
+        header = build_volume_header(patient_id, study_id, series_name, dicom_files)
+    except Exception as e:
+        current_app.logger.error(f"Error reading volume header: {e}")
+        abort(404)
+    
+    return Response(
+        stream_with_context(iter_series_volume(patient_id, study_id, series_name, header)),
+        mimetype='application/octet-stream',
+        headers={'Cache-Control': 'private, no-transform'}
+    )
+
+@bp.route('/api/render-cache/stats')
+@login_required
+def render_cache_stats():
+    """API endpoint to report render cache hit/miss counters and size"""
+    from app.utils.render_cache import get_render_cache
+    
+    return jsonify(get_render_cache().stats())
+
+@bp.route('/api/prerender/stats')
+@login_required
+def prerender_stats():
+    """API endpoint to report the state of the background pre-render queue"""
+    service = get_prerender_service()
+    if service is None:
+        return jsonify({'enabled': False})
+    
+    stats = service.stats()
+    stats['enabled'] = True
+    return jsonify(stats)
+
+@bp.route('/api/watcher/stats')
+@login_required
+def watcher_stats():
+    """API endpoint to report archive watcher backlog and lag"""
+    import json
+    from app.utils.catalog import get_catalog
+    
+    watcher = current_app.extensions.get('archive_watcher')
+    if watcher is not None:
+        return jsonify(watcher.stats())
+    
+    # The watcher may run in another process; report the metrics it last stored
+    catalog = get_catalog()
+    stored = catalog.get_meta('watcher_stats') if catalog is not None else None
+    if not stored:
+        return jsonify({'mode': None, 'message': 'Archive watcher is not running'})
+    return jsonify(json.loads(stored))
+
+@bp.route('/api/status-store/stats')
+@login_required
+def status_store_stats():
+    """API endpoint to report the status store backend, read cache counters and journal size"""
+    from app.utils.status_store import get_status_store
+    
+    return jsonify(get_status_store().stats())
+
 @bp.route('/api/debug/spinenet')
 @login_required
 def debug_spinenet():
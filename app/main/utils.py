@@ -1,44 +1,144 @@
 import os
 import json
-import random
+import struct
 from datetime import datetime
 from flask import current_app
 import pydicom
+from pydicom.multival import MultiValue
+from app.utils.render_cache import get_render_cache
+from app.utils.catalog import get_catalog, ensure_catalogued
+from app.utils.dicom_header import read_dicom_header, SERIES_INFO_TAGS, VOLUME_HEADER_TAGS, VALIDATION_TAGS
+from app.utils.windowing import apply_window, get_default_window, get_series_stats, series_stats_signature
+from app.utils.work_pool import IncompletePatientPool
+from app.utils.status_store import get_status_store
 
 # Status constants
 STATUS_NOT_ANNOTATED = 'not_annotated'
 STATUS_PARTIAL = 'partially_annotated'
 STATUS_COMPLETE = 'completed'
 
+# Rendering defaults; bump RENDER_VERSION whenever _dicom_to_jpg output changes
+# so that previously cached renders are not served any more
+RENDER_VERSION = 3
+PREVIEW_WIDTH = 300
+JPEG_QUALITY = 90
+
+# Magic prefix of the series bundle stream produced by iter_series_bundle
+SERIES_BUNDLE_MAGIC = b'DSB1'
+
+# Pixel data in raw volume streams starts at a multiple of this many bytes,
+# so clients can view it directly as a typed array
+VOLUME_DATA_ALIGNMENT = 8
+
 def get_annotation_status():
-    """Load the annotation status from JSON file"""
-    status_file = current_app.config['ANNOTATION_STATUS_FILE']
+    """Load the full annotation status from the configured status store"""
+    return get_status_store().load_all()
+
+def save_annotation_status(status_data):
+    """Replace the full annotation status in the configured status store"""
+    get_status_store().replace_all(status_data)
+    _update_incomplete_pool(None)
+
+def _update_status(patient_ids, mutate):
+    """
+    Modify the status entries of some patients in one store transaction
     
-    # Create directory if it doesn't exist
-    os.makedirs(os.path.dirname(status_file), exist_ok=True)
+    Args:
+        patient_ids: IDs of the patients mutate may read or change
+        mutate: Callable receiving {patient_id: entry} for the patients that
+                have a status entry (see StatusStore.update)
     
-    if os.path.exists(status_file):
-        try:
-            with open(status_file, 'r') as f:
-                return json.load(f)
-        except json.JSONDecodeError:
-            current_app.logger.error(f"Error decoding JSON from {status_file}")
-            return {}
-    return {}
+    Returns:
+        The return value of mutate
+    """
+    statuses = {}
+    
+    def apply(entries):
+        result = mutate(entries)
+        statuses.update({p: entries[p]['status'] if p in entries else None for p in patient_ids})
+        return result
+    
+    signatures = {}
+    result = get_status_store().update(patient_ids, apply, signatures=signatures)
+    _update_incomplete_pool(statuses, signatures)
+    return result
 
-def save_annotation_status(status_data):
-    """Save the annotation status to JSON file"""
-    status_file = current_app.config['ANNOTATION_STATUS_FILE']
+def _get_built_catalog():
+    """Get the archive catalog, or None while it is disabled or its first full refresh has not finished"""
+    catalog = get_catalog()
+    return catalog if catalog is not None and catalog.is_built() else None
+
+def _patient_list_signature():
+    """Value that changes whenever patients are added to or removed from the archive"""
+    catalog = _get_built_catalog()
+    if catalog is not None:
+        return catalog.directory_mtime('')
+    try:
+        return os.stat(current_app.config['MRI_ROOT_DIR']).st_mtime_ns
+    except OSError:
+        return None
+
+def get_incomplete_patient_pool():
+    """
+    Get the pool of patients that still need annotation
+    
+    The pool is built once from the patient list and the status store, then
+    kept current by the status updates of this process. It is rebuilt only
+    when the store or the patient list was changed by something else (another
+    worker process, an edit on disk, patients added to the archive).
+    """
+    signature = (get_status_store().signature(), _patient_list_signature())
+    pool = current_app.extensions.get('incomplete_patient_pool')
+    if pool is not None and pool.signature == signature:
+        return pool
+    
+    statuses = get_status_store().patient_statuses()
+    pool = IncompletePatientPool(
+        (p for p in get_patient_list() if statuses.get(p) != STATUS_COMPLETE),
+        signature=signature
+    )
+    current_app.extensions['incomplete_patient_pool'] = pool
+    return pool
+
+def _update_incomplete_pool(statuses, signatures=None):
+    """
+    Apply a status write made by this process to the incomplete patient pool
+    
+    Args:
+        statuses: {patient_id: new status, or None if the entry was removed},
+                  or None to have the pool rebuilt on its next use
+        signatures: Store signatures just before and after the write, as
+                    filled in by StatusStore.update
+    """
+    pool = current_app.extensions.get('incomplete_patient_pool')
+    if pool is None:
+        return
+    if statuses is None or not signatures or pool.signature[0] != signatures['before']:
+        # The pool does not reflect the store as it was right before this
+        # write (another process wrote since it was built); rebuild it
+        current_app.extensions.pop('incomplete_patient_pool', None)
+        return
     
-    # Create directory if it doesn't exist
-    os.makedirs(os.path.dirname(status_file), exist_ok=True)
+    mri_root = current_app.config['MRI_ROOT_DIR']
+    for patient_id, status in statuses.items():
+        if status == STATUS_COMPLETE:
+            pool.discard(patient_id)
+        elif os.path.isdir(os.path.join(mri_root, patient_id)):
+            pool.add(patient_id)
+        else:
+            pool.discard(patient_id)
     
-    with open(status_file, 'w') as f:
-        json.dump(status_data, f, indent=2)
+    # Only this write moved the store signature; the patient list is unaffected
+    pool.signature = (signatures['after'], pool.signature[1])
 
 def get_patient_list():
     """Get a list of all patient IDs from the MRI root directory"""
     mri_root = current_app.config['MRI_ROOT_DIR']
+    status_dir_name = os.path.basename(os.path.dirname(current_app.config['ANNOTATION_STATUS_FILE']))
+    
+    catalog = _get_built_catalog()
+    if catalog is not None:
+        return [d for d in catalog.list_patients() if d != status_dir_name]
     
     if not os.path.exists(mri_root):
         current_app.logger.warning(f"MRI root directory does not exist: {mri_root}")
@@ -47,21 +147,28 @@ def get_patient_list():
     return [d for d in os.listdir(mri_root) 
             if os.path.isdir(os.path.join(mri_root, d)) and 
             not d.startswith('.') and
-            d != os.path.basename(os.path.dirname(current_app.config['ANNOTATION_STATUS_FILE']))]
+            d != status_dir_name]
 
 def get_patient_studies(patient_id):
     """Get all MRI studies for a specific patient (folders named YYYYMMDD_MR)"""
     patient_dir = os.path.join(current_app.config['MRI_ROOT_DIR'], patient_id)
+    catalog = _get_built_catalog()
     
-    if not os.path.exists(patient_dir):
+    if not (ensure_catalogued(catalog, patient_id) if catalog is not None else os.path.exists(patient_dir)):
         current_app.logger.warning(f"Patient directory does not exist: {patient_dir}")
         return []
     
+    if catalog is not None:
+        study_ids = catalog.list_studies(patient_id)
+    else:
+        study_ids = [d for d in os.listdir(patient_dir)
+                     if os.path.isdir(os.path.join(patient_dir, d))]
+    
     # Get folders matching the pattern YYYYMMDD_MR
     studies = []
-    for d in os.listdir(patient_dir):
+    for d in study_ids:
         study_path = os.path.join(patient_dir, d)
-        if os.path.isdir(study_path) and is_valid_study_folder(d):
+        if is_valid_study_folder(d):
             study_date = parse_study_date(d)
             studies.append({
                 'id': d,
@@ -104,46 +211,41 @@ def format_study_date(date_obj):
 def get_study_series(patient_id, study_id):
     """Get all MRI series for a specific study"""
     study_dir = os.path.join(current_app.config['MRI_ROOT_DIR'], patient_id, study_id)
+    catalog = _get_built_catalog()
     
-    if not os.path.exists(study_dir):
+    if not (ensure_catalogued(catalog, patient_id, study_id) if catalog is not None else os.path.exists(study_dir)):
         current_app.logger.warning(f"Study directory does not exist: {study_dir}")
         return []
     
+    if catalog is not None:
+        return catalog.list_series(patient_id, study_id)
+    
     return [d for d in os.listdir(study_dir) 
             if os.path.isdir(os.path.join(study_dir, d))]
 
 def get_dicom_files(patient_id, study_id, series_name):
-    """Get list of DICOM files for a specific series in a study"""
+    """Get list of DICOM files for a specific series in a study (in InstanceNumber order when catalogued)"""
     series_dir = os.path.join(current_app.config['MRI_ROOT_DIR'], patient_id, study_id, series_name)
+    catalog = _get_built_catalog()
     
-    if not os.path.exists(series_dir):
+    if not (ensure_catalogued(catalog, patient_id, study_id, series_name) if catalog is not None else os.path.exists(series_dir)):
         current_app.logger.warning(f"Series directory does not exist: {series_dir}")
         return []
     
+    if catalog is not None:
+        return catalog.list_instances(patient_id, study_id, series_name)
+    
     return [f for f in os.listdir(series_dir) if f.lower().endswith('.dcm')]
 
 def get_random_patients_for_annotation(count=5):
-    """Get a list of random patients that need annotation"""
-    status_data = get_annotation_status()
-    patient_list = get_patient_list()
-    
-    # Filter patients that need annotation (not annotated or partially annotated)
-    patients_needing_work = [p for p in patient_list 
-                            if p not in status_data or 
-                            status_data[p]['status'] != STATUS_COMPLETE]
-    
-    # If we have fewer patients than requested, return all of them
-    if len(patients_needing_work) <= count:
-        return patients_needing_work
-    
-    # Otherwise, return a random selection
-    return random.sample(patients_needing_work, count)
+    """Get a list of random patients that need annotation (not annotated or partially annotated)"""
+    return get_incomplete_patient_pool().sample(count)
 
 def get_patient_annotation_status(patient_id):
     """Get the annotation status for a specific patient"""
-    status_data = get_annotation_status()
+    entry = get_status_store().get_patient(patient_id)
     
-    if patient_id not in status_data:
+    if entry is None:
         return {
             'status': STATUS_NOT_ANNOTATED,
             'annotated_by': None,
@@ -151,121 +253,203 @@ def get_patient_annotation_status(patient_id):
             'studies': {}
         }
     
-    return status_data[patient_id]
+    return entry
 
 def update_patient_annotation_status(patient_id, status, username):
     """Update the annotation status for a specific patient"""
-    status_data = get_annotation_status()
-    
-    # If this is a new patient entry, initialize with empty studies dict
-    if patient_id not in status_data:
-        status_data[patient_id] = {
-            'status': status,
-            'annotated_by': username,
-            'last_updated': datetime.now().isoformat(),
-            'studies': {}
-        }
-    else:
-        # Update existing entry
-        status_data[patient_id]['status'] = status
-        status_data[patient_id]['annotated_by'] = username
-        status_data[patient_id]['last_updated'] = datetime.now().isoformat()
-        
-        # Ensure studies dict exists
-        if 'studies' not in status_data[patient_id]:
-            status_data[patient_id]['studies'] = {}
+    def mutate(entries):
+        # If this is a new patient entry, initialize with empty studies dict
+        if patient_id not in entries:
+            entries[patient_id] = {
+                'status': status,
+                'annotated_by': username,
+                'last_updated': datetime.now().isoformat(),
+                'studies': {}
+            }
+        else:
+            # Update existing entry
+            entries[patient_id]['status'] = status
+            entries[patient_id]['annotated_by'] = username
+            entries[patient_id]['last_updated'] = datetime.now().isoformat()
+            
+            # Ensure studies dict exists
+            if 'studies' not in entries[patient_id]:
+                entries[patient_id]['studies'] = {}
     
-    save_annotation_status(status_data)
+    _update_status([patient_id], mutate)
 
 def update_study_annotation_status(patient_id, study_id, status, username):
     """Update the annotation status for a specific study"""
-    status_data = get_annotation_status()
-    
-    # Make sure patient exists in status data
-    if patient_id not in status_data:
-        status_data[patient_id] = {
-            'status': STATUS_PARTIAL,
+    def mutate(entries):
+        # Make sure patient exists in status data
+        if patient_id not in entries:
+            entries[patient_id] = {
+                'status': STATUS_PARTIAL,
+                'annotated_by': username,
+                'last_updated': datetime.now().isoformat(),
+                'studies': {}
+            }
+        
+        # Make sure studies dict exists
+        if 'studies' not in entries[patient_id]:
+            entries[patient_id]['studies'] = {}
+        
+        # Update the study status
+        entries[patient_id]['studies'][study_id] = {
+            'status': status,
             'annotated_by': username,
-            'last_updated': datetime.now().isoformat(),
-            'studies': {}
+            'last_updated': datetime.now().isoformat()
         }
+        
+        # Update overall patient status based on studies
+        entries[patient_id]['status'] = rollup_patient_status(entries[patient_id]['studies'])
+        
+        # Update last modified
+        entries[patient_id]['last_updated'] = datetime.now().isoformat()
+        entries[patient_id]['annotated_by'] = username
     
-    # Make sure studies dict exists
-    if 'studies' not in status_data[patient_id]:
-        status_data[patient_id]['studies'] = {}
+    _update_status([patient_id], mutate)
+    return True
+
+def update_annotation_statuses(updates, username):
+    """
+    Apply many patient and study status changes in one status store transaction
     
-    # Update the study status
-    status_data[patient_id]['studies'][study_id] = {
-        'status': status,
-        'annotated_by': username,
-        'last_updated': datetime.now().isoformat()
-    }
+    Study changes are applied first and each affected patient's status is
+    rolled up once afterwards; explicit patient-level changes are applied
+    last, so they win over the rollup.
     
-    # Update overall patient status based on studies
-    if all(study['status'] == STATUS_COMPLETE for study in status_data[patient_id]['studies'].values()):
-        status_data[patient_id]['status'] = STATUS_COMPLETE
-    elif any(study['status'] in [STATUS_PARTIAL, STATUS_COMPLETE] for study in status_data[patient_id]['studies'].values()):
-        status_data[patient_id]['status'] = STATUS_PARTIAL
-    else:
-        status_data[patient_id]['status'] = STATUS_NOT_ANNOTATED
+    Args:
+        updates: List of dicts with 'patient_id', 'status' and optionally
+                 'study_id' (study-level change when present)
+        username: User recorded as the annotator
     
-    # Update last modified
-    status_data[patient_id]['last_updated'] = datetime.now().isoformat()
-    status_data[patient_id]['annotated_by'] = username
+    Returns:
+        Sorted list of the affected patient IDs
+    """
+    patient_ids = sorted({u['patient_id'] for u in updates})
+    if not patient_ids:
+        return []
     
-    save_annotation_status(status_data)
-    return True
+    def mutate(entries):
+        now = datetime.now().isoformat()
+        
+        def entry_for(patient_id, initial_status):
+            if patient_id not in entries:
+                entries[patient_id] = {
+                    'status': initial_status,
+                    'annotated_by': username,
+                    'last_updated': now,
+                    'studies': {}
+                }
+            return entries[patient_id]
+        
+        rollup = set()
+        for update in updates:
+            if update.get('study_id'):
+                entry = entry_for(update['patient_id'], STATUS_PARTIAL)
+                entry.setdefault('studies', {})[update['study_id']] = {
+                    'status': update['status'],
+                    'annotated_by': username,
+                    'last_updated': now
+                }
+                rollup.add(update['patient_id'])
+        
+        for patient_id in rollup:
+            entry = entries[patient_id]
+            entry['status'] = rollup_patient_status(entry['studies'])
+            entry['annotated_by'] = username
+            entry['last_updated'] = now
+        
+        for update in updates:
+            if not update.get('study_id'):
+                entry = entry_for(update['patient_id'], update['status'])
+                entry.setdefault('studies', {})
+                entry['status'] = update['status']
+                entry['annotated_by'] = username
+                entry['last_updated'] = now
+        return patient_ids
+    
+    return _update_status(patient_ids, mutate)
 
-def check_and_update_study_status(patient_id, study_id, username):
-    """Check if study has any annotations and update its status accordingly"""
-    from app.models.annotation import get_all_patient_annotations
+def rollup_patient_status(studies):
+    """Derive a patient status from the statuses of its studies"""
+    if all(study['status'] == STATUS_COMPLETE for study in studies.values()):
+        return STATUS_COMPLETE
+    elif any(study['status'] in [STATUS_PARTIAL, STATUS_COMPLETE] for study in studies.values()):
+        return STATUS_PARTIAL
+    return STATUS_NOT_ANNOTATED
+
+def check_and_update_study_status(patient_id, study_id, username, has_annotations=None):
+    """
+    Derive a study's status from the presence of annotations and store it if it changed
     
-    # Get all annotations for the patient
-    all_annotations = get_all_patient_annotations(patient_id)
+    Called whenever annotations of the study are written; page views only read
+    the stored status. Only the study's own annotation files are inspected,
+    and the status store is not written when the derived status is unchanged.
     
-    # Check if this study has any annotations
-    study_has_annotations = False
-    if study_id in all_annotations and all_annotations[study_id]:
-        for series_name, annotations in all_annotations[study_id].items():
-            if annotations and len(annotations) > 0:
-                study_has_annotations = True
-                break
+    Args:
+        has_annotations: Whether the study has annotations, if the caller
+                         already knows; otherwise its annotation files are checked
+    """
+    if has_annotations is None:
+        from app.models.annotation import study_has_annotations
+        has_annotations = study_has_annotations(patient_id, study_id)
     
     # Update status based on annotation presence
-    if study_has_annotations:
-        new_status = STATUS_PARTIAL
-    else:
-        new_status = STATUS_NOT_ANNOTATED
+    new_status = STATUS_PARTIAL if has_annotations else STATUS_NOT_ANNOTATED
+    
+    current = get_patient_annotation_status(patient_id).get('studies', {}).get(study_id)
+    if current is not None and current['status'] == new_status:
+        return False
     
     # Update the study status
     return update_study_annotation_status(patient_id, study_id, new_status, username)
 
-def check_and_update_patient_status(patient_id, username):
-    """Check all studies for a patient and update patient status"""
-    status_data = get_annotation_status()
-    
-    if patient_id not in status_data or 'studies' not in status_data[patient_id]:
-        # No status data, nothing to update
-        return False
+def mark_studies_annotated(studies, username):
+    """
+    Bulk form of check_and_update_study_status for studies known to have annotations
     
-    # Get study statuses
-    studies = status_data[patient_id]['studies']
+    Studies whose stored status is not already partially annotated are set to
+    it, and their patients rolled up, in a single status store transaction.
     
-    # Determine patient status based on studies
-    if all(study['status'] == STATUS_COMPLETE for study in studies.values()):
-        new_status = STATUS_COMPLETE
-    elif any(study['status'] in [STATUS_PARTIAL, STATUS_COMPLETE] for study in studies.values()):
-        new_status = STATUS_PARTIAL
-    else:
-        new_status = STATUS_NOT_ANNOTATED
+    Args:
+        studies: Iterable of (patient_id, study_id)
     
-    # Update patient status
-    status_data[patient_id]['status'] = new_status
-    status_data[patient_id]['last_updated'] = datetime.now().isoformat()
-    status_data[patient_id]['annotated_by'] = username
+    Returns:
+        Sorted list of the affected patient IDs
+    """
+    store = get_status_store()
+    updates = []
+    entries = {}
+    for patient_id, study_id in sorted(set(studies)):
+        if patient_id not in entries:
+            entries[patient_id] = store.get_patient(patient_id) or {}
+        current = entries[patient_id].get('studies', {}).get(study_id)
+        if current is None or current['status'] != STATUS_PARTIAL:
+            updates.append({'patient_id': patient_id, 'study_id': study_id, 'status': STATUS_PARTIAL})
+    
+    return update_annotation_statuses(updates, username)
+
+def check_and_update_patient_status(patient_id, username):
+    """Recompute a patient's status from its study statuses and store it if it changed"""
+    def mutate(entries):
+        if patient_id not in entries or 'studies' not in entries[patient_id]:
+            # No status data, nothing to update
+            return False
+        
+        # Determine patient status based on studies
+        new_status = rollup_patient_status(entries[patient_id]['studies'])
+        if entries[patient_id]['status'] == new_status:
+            return False
+        
+        # Update patient status
+        entries[patient_id]['status'] = new_status
+        entries[patient_id]['last_updated'] = datetime.now().isoformat()
+        entries[patient_id]['annotated_by'] = username
+        return True
     
-    save_annotation_status(status_data)
-    return True
+    return _update_status([patient_id], mutate)
 
 def get_study_annotation_status(patient_id, study_id):
     """Get the annotation status for a specific study"""
@@ -280,7 +464,59 @@ def get_study_annotation_status(patient_id, study_id):
     
     return patient_status['studies'][study_id]
 
-def get_dicom_preview(path_components, as_bytes=False):
+def sync_status_with_archive(changes):
+    """
+    Apply studies and patients added to or removed from the archive to the annotation status
+    
+    Removed patients and studies are dropped from the status data. New studies
+    of patients that already have a status are recorded as not annotated, so
+    a completed patient who receives a new study needs work again.
+    
+    Args:
+        changes: The 'changes' dict of an ArchiveCatalog refresh
+        
+    Returns:
+        List of patient IDs whose status changed
+    """
+    patient_ids = set(changes.get('removed_patients', []))
+    patient_ids.update(p for p, _ in changes.get('removed_studies', []))
+    patient_ids.update(p for p, _ in changes.get('added_studies', []))
+    if not patient_ids:
+        return []
+    
+    def mutate(entries):
+        changed = set()
+        
+        for patient_id in changes.get('removed_patients', []):
+            if entries.pop(patient_id, None) is not None:
+                changed.add(patient_id)
+        
+        for patient_id, study_id in changes.get('removed_studies', []):
+            studies = entries.get(patient_id, {}).get('studies', {})
+            if studies.pop(study_id, None) is not None:
+                changed.add(patient_id)
+        
+        for patient_id, study_id in changes.get('added_studies', []):
+            if patient_id not in entries:
+                continue
+            studies = entries[patient_id].setdefault('studies', {})
+            if study_id not in studies:
+                studies[study_id] = {
+                    'status': STATUS_NOT_ANNOTATED,
+                    'annotated_by': None,
+                    'last_updated': datetime.now().isoformat()
+                }
+                changed.add(patient_id)
+        
+        for patient_id in changed:
+            if patient_id in entries and entries[patient_id].get('studies'):
+                entries[patient_id]['status'] = rollup_patient_status(entries[patient_id]['studies'])
+                entries[patient_id]['last_updated'] = datetime.now().isoformat()
+        return sorted(changed)
+    
+    return _update_status(sorted(patient_ids), mutate)
+
+def get_dicom_preview(path_components, as_bytes=False, window=None):
     """
     Get a preview image from a DICOM file
     
@@ -288,6 +524,7 @@ def get_dicom_preview(path_components, as_bytes=False):
         path_components: List or string with path components [patient_id, study_id, series_name, dicom_file]
                         or a path string relative to MRI_ROOT_DIR
         as_bytes: If True, return JPEG bytes, otherwise return DICOM count and sample path
+        window: Optional (center, width) display window for as_bytes, overriding the default
         
     Returns:
         If as_bytes=False: tuple of (dicom_count, sample_path)
@@ -317,13 +554,12 @@ def get_dicom_preview(path_components, as_bytes=False):
                 if not os.path.exists(full_path):
                     raise FileNotFoundError(f"DICOM file not found: {full_path}")
                 
-                # Read the DICOM file
-                ds = pydicom.dcmread(full_path)
-                
                 if as_bytes:
                     # Convert to an image and return as JPEG bytes
-                    return _dicom_to_jpg(ds)
+                    return render_dicom_file(full_path, window=window)
                 else:
+                    # Only check that the file is a readable DICOM
+                    read_dicom_header(full_path, VALIDATION_TAGS)
                     return 1, rel_path
             else:
                 # Series only - need to get a sample DICOM file
@@ -341,13 +577,12 @@ def get_dicom_preview(path_components, as_bytes=False):
                 if not os.path.exists(full_path):
                     raise FileNotFoundError(f"DICOM file not found: {full_path}")
                 
-                # Read the DICOM file
-                ds = pydicom.dcmread(full_path)
-                
                 if as_bytes:
                     # Convert to an image and return as JPEG bytes
-                    return _dicom_to_jpg(ds)
+                    return render_dicom_file(full_path, window=window)
                 else:
+                    # Only check that the file is a readable DICOM
+                    read_dicom_header(full_path, VALIDATION_TAGS)
                     return 1, os.path.join(patient_id, study_id, series_name, dicom_file)
             else:
                 # Series only - need to get a sample DICOM file
@@ -371,8 +606,7 @@ def get_dicom_preview(path_components, as_bytes=False):
         
         if as_bytes:
             # Read the DICOM file and convert to JPEG
-            ds = pydicom.dcmread(os.path.join(series_dir, sample_file))
-            return _dicom_to_jpg(ds)
+            return render_dicom_file(os.path.join(series_dir, sample_file), window=window)
         else:
             return len(dicom_files), sample_path
     
@@ -382,6 +616,145 @@ def get_dicom_preview(path_components, as_bytes=False):
             return b''
         return 0, None
 
+def iter_series_bundle(patient_id, study_id, series_name, dicom_files, width=PREVIEW_WIDTH, window=None):
+    """
+    Generate every rendered slice of a series as a single binary stream
+    
+    Slices are rendered (or read from the render cache) one at a time, so the
+    first slices reach the client while later ones are still being rendered.
+    
+    Layout (all integers big-endian):
+        4 bytes   magic 'DSB1'
+        uint32    number of slices
+        per slice, in the order of dicom_files:
+            uint16  length of the file name, followed by the UTF-8 file name
+            uint32  length of the JPEG data, followed by the JPEG data
+                    (0 if the slice could not be rendered)
+    
+    Args:
+        patient_id, study_id, series_name: Series location below MRI_ROOT_DIR
+        dicom_files: List of DICOM file names in the series, as returned by get_dicom_files
+        width: Width of the rendered JPEGs
+        window: Optional (center, width) display window, overriding the default
+    """
+    series_dir = os.path.join(current_app.config['MRI_ROOT_DIR'], patient_id, study_id, series_name)
+    
+    yield SERIES_BUNDLE_MAGIC + struct.pack('>I', len(dicom_files))
+    
+    for dicom_file in dicom_files:
+        try:
+            image_bytes = render_dicom_file(os.path.join(series_dir, dicom_file), width=width, window=window)
+        except Exception as e:
+            current_app.logger.error(f"Error rendering {dicom_file} for series bundle: {e}")
+            image_bytes = b''
+        
+        name = dicom_file.encode('utf-8')
+        yield struct.pack('>H', len(name)) + name + struct.pack('>I', len(image_bytes))
+        if image_bytes:
+            yield image_bytes
+
+def _first_value(value, default=None):
+    """Return the first item of a multi-valued DICOM element, or the value itself"""
+    if value is None:
+        return default
+    if isinstance(value, (list, tuple, MultiValue)):
+        return value[0] if len(value) else default
+    return value
+
+def build_volume_header(patient_id, study_id, series_name, dicom_files):
+    """
+    Build the JSON header describing a raw series volume
+    
+    The header is derived from the first slice of the series; all slices are
+    streamed with its dimensions and data type.
+    
+    Returns:
+        dict with shape [slices, rows, columns], dtype ('uint16' or 'int16'),
+        spacing [slice, row, column] in mm, rescale_slope, rescale_intercept,
+        the default window {'center', 'width'} (from the DICOM tags, or the
+        robust per-series statistics when the tags are missing), invert (true
+        for MONOCHROME1, displayed with low values white) and the ordered list
+        of file names
+    """
+    series_dir = os.path.join(current_app.config['MRI_ROOT_DIR'], patient_id, study_id, series_name)
+    ds = read_dicom_header(os.path.join(series_dir, dicom_files[0]), VOLUME_HEADER_TAGS)
+    
+    pixel_spacing = getattr(ds, 'PixelSpacing', None) or [1.0, 1.0]
+    slice_spacing = getattr(ds, 'SpacingBetweenSlices', None) or getattr(ds, 'SliceThickness', None) or 1.0
+    
+    window = None
+    window_center = _first_value(getattr(ds, 'WindowCenter', None))
+    window_width = _first_value(getattr(ds, 'WindowWidth', None))
+    if window_center is not None and window_width is not None:
+        window = {'center': float(window_center), 'width': float(window_width)}
+    else:
+        stats = get_series_stats(series_dir, dicom_files)
+        if stats:
+            window = {'center': stats['center'], 'width': stats['width']}
+    
+    return {
+        'shape': [len(dicom_files), int(ds.Rows), int(ds.Columns)],
+        'dtype': 'int16' if getattr(ds, 'PixelRepresentation', 0) == 1 else 'uint16',
+        'byte_order': 'little',
+        'spacing': [float(slice_spacing), float(pixel_spacing[0]), float(pixel_spacing[1])],
+        'rescale_slope': float(getattr(ds, 'RescaleSlope', 1) or 1),
+        'rescale_intercept': float(getattr(ds, 'RescaleIntercept', 0) or 0),
+        'window': window,
+        'invert': getattr(ds, 'PhotometricInterpretation', '') == 'MONOCHROME1',
+        'files': dicom_files
+    }
+
+def iter_series_volume(patient_id, study_id, series_name, header):
+    """
+    Generate a series as a raw little-endian 16-bit volume
+    
+    Layout:
+        uint32 (little-endian)  length of the JSON header
+        JSON header             see build_volume_header, space-padded so that the
+                                pixel data starts at a multiple of VOLUME_DATA_ALIGNMENT
+        pixel data              slices x rows x columns samples of header['dtype']
+    
+    Slices are decoded and sent one at a time. Uncompressed little-endian
+    16-bit pixel data is passed through as read from the file; other slices are
+    only converted where their decoded array does not already match the header.
+    Slices that fail to decode are sent as zeros so the volume keeps its shape.
+    """
+    import numpy as np
+    
+    series_dir = os.path.join(current_app.config['MRI_ROOT_DIR'], patient_id, study_id, series_name)
+    _, rows, columns = header['shape']
+    dtype = np.dtype('<i2' if header['dtype'] == 'int16' else '<u2')
+    slice_bytes = rows * columns * dtype.itemsize
+    
+    header_bytes = json.dumps(header).encode('utf-8')
+    padding = -(4 + len(header_bytes)) % VOLUME_DATA_ALIGNMENT
+    header_bytes += b' ' * padding
+    yield struct.pack('<I', len(header_bytes)) + header_bytes
+    
+    for dicom_file in header['files']:
+        try:
+            ds = pydicom.dcmread(os.path.join(series_dir, dicom_file))
+            transfer_syntax = ds.file_meta.TransferSyntaxUID
+            
+            if (not transfer_syntax.is_compressed and transfer_syntax.is_little_endian and
+                    ds.BitsAllocated == 16 and ds.SamplesPerPixel == 1 and
+                    int(ds.Rows) == rows and int(ds.Columns) == columns and
+                    len(ds.PixelData) >= slice_bytes):
+                # Stored pixel data already has the wire layout
+                pixel_data = ds.PixelData
+                yield pixel_data if len(pixel_data) == slice_bytes else pixel_data[:slice_bytes]
+                continue
+            
+            pixel_array = ds.pixel_array
+            if pixel_array.shape != (rows, columns):
+                raise ValueError(f"Slice shape {pixel_array.shape} does not match volume shape {(rows, columns)}")
+            if pixel_array.dtype != dtype or not pixel_array.flags['C_CONTIGUOUS']:
+                pixel_array = np.ascontiguousarray(pixel_array, dtype=dtype)
+            yield pixel_array.tobytes()
+        except Exception as e:
+            current_app.logger.error(f"Error reading {dicom_file} for raw volume: {e}")
+            yield bytes(slice_bytes)
+
 def get_series_info(patient_id, study_id, series_name):
     """Extract series information from DICOM tags"""
     series_dir = os.path.join(current_app.config['MRI_ROOT_DIR'], patient_id, study_id, series_name)
@@ -408,9 +781,9 @@ def get_series_info(patient_id, study_id, series_name):
         }
     
     try:
-        # Read the first DICOM file
+        # Read only the tags needed below from the first DICOM file
         dicom_path = os.path.join(series_dir, dicom_files[0])
-        ds = pydicom.dcmread(dicom_path)
+        ds = read_dicom_header(dicom_path, SERIES_INFO_TAGS)
         
         # Extract common tags
         series_description = getattr(ds, 'SeriesDescription', series_name)
@@ -505,8 +878,49 @@ def get_series_info(patient_id, study_id, series_name):
             'orientation': 'Unknown'
         }
 
-def _dicom_to_jpg(ds, width=300):
-    """Convert DICOM dataset to JPEG bytes"""
+def render_dicom_file(full_path, width=PREVIEW_WIDTH, window=None):
+    """
+    Render a DICOM file to JPEG bytes, using the render cache when enabled
+    
+    Renders are cached under the requested window ('default' when none is
+    given), so a cache hit reads neither the DICOM header nor the series
+    statistics; the default window is only resolved when rendering. Default
+    renders are also keyed on the series statistics signature, since the
+    statistics are recomputed when slices are added to the series.
+    
+    Args:
+        full_path: Absolute path of the DICOM file
+        width: Width of the rendered JPEG
+        window: Optional (center, width) display window; defaults to the
+                WindowCenter/WindowWidth tags or the per-series statistics
+    """
+    def render():
+        ds = pydicom.dcmread(full_path)
+        # MONOCHROME1 is displayed inverted whichever window is used
+        invert = getattr(ds, 'PhotometricInterpretation', '') == 'MONOCHROME1'
+        render_window = window
+        if render_window is None:
+            default_window = get_default_window(full_path)
+            if default_window:
+                render_window = default_window[:2]
+        return _dicom_to_jpg(ds, width=width, window=render_window, invert=invert)
+    
+    if not current_app.config.get('RENDER_CACHE_ENABLED', True):
+        return render()
+    
+    params = {
+        'format': 'jpeg',
+        'width': width,
+        'quality': JPEG_QUALITY,
+        'window': [round(window[0], 3), round(window[1], 3)] if window else 'default',
+        'version': RENDER_VERSION
+    }
+    if not window:
+        params['series_stats'] = series_stats_signature(os.path.dirname(full_path))
+    return get_render_cache().get_or_render(full_path, params, render)
+
+def _dicom_to_jpg(ds, width=PREVIEW_WIDTH, window=None, invert=False):
+    """Convert DICOM dataset to JPEG bytes, applying the (center, width) window if given"""
     import numpy as np
     from PIL import Image
     import io
@@ -515,18 +929,23 @@ def _dicom_to_jpg(ds, width=300):
     try:
         # Get the pixel array
         pixel_array = ds.pixel_array
+        is_color = len(pixel_array.shape) == 3 and pixel_array.shape[2] == 3
         
-        # Normalize to 0-255 for display
-        if pixel_array.dtype != np.uint8:
-            pixel_min = pixel_array.min()
-            pixel_max = pixel_array.max()
-            if pixel_max == pixel_min:
-                pixel_array = np.zeros_like(pixel_array)
+        # Map to 0-255 for display through the window lookup table
+        if not is_color and (window is not None or pixel_array.dtype != np.uint8):
+            if window is None:
+                # No window available: stretch between the slice's own min and max
+                pixel_min = float(pixel_array.min())
+                pixel_max = float(pixel_array.max())
+                window = ((pixel_min + pixel_max) / 2, max(pixel_max - pixel_min, 1))
+                slope, intercept = 1.0, 0.0
             else:
-                pixel_array = (((pixel_array - pixel_min) / (pixel_max - pixel_min)) * 255).astype(np.uint8)
+                slope = float(getattr(ds, 'RescaleSlope', 1) or 1)
+                intercept = float(getattr(ds, 'RescaleIntercept', 0) or 0)
+            pixel_array = apply_window(pixel_array, window[0], window[1], slope, intercept, invert)
         
         # Create PIL Image
-        if len(pixel_array.shape) == 3 and pixel_array.shape[2] == 3:
+        if is_color:
             # Color image
             img = Image.fromarray(pixel_array)
         else:
@@ -540,10 +959,10 @@ def _dicom_to_jpg(ds, width=300):
         
         # Convert to JPEG in memory
         img_byte_arr = io.BytesIO()
-        img.save(img_byte_arr, format='JPEG', quality=90)
+        img.save(img_byte_arr, format='JPEG', quality=JPEG_QUALITY)
         return img_byte_arr.getvalue()
     
     except Exception as e:
         current_app.logger.error(f"Error converting DICOM to JPEG: {e}")
         # Return empty bytes
-        return b''
\ No newline at end of file
+        return b''
@@ -1,7 +1,7 @@
-import os
-import json
+import sqlite3
 from datetime import datetime
 from flask import current_app
+from app.models.annotation_store import FileAnnotationStore, SeriesVersionConflict, check_version, get_annotation_store
 
 # Define the constants for annotation types
 ANNOTATION_TYPES = {
@@ -56,126 +56,386 @@ VERTEBRAL_LEVELS = [
 SIDE_OPTIONS = ['left', 'right', 'bilateral']
 
 def get_annotations_file_path(patient_id, study_id, series_name):
-    """Get the path to the annotations JSON file for a specific series"""
-    # Create a nested structure: patient_id/study_id/series_name.json
-    annotations_dir = os.path.join(current_app.config['ANNOTATION_DATA_DIR'], patient_id, study_id)
-    
-    # Create directory if it doesn't exist
-    os.makedirs(annotations_dir, exist_ok=True)
-    
-    # Return the path to the series-specific annotations file
-    return os.path.join(annotations_dir, f"{series_name}.json")
+    """Get the path to the annotations JSON file for a specific series (file backend layout)"""
+    return FileAnnotationStore(current_app.config['ANNOTATION_DATA_DIR']).series_path(patient_id, study_id, series_name)
 
 def get_series_annotations(patient_id, study_id, series_name):
     """Get all annotations for a specific series"""
-    file_path = get_annotations_file_path(patient_id, study_id, series_name)
-    
-    if not os.path.exists(file_path):
-        return []
-    
+    return get_annotation_store().get_series(patient_id, study_id, series_name)
+
+def get_annotation(patient_id, study_id, series_name, annotation_id):
+    """Get a single annotation of a series by ID, or None if there is none"""
+    return get_annotation_store().get_annotation(patient_id, study_id, series_name, annotation_id)
+
+def get_series_annotations_versioned(patient_id, study_id, series_name):
+    """Get all annotations for a specific series with the series version, as (annotations, version)"""
+    return get_annotation_store().get_series_versioned(patient_id, study_id, series_name)
+
+# Fields set by the server; edits of an annotation never change them
+METADATA_FIELDS = ('id', 'created_by', 'created_at', 'updated_by', 'updated_at')
+
+def _content(annotation):
+    """An annotation without its server-set metadata"""
+    return {key: value for key, value in annotation.items() if key not in METADATA_FIELDS}
+
+def diff_annotations(base, current):
+    """
+    Compare two versions of a series' annotation list by annotation ID
+
+    Returns:
+        {'added': annotations only in current, 'removed': IDs only in base,
+         'changed': annotations of current whose content differs from base}.
+        Annotations of base without an ID (not yet saved) are ignored.
+    """
+    base_by_id = {a['id']: a for a in base if a.get('id')}
+    current_ids = set()
+    diff = {'added': [], 'removed': [], 'changed': []}
+
+    for annotation in current:
+        previous = base_by_id.get(annotation.get('id'))
+        current_ids.add(annotation.get('id'))
+        if previous is None:
+            diff['added'].append(annotation)
+        elif _content(previous) != _content(annotation):
+            diff['changed'].append(annotation)
+
+    diff['removed'] = [annotation_id for annotation_id in base_by_id if annotation_id not in current_ids]
+    return diff
+
+def diff_since(patient_id, study_id, series_name, annotations, version, base_version):
+    """
+    What changed in a series since base_version, by annotation ID
+
+    The annotations at base_version are reconstructed from the current ones
+    by undoing the writes recorded in the audit log since then.
+
+    Returns:
+        diff_annotations(annotations at base_version, annotations), or None if
+        the audit log is disabled or does not cover every write since base_version
+    """
+    from app.models.annotation_audit import AuditHistoryGap, get_audit_log
+    audit_log = get_audit_log()
+    if audit_log is None:
+        return None
     try:
-        with open(file_path, 'r') as f:
-            return json.load(f)
-    except (json.JSONDecodeError, IOError) as e:
-        current_app.logger.error(f"Error loading annotations from {file_path}: {e}")
-        return []
-
-def save_series_annotations(patient_id, study_id, series_name, annotations, username):
-    """Save annotations for a specific series"""
-    file_path = get_annotations_file_path(patient_id, study_id, series_name)
-    
-    # Add metadata to each annotation if not present
+        base, _ = audit_log.state_at(patient_id, study_id, series_name, annotations, version,
+                                     at_version=base_version)
+    except (AuditHistoryGap, OSError) as e:
+        current_app.logger.info(f"No diff since version {base_version} of {patient_id}/{study_id}/{series_name}: {e}")
+        return None
+    return diff_annotations(base, annotations)
+
+def _update_study_status(patient_id, study_id, username, has_annotations=None):
+    # Every annotation write goes through here, so this is the one place the
+    # derived study and patient statuses need to be brought up to date
+    from app.main.utils import check_and_update_study_status
+    check_and_update_study_status(patient_id, study_id, username, has_annotations=has_annotations)
+
+def _update_index(apply):
+    """Apply an annotation write to the annotation index; if that fails, have the index rebuilt"""
+    from app.models.annotation_index import get_annotation_index
+    index = None
+    try:
+        index = get_annotation_index()
+        apply(index)
+    except sqlite3.Error as e:
+        current_app.logger.error(f"Error updating the annotation index: {e}")
+        if index is not None:
+            try:
+                index.invalidate()
+            except sqlite3.Error:
+                pass
+
+def _log_audit(write):
+    """Record an annotation write in the audit log; a failure is logged but never fails the write"""
+    from app.models.annotation_audit import get_audit_log
+    try:
+        audit_log = get_audit_log()
+        if audit_log is not None:
+            write(audit_log)
+    except OSError as e:
+        current_app.logger.error(f"Error writing the annotation audit log: {e}")
+
+# Number of times a full-list save without an expected version is retried before a series that keeps changing makes it fail
+SAVE_ATTEMPTS = 5
+
+def _stamp_metadata(annotations, base, username):
+    """Copies of annotations with metadata carried over from base, the stored list they replace"""
+    stored = {a.get('id'): a for a in base if a.get('id')}
+    now = datetime.now().isoformat()
+    stamped = []
     for annotation in annotations:
+        annotation = dict(annotation)
+        stamped.append(annotation)
+        previous = stored.get(annotation.get('id'))
+        if previous is not None and _content(previous) == _content(annotation):
+            for field in METADATA_FIELDS:
+                if field in previous:
+                    annotation[field] = previous[field]
+            continue
+
         if 'created_by' not in annotation:
-            annotation['created_by'] = username
+            annotation['created_by'] = previous.get('created_by', username) if previous else username
         if 'created_at' not in annotation:
-            annotation['created_at'] = datetime.now().isoformat()
-        
+            annotation['created_at'] = previous.get('created_at', now) if previous else now
         annotation['updated_by'] = username
-        annotation['updated_at'] = datetime.now().isoformat()
+        annotation['updated_at'] = now
+    return stamped
+
+def save_series_annotations(patient_id, study_id, series_name, annotations, username, expected_version=None):
+    """
+    Replace the annotations of a series
+
+    Annotations without an ID get the series' next free IDs. Only annotations
+    that are new or whose content changed are stamped with updated_by and
+    updated_at; the others keep their stored metadata. The annotations list
+    is updated in place with the IDs and metadata saved.
+
+    The stored series is read first, and the save is made conditional on the
+    version read, so the metadata and the audit log entry are based on
+    exactly the list the save replaced. Without an expected_version, a save
+    that another write got in ahead of is retried from a fresh read.
+
+    Returns:
+        The new series version, or False if the write failed
+
+    Raises:
+        SeriesVersionConflict: expected_version is given and the series is at
+            another version, or the series kept changing for SAVE_ATTEMPTS tries
+    """
+    store = get_annotation_store()
+    for attempt in range(SAVE_ATTEMPTS):
+        base, base_version = store.get_series_versioned(patient_id, study_id, series_name)
+        check_version(expected_version, base_version, base)
+        stamped = _stamp_metadata(annotations, base, username)
+        try:
+            version = store.save_series(patient_id, study_id, series_name, stamped, base_version)
+            break
+        except SeriesVersionConflict:
+            if attempt == SAVE_ATTEMPTS - 1:
+                raise
+        except (IOError, sqlite3.Error) as e:
+            current_app.logger.error(f"Error saving annotations for {patient_id}/{study_id}/{series_name}: {e}")
+            return False
+    annotations[:] = stamped
     
+    _update_index(lambda index: index.replace_series(patient_id, study_id, series_name, annotations, version))
+    _log_audit(lambda audit_log: audit_log.log_save(patient_id, study_id, series_name, base, base_version,
+                                                    annotations, version, username))
+    _update_study_status(patient_id, study_id, username, has_annotations=True if annotations else None)
+    return version
+
+def add_annotation(patient_id, study_id, series_name, annotation_data, username, expected_version=None):
+    """
+    Add a single annotation to a series
+
+    Returns:
+        (annotation, version) with the stored annotation including its new ID,
+        or None if the write failed
+
+    Raises:
+        SeriesVersionConflict: expected_version is given and the series is at another version
+    """
+    now = datetime.now().isoformat()
+    annotation = _content(annotation_data)
+    annotation['created_by'] = username
+    annotation['created_at'] = now
+    annotation['updated_by'] = username
+    annotation['updated_at'] = now
+
     try:
-        with open(file_path, 'w') as f:
-            json.dump(annotations, f, indent=2)
-        return True
-    except IOError as e:
-        current_app.logger.error(f"Error saving annotations to {file_path}: {e}")
-        return False
+        annotation, version = get_annotation_store().insert(patient_id, study_id, series_name, annotation,
+                                                            expected_version)
+    except (IOError, sqlite3.Error) as e:
+        current_app.logger.error(f"Error adding annotation to {patient_id}/{study_id}/{series_name}: {e}")
+        return None
 
-def add_annotation(patient_id, study_id, series_name, annotation_data, username):
-    """Add a single annotation to a series"""
-    annotations = get_series_annotations(patient_id, study_id, series_name)
-    
-    # Add metadata
-    annotation_data['created_by'] = username
-    annotation_data['created_at'] = datetime.now().isoformat()
-    annotation_data['updated_by'] = username
-    annotation_data['updated_at'] = datetime.now().isoformat()
-    
-    # Add a unique ID for this annotation
-    annotation_data['id'] = str(len(annotations) + 1)
-    
-    # Add to list
-    annotations.append(annotation_data)
-    
-    # Save updated list
-    saved = save_series_annotations(patient_id, study_id, series_name, annotations, username)
-    
-    if saved:
-        # Update study status to partially annotated
-        from app.main.utils import update_study_annotation_status, STATUS_PARTIAL
-        update_study_annotation_status(patient_id, study_id, STATUS_PARTIAL, username)
-    
-    return saved
+    _update_index(lambda index: index.upsert(patient_id, study_id, series_name, [annotation], version))
+    _log_audit(lambda audit_log: audit_log.append('add', patient_id, study_id, series_name, version, username,
+                                                  a=[annotation]))
+    _update_study_status(patient_id, study_id, username, has_annotations=True)
+    return annotation, version
 
-def delete_annotation(patient_id, study_id, series_name, annotation_id, username):
-    """Delete a single annotation from a series"""
-    annotations = get_series_annotations(patient_id, study_id, series_name)
-    
-    # Find and remove the annotation with the given ID
-    annotations = [a for a in annotations if a.get('id') != annotation_id]
-    
-    # Save updated list
-    saved = save_series_annotations(patient_id, study_id, series_name, annotations, username)
-    
-    if saved:
-        # Check if there are any annotations left and update study status
-        from app.main.utils import check_and_update_study_status
-        check_and_update_study_status(patient_id, study_id, username)
+def update_annotation(patient_id, study_id, series_name, annotation_id, fields, username, expected_version=None):
+    """
+    Change fields of a single annotation; other annotations of the series are untouched
+
+    Returns:
+        (annotation, version) with the updated annotation, None if there is no
+        such annotation, or False if the write failed
+
+    Raises:
+        SeriesVersionConflict: expected_version is given and the series is at another version
+    """
+    changes = _content(fields)
+    changes['updated_by'] = username
+    changes['updated_at'] = datetime.now().isoformat()
+
+    try:
+        before, annotation, version = get_annotation_store().update(patient_id, study_id, series_name,
+                                                                    annotation_id, changes, expected_version)
+    except (IOError, sqlite3.Error) as e:
+        current_app.logger.error(f"Error updating annotation {annotation_id} in {patient_id}/{study_id}/{series_name}: {e}")
+        return False
+    if annotation is None:
+        return None
     
-    return saved
+    _update_index(lambda index: index.upsert(patient_id, study_id, series_name, [annotation], version))
+    _log_audit(lambda audit_log: audit_log.append(
+        'set', patient_id, study_id, series_name, version, username, id=annotation_id, new=changes,
+        old={field: before[field] for field in changes if field in before},
+        unset=[field for field in changes if field not in before]))
+    return annotation, version
+
+def delete_annotation(patient_id, study_id, series_name, annotation_id, username, expected_version=None):
+    """
+    Delete a single annotation from a series
+
+    Returns:
+        The new series version if it was deleted, None if there is no such
+        annotation, or False if the write failed
+
+    Raises:
+        SeriesVersionConflict: expected_version is given and the series is at another version
+    """
+    try:
+        removed, version = get_annotation_store().delete(patient_id, study_id, series_name, annotation_id,
+                                                         expected_version)
+    except (IOError, sqlite3.Error) as e:
+        current_app.logger.error(f"Error deleting annotation {annotation_id} from {patient_id}/{study_id}/{series_name}: {e}")
+        return False
+    if not removed:
+        return None
+
+    _update_index(lambda index: index.remove(patient_id, study_id, series_name, annotation_id, version))
+    _log_audit(lambda audit_log: audit_log.append('del', patient_id, study_id, series_name, version, username,
+                                                  rm=removed))
+    _update_study_status(patient_id, study_id, username)
+    return version
+
+# Keys of an import record that locate the series instead of describing the annotation
+IMPORT_LOCATION_FIELDS = ('patient_id', 'study_id', 'series_name')
+
+def _valid_path_component(value):
+    """Check that an ID can be used as a single directory or file name"""
+    return (isinstance(value, str) and value not in ('', '.', '..')
+            and '/' not in value and '\\' not in value)
+
+def validate_import_records(records):
+    """
+    Validate import records in one pass
+
+    Each record is an annotation plus the patient_id, study_id and
+    series_name it belongs to.
+
+    Returns:
+        (valid, errors): valid is a list of (patient_id, study_id, series_name,
+        annotation) for the records that passed, errors a list of
+        {'index', 'errors'} for the others
+    """
+    valid = []
+    errors = []
+    for index, record in enumerate(records):
+        if not isinstance(record, dict):
+            errors.append({'index': index, 'errors': ['Record is not an object']})
+            continue
+
+        record_errors = [f"Missing or invalid field: {field}" for field in IMPORT_LOCATION_FIELDS
+                         if not _valid_path_component(record.get(field))]
+        annotation = _content({key: value for key, value in record.items() if key not in IMPORT_LOCATION_FIELDS})
+        record_errors.extend(validate_annotation(annotation))
+
+        if record_errors:
+            errors.append({'index': index, 'errors': record_errors})
+        else:
+            valid.append((record['patient_id'], record['study_id'], record['series_name'], annotation))
+    return valid, errors
+
+def import_annotations(records, username, skip_invalid=False):
+    """
+    Add many annotations, writing each series once and updating statuses once
+
+    Records are validated up front (see validate_import_records). Unless
+    skip_invalid is set, any invalid record aborts the import before anything
+    is written. Valid records are grouped per series and appended with one
+    store write per series; the statuses of all touched studies are then
+    updated in a single status store transaction.
+
+    Returns:
+        Summary dict: imported (annotation count), series, studies, errors
+        (validation errors) and failed (series whose write failed)
+    """
+    valid, errors = validate_import_records(records)
+    summary = {'imported': 0, 'series': 0, 'studies': 0, 'errors': errors, 'failed': []}
+    if errors and not skip_invalid:
+        return summary
+
+    now = datetime.now().isoformat()
+    by_series = {}
+    for patient_id, study_id, series_name, annotation in valid:
+        annotation['created_by'] = username
+        annotation['created_at'] = now
+        annotation['updated_by'] = username
+        annotation['updated_at'] = now
+        by_series.setdefault((patient_id, study_id, series_name), []).append(annotation)
+
+    store = get_annotation_store()
+    studies = set()
+    for (patient_id, study_id, series_name), annotations in by_series.items():
+        try:
+            _, version = store.insert_many(patient_id, study_id, series_name, annotations)
+        except (IOError, sqlite3.Error) as e:
+            current_app.logger.error(f"Error importing annotations into {patient_id}/{study_id}/{series_name}: {e}")
+            summary['failed'].append({'patient_id': patient_id, 'study_id': study_id, 'series_name': series_name})
+            continue
+        _update_index(lambda index: index.upsert(patient_id, study_id, series_name, annotations, version))
+        _log_audit(lambda audit_log: audit_log.append('add', patient_id, study_id, series_name, version, username,
+                                                      a=annotations))
+        summary['imported'] += len(annotations)
+        summary['series'] += 1
+        studies.add((patient_id, study_id))
+
+    from app.main.utils import mark_studies_annotated
+    mark_studies_annotated(studies, username)
+    summary['studies'] = len(studies)
+    return summary
+
+def get_study_annotation_summary(patient_id, study_id):
+    """
+    Get annotation counts of a study per series and per finding
+
+    Served from the annotation index's in-memory summaries; if the index is
+    unavailable or still being built the counts are taken from the
+    annotation store instead.
+
+    Returns:
+        {'total': n, 'findings': {finding: n}, 'series': {series_name: {'total': n, 'findings': {finding: n}}}}
+    """
+    from app.models.annotation_index import get_annotation_index
+    try:
+        index = get_annotation_index()
+        if index.is_built():
+            return index.study_summary(patient_id, study_id)
+    except sqlite3.Error as e:
+        current_app.logger.error(f"Error reading the annotation summary of {patient_id}/{study_id}: {e}")
+
+    summary = {'total': 0, 'findings': {}, 'series': {}}
+    for series_name, annotations in get_all_patient_annotations(patient_id).get(study_id, {}).items():
+        series = summary['series'][series_name] = {'total': len(annotations), 'findings': {}}
+        summary['total'] += len(annotations)
+        for annotation in annotations:
+            finding = annotation.get('finding') or ''
+            series['findings'][finding] = series['findings'].get(finding, 0) + 1
+            summary['findings'][finding] = summary['findings'].get(finding, 0) + 1
+    return summary
+
+def study_has_annotations(patient_id, study_id):
+    """Check whether any series of a study has at least one annotation"""
+    return get_annotation_store().study_has_annotations(patient_id, study_id)
 
 def get_all_patient_annotations(patient_id):
     """Get all annotations for a patient across all studies and series"""
-    annotations_dir = os.path.join(current_app.config['ANNOTATION_DATA_DIR'], patient_id)
-    
-    if not os.path.exists(annotations_dir):
-        return {}
-    
-    all_annotations = {}
-    
-    # Traverse the directory structure
-    for study_id in os.listdir(annotations_dir):
-        study_dir = os.path.join(annotations_dir, study_id)
-        
-        if os.path.isdir(study_dir):
-            all_annotations[study_id] = {}
-            
-            # Get annotations for each series
-            for filename in os.listdir(study_dir):
-                if filename.endswith('.json'):
-                    series_name = os.path.splitext(filename)[0]
-                    file_path = os.path.join(study_dir, filename)
-                    
-                    try:
-                        with open(file_path, 'r') as f:
-                            all_annotations[study_id][series_name] = json.load(f)
-                    except (json.JSONDecodeError, IOError) as e:
-                        current_app.logger.error(f"Error loading annotations from {file_path}: {e}")
-                        all_annotations[study_id][series_name] = []
-    
-    return all_annotations
-
+    return get_annotation_store().get_patient(patient_id)
 
 def validate_annotation(annotation_data):
     """Validate annotation data against defined schemas"""
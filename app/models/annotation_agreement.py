@@ -0,0 +1,244 @@
+import copy
+import threading
+from collections import OrderedDict
+import numpy as np
+from flask import current_app
+from app.models.annotation import ANNOTATION_TYPES, VERTEBRAL_LEVELS
+from app.models.annotation_index import get_annotation_index
+
+FINDINGS = list(ANNOTATION_TYPES)
+
+# Rating categories of a finding at a level: 0 absent, 1.. the finding's
+# options in order, then one for an annotation without a valid value
+RATING_CATEGORIES = max(len(spec['options']) for spec in ANNOTATION_TYPES.values()) + 2
+
+# Computed results kept per rater selection
+RESULT_CACHE_SIZE = 16
+
+# Reload every study instead of the changed ones past this fraction of the loaded studies
+FULL_RELOAD_FRACTION = 0.5
+
+def _category(finding, value):
+    options = ANNOTATION_TYPES[finding]['options']
+    return options.index(value) + 1 if value in options else len(options) + 1
+
+def _kappa(observed, expected):
+    """(observed - expected) / (1 - expected), NaN where expected agreement is total"""
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(expected < 1, (observed - expected) / (1 - expected), np.nan)
+
+def _number(value):
+    return None if np.isnan(value) else round(float(value), 4)
+
+class AgreementEngine:
+    """
+    Inter-rater agreement on the studies read by more than one annotator
+
+    Ratings are held in an int8 matrix of study x level x finding x rater,
+    loaded from the annotation index: the rating of a rater is the category
+    of their annotation of that finding at that level (the highest-ranked
+    option if they made several, e.g. on both sides or in several series),
+    or 0 (absent) if they read the study without annotating it there. A
+    rater has read a study if they made any annotation in it.
+
+    Cohen's kappa of every rater pair and Fleiss' kappa of all raters are
+    computed per finding and level, and per finding over all levels, with a
+    few einsum reductions over a one-hot encoding of the matrix, on the
+    studies read by at least two of the selected raters.
+
+    Every annotation write restamps its study in the index's study_versions;
+    before answering, the engine reloads only the studies stamped since it
+    last looked, so writes from any process are picked up incrementally.
+    Computed results are cached per rater selection until then.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._results = OrderedDict()
+        self._version = 0
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self._reset()
+
+    def _reset(self):
+        self.studies = []
+        self.raters = []
+        self._study_positions = {}
+        self._rater_positions = {}
+        self._ratings = np.zeros((0, len(VERTEBRAL_LEVELS), len(FINDINGS), 0), dtype=np.int8)
+        self._read = np.zeros((0, 0), dtype=bool)
+
+    # Loading
+
+    def _position(self, positions, items, key):
+        position = positions.get(key)
+        if position is None:
+            position = positions[key] = len(items)
+            items.append(key)
+        return position
+
+    def _grow(self):
+        """Make room in the matrices for studies and raters added since the last load"""
+        capacity, raters = self._read.shape
+        if len(self.studies) > capacity or len(self.raters) > raters:
+            new_capacity = max(len(self.studies), 2 * capacity)
+            ratings = np.zeros((new_capacity,) + self._ratings.shape[1:3] + (len(self.raters),), dtype=np.int8)
+            ratings[:capacity, :, :, :raters] = self._ratings
+            read = np.zeros((new_capacity, len(self.raters)), dtype=bool)
+            read[:capacity, :raters] = self._read
+            self._ratings, self._read = ratings, read
+
+    def _load(self, rows):
+        studies, levels, findings, raters, categories = [], [], [], [], []
+        level_positions = {level: i for i, level in enumerate(VERTEBRAL_LEVELS)}
+        finding_positions = {finding: i for i, finding in enumerate(FINDINGS)}
+        read = set()
+
+        for patient_id, study_id, level, finding, value, annotator in rows:
+            if not annotator:
+                continue
+            study = self._position(self._study_positions, self.studies, (patient_id, study_id))
+            rater = self._position(self._rater_positions, self.raters, annotator)
+            read.add((study, rater))
+            if level in level_positions and finding in finding_positions:
+                studies.append(study)
+                levels.append(level_positions[level])
+                findings.append(finding_positions[finding])
+                raters.append(rater)
+                categories.append(_category(finding, value))
+
+        self._grow()
+        if read:
+            self._read[tuple(np.array(sorted(read)).T)] = True
+        if studies:
+            np.maximum.at(self._ratings, (studies, levels, findings, raters), np.array(categories, dtype=np.int8))
+
+    def refresh(self):
+        """
+        Reload the studies written since the last refresh
+
+        Returns:
+            Number of studies reloaded
+        """
+        index = get_annotation_index()
+        with self._lock:
+            changed, version = index.changed_studies(self._version)
+            if not changed:
+                return 0
+
+            if self._version == 0 or len(changed) > FULL_RELOAD_FRACTION * len(self.studies):
+                self._reset()
+                self._load(index.iter_ratings())
+            else:
+                for patient_id, study_id in changed:
+                    study = self._study_positions.get((patient_id, study_id))
+                    if study is not None:
+                        self._ratings[study] = 0
+                        self._read[study] = False
+                    self._load(index.iter_ratings(patient_id, study_id))
+            self._version = version
+            self._results.clear()
+            return len(changed)
+
+    # Statistics
+
+    def agreement(self, raters=None, findings=None):
+        """
+        Cohen's and Fleiss' kappa per finding and level
+
+        Args:
+            raters: Annotators to compare (default: all)
+            findings: Findings to report (default: all)
+
+        Returns:
+            {'raters': [...], 'studies': double-read studies, 'findings': {finding:
+            {'fleiss', 'observed', 'cohen': [{'raters', 'kappa', 'studies'}],
+            'levels': {level: {'fleiss', 'observed', 'cohen'}}}}}. Kappas are
+            None where every rating fell in the same category.
+        """
+        self.refresh()
+        key = (tuple(sorted(raters)) if raters else None, tuple(findings) if findings else None)
+        with self._lock:
+            cached = self._results.get(key)
+            if cached is not None:
+                self._results.move_to_end(key)
+                self.cache_hits += 1
+                return copy.deepcopy(cached)
+            self.cache_misses += 1
+
+            selected = [self._rater_positions[rater] for rater in (raters or self.raters)
+                        if rater in self._rater_positions]
+            read = self._read[:len(self.studies), selected]
+            double_read = np.flatnonzero(read.sum(axis=1) >= 2)
+            # Leave out raters who read none of the double-read studies
+            selected = [position for position, used in zip(selected, read[double_read].any(axis=0)) if used]
+            read = self._read[:len(self.studies), selected]
+            result = self._compute(self._ratings[double_read][..., selected], read[double_read],
+                                   [self.raters[position] for position in selected], findings)
+
+        with self._lock:
+            self._results[key] = result
+            while len(self._results) > RESULT_CACHE_SIZE:
+                self._results.popitem(last=False)
+        return copy.deepcopy(result)
+
+    def _compute(self, ratings, read, rater_names, findings):
+        # One-hot ratings, study x level x finding x rater x category; all zero where the rater did not read
+        onehot = (ratings[..., None] == np.arange(RATING_CATEGORIES)) & read[:, None, None, :, None]
+        onehot = onehot.astype(np.float64)
+        readf = read.astype(np.float64)
+        levels = len(VERTEBRAL_LEVELS)
+
+        # Cohen: agreements and per-rater category counts over the studies both raters read
+        shared = readf.T @ readf
+        agreements = np.einsum('slfak,slfbk->lfab', onehot, onehot, optimize=True)
+        counts = np.einsum('slfak,sb->lfabk', onehot, readf, optimize=True)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            cohen_level = _kappa(agreements / shared,
+                                 np.einsum('lfabk,lfbak->lfab', counts, counts) / shared ** 2)
+            pooled = counts.sum(axis=0)
+            cohen_finding = _kappa(agreements.sum(axis=0) / (shared * levels),
+                                   np.einsum('fabk,fbak->fab', pooled, pooled) / (shared * levels) ** 2)
+
+        # Fleiss, generalised to a varying number of raters per study
+        per_category = onehot.sum(axis=3)
+        raters_per_study = readf.sum(axis=1)[:, None, None]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            study_agreement = (((per_category ** 2).sum(axis=-1) - raters_per_study)
+                               / (raters_per_study * (raters_per_study - 1)))
+            observed_level = study_agreement.sum(axis=0) / len(read)
+            observed_finding = study_agreement.sum(axis=(0, 1)) / (len(read) * levels)
+            proportions = per_category.sum(axis=0) / raters_per_study.sum()
+            fleiss_level = _kappa(observed_level, (proportions ** 2).sum(axis=-1))
+            pooled_proportions = proportions.sum(axis=0) / levels
+            fleiss_finding = _kappa(observed_finding, (pooled_proportions ** 2).sum(axis=-1))
+
+        pairs = [(a, b) for a in range(len(rater_names)) for b in range(a + 1, len(rater_names))
+                 if shared[a, b] > 0]
+
+        def cohen(kappas):
+            return [{'raters': [rater_names[a], rater_names[b]], 'kappa': _number(kappas[a, b]),
+                     'studies': int(shared[a, b])} for a, b in pairs]
+
+        result = {'raters': rater_names, 'studies': len(read), 'findings': {}}
+        for f, finding in enumerate(FINDINGS):
+            if findings and finding not in findings:
+                continue
+            result['findings'][finding] = {
+                'fleiss': _number(fleiss_finding[f]),
+                'observed': _number(observed_finding[f]),
+                'cohen': cohen(cohen_finding[f]),
+                'levels': {level: {
+                    'fleiss': _number(fleiss_level[l, f]),
+                    'observed': _number(observed_level[l, f]),
+                    'cohen': cohen(cohen_level[l, f]),
+                } for l, level in enumerate(VERTEBRAL_LEVELS)},
+            }
+        return result
+
+def get_agreement_engine():
+    """Get the agreement engine for the current app"""
+    engine = current_app.extensions.get('annotation_agreement')
+    if engine is None:
+        engine = current_app.extensions['annotation_agreement'] = AgreementEngine()
+    return engine
@@ -0,0 +1,289 @@
+import os
+import glob
+import gzip
+import json
+import threading
+from datetime import datetime, timedelta
+from flask import current_app
+
+# Entry keys, kept short since there is one entry per annotation write:
+#   t   time of the write (ISO, milliseconds)   u   user
+#   op  'add', 'set', 'del' or 'put'            p, s, se   patient, study, series
+#   v   series version after the write
+# and the delta of the operation:
+#   add  a: annotations appended, in order
+#   set  id, new: fields written, old: their previous values, unset: fields that did not exist
+#   del  rm: [position, annotation] of each annotation removed, positions before the delete
+#   put  (whole series saved) b: series version the delta was taken against,
+#        ids: new ID order, new: annotations added or changed, old_ids: previous ID order,
+#        old: previous versions of annotations changed or removed
+AUDIT_OPERATIONS = ('add', 'set', 'del', 'put')
+
+SEGMENT_PREFIX = 'audit-'
+
+class AuditHistoryGap(Exception):
+    """The audit log does not cover every write needed to reconstruct a series state"""
+
+def _segment_day(path):
+    """YYYYMMDD of a segment file name"""
+    return os.path.basename(path)[len(SEGMENT_PREFIX):len(SEGMENT_PREFIX) + 8]
+
+def _day(bound):
+    """YYYYMMDD of an ISO date or datetime bound"""
+    return bound[:10].replace('-', '')
+
+def _put_delta(previous, annotations):
+    """Delta of a whole-series save, storing unchanged annotations by ID only"""
+    previous_by_id = {a.get('id'): a for a in previous}
+    current_by_id = {a.get('id'): a for a in annotations}
+    return {
+        'ids': [a.get('id') for a in annotations],
+        'new': [a for a in annotations if previous_by_id.get(a.get('id')) != a],
+        'old_ids': [a.get('id') for a in previous],
+        'old': [a for a in previous if current_by_id.get(a.get('id')) != a],
+    }
+
+def apply_entry(annotations, entry):
+    """Replay an entry forwards onto the annotation list it was written against"""
+    op = entry['op']
+    if op == 'add':
+        return annotations + [dict(a) for a in entry['a']]
+    if op == 'set':
+        return [dict(a, **entry['new']) if a.get('id') == entry['id'] else a for a in annotations]
+    if op == 'del':
+        positions = {position for position, _ in entry['rm']}
+        return [a for position, a in enumerate(annotations) if position not in positions]
+    by_id = {a.get('id'): a for a in annotations}
+    by_id.update((a.get('id'), a) for a in entry['new'])
+    return [dict(by_id[annotation_id]) for annotation_id in entry['ids']]
+
+def undo_entry(annotations, entry):
+    """Replay an entry backwards, giving the annotation list as it was before the write"""
+    op = entry['op']
+    if op == 'add':
+        return annotations[:len(annotations) - len(entry['a'])]
+    if op == 'set':
+        restored = []
+        for annotation in annotations:
+            if annotation.get('id') == entry['id']:
+                annotation = dict(annotation, **entry['old'])
+                for field in entry['unset']:
+                    annotation.pop(field, None)
+            restored.append(annotation)
+        return restored
+    if op == 'del':
+        restored = list(annotations)
+        for position, annotation in entry['rm']:
+            restored.insert(position, dict(annotation))
+        return restored
+    by_id = {a.get('id'): a for a in annotations}
+    by_id.update((a.get('id'), a) for a in entry['old'])
+    return [dict(by_id[annotation_id]) for annotation_id in entry['old_ids']]
+
+class AuditLog:
+    """
+    Append-only log of annotation writes, one delta entry per operation
+
+    Entries are compact JSON lines in one segment file per day
+    (audit-YYYYMMDD.jsonl). Each entry is appended with a single write(2) on
+    a file opened with O_APPEND, which the kernel keeps atomic for lines of
+    this size, so worker processes can share a segment without a lock and a
+    write costs one json.dumps and one syscall. Entries are not fsynced:
+    a crash can lose the last entries, never corrupt earlier ones.
+    Segments of past days can be gzipped with compact(); reads handle both.
+
+    Time-range queries only open the segments of the days in range. Past
+    states of a series are reconstructed by undoing the entries written
+    after that point, newest first, from the current state; see state_at.
+    """
+
+    def __init__(self, log_dir):
+        self.log_dir = log_dir
+        self._lock = threading.Lock()
+        self._fd = None
+        self._fd_day = None
+        os.makedirs(log_dir, exist_ok=True)
+
+    def segment_path(self, day):
+        return os.path.join(self.log_dir, f'{SEGMENT_PREFIX}{day}.jsonl')
+
+    def _segment_fd(self, day):
+        with self._lock:
+            if self._fd_day != day:
+                fd = os.open(self.segment_path(day), os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+                if self._fd is not None:
+                    os.close(self._fd)
+                self._fd, self._fd_day = fd, day
+            return self._fd
+
+    def append(self, op, patient_id, study_id, series_name, version, username, **delta):
+        """Append one entry; delta holds the op's fields (see AUDIT_OPERATIONS)"""
+        now = datetime.now()
+        entry = {'t': now.isoformat(timespec='milliseconds'), 'u': username, 'op': op,
+                 'p': patient_id, 's': study_id, 'se': series_name, 'v': version, **delta}
+        line = json.dumps(entry, separators=(',', ':')).encode('utf-8') + b'\n'
+        os.write(self._segment_fd(now.strftime('%Y%m%d')), line)
+        return entry
+
+    def log_save(self, patient_id, study_id, series_name, previous, base_version, annotations,
+                 version, username):
+        """Log a whole-series save against the annotations read at base_version"""
+        return self.append('put', patient_id, study_id, series_name, version, username,
+                           b=base_version, **_put_delta(previous, annotations))
+
+    # Reads
+
+    def segments(self, since=None, until=None):
+        """Segment files holding the days of an inclusive ISO date/datetime range, oldest first"""
+        by_day = {}
+        for path in glob.glob(os.path.join(self.log_dir, f'{SEGMENT_PREFIX}*.jsonl*')):
+            day = _segment_day(path)
+            if since is not None and day < _day(since):
+                continue
+            if until is not None and day > _day(until):
+                continue
+            # A segment being compacted briefly exists in both forms; read the plain one
+            if day not in by_day or not path.endswith('.gz'):
+                by_day[day] = path
+        return [by_day[day] for day in sorted(by_day)]
+
+    def _read_segment(self, path):
+        opener = gzip.open if path.endswith('.gz') else open
+        try:
+            with opener(path, 'rb') as f:
+                data = f.read()
+        except FileNotFoundError:
+            return
+        # A line without its newline is still being written (or was torn by a crash); leave it
+        for line in data[:data.rfind(b'\n') + 1].splitlines():
+            if not line.strip():
+                continue
+            try:
+                yield json.loads(line)
+            except ValueError as e:
+                current_app.logger.error(f"Skipping bad audit log line in {path}: {e}")
+
+    def iter_entries(self, since=None, until=None, patient_id=None, study_id=None, series_name=None,
+                     username=None, op=None):
+        """
+        Yield entries in the order they were written, filtered
+
+        Args:
+            since, until: Only entries written within this inclusive range (ISO date or datetime)
+            patient_id, study_id, series_name: Only entries of this patient / study / series
+            username: Only entries written by this user
+            op: Only entries of this operation
+        """
+        for path in self.segments(since, until):
+            for entry in self._read_segment(path):
+                if since is not None and entry['t'][:len(since)] < since:
+                    continue
+                if until is not None and entry['t'][:len(until)] > until:
+                    continue
+                if patient_id is not None and entry['p'] != patient_id:
+                    continue
+                if study_id is not None and entry['s'] != study_id:
+                    continue
+                if series_name is not None and entry['se'] != series_name:
+                    continue
+                if username is not None and entry['u'] != username:
+                    continue
+                if op is not None and entry['op'] != op:
+                    continue
+                yield entry
+
+    def state_at(self, patient_id, study_id, series_name, annotations, version, at=None, at_version=None):
+        """
+        Reconstruct a past state of a series from its current state
+
+        Args:
+            annotations, version: The series' current annotations and version
+            at: ISO date or datetime; the state after the last write up to then
+                (a date includes that whole day)
+            at_version: The state at this series version instead
+
+        Returns:
+            (annotations, version) as they were
+
+        Raises:
+            AuditHistoryGap: a write needed for the reconstruction is not in the log,
+                e.g. it was made with logging disabled or outside the app
+        """
+        if at is None and at_version is None:
+            return annotations, version
+
+        # Only the entries written after the wanted state need to be read
+        if at is None:
+            entries = self._entries_since_version(patient_id, study_id, series_name, version, at_version)
+        else:
+            since = at if 'T' in at else (datetime.fromisoformat(at) + timedelta(days=1)).date().isoformat()
+            entries = [entry for entry in self.iter_entries(since=since, patient_id=patient_id,
+                                                            study_id=study_id, series_name=series_name)
+                       if at_version is None or entry['v'] > at_version]
+        # Concurrent writers can append out of order; the series version gives the true order
+        entries.sort(key=lambda entry: entry['v'], reverse=True)
+
+        for entry in entries:
+            if at is not None and entry['t'][:len(at)] <= at:
+                break
+            if entry['v'] != version:
+                raise AuditHistoryGap(f"No audit entry for version {version} of {patient_id}/{study_id}/{series_name}")
+            if entry['op'] == 'put' and entry['b'] != version - 1:
+                raise AuditHistoryGap(f"Version {version} of {patient_id}/{study_id}/{series_name} "
+                                      f"was saved over a concurrent write")
+            annotations = undo_entry(annotations, entry)
+            version -= 1
+        if at_version is not None and version != at_version:
+            raise AuditHistoryGap(f"No audit entry for version {version} of {patient_id}/{study_id}/{series_name}")
+        return annotations, version
+
+    def _entries_since_version(self, patient_id, study_id, series_name, version, at_version):
+        """
+        Entries of a series for versions at_version + 1 to version
+
+        Segments are read newest first and only until every one of those
+        versions was found, so a recent base version does not read (and
+        decompress) the whole history. A segment is always read to its end,
+        since concurrent writers can append a day's entries out of order.
+        """
+        wanted = set(range(at_version + 1, version + 1))
+        entries = []
+        for path in reversed(self.segments()):
+            if not wanted:
+                break
+            for entry in self._read_segment(path):
+                if (entry['p'] == patient_id and entry['s'] == study_id and entry['se'] == series_name and
+                        at_version < entry['v'] <= version):
+                    entries.append(entry)
+                    wanted.discard(entry['v'])
+        return entries
+
+    def compact(self, before=None):
+        """
+        Gzip the segments of days before `before` (YYYYMMDD, default today)
+
+        Returns:
+            Number of segments compacted
+        """
+        before = before or datetime.now().strftime('%Y%m%d')
+        count = 0
+        for path in glob.glob(os.path.join(self.log_dir, f'{SEGMENT_PREFIX}*.jsonl')):
+            if _segment_day(path) >= before:
+                continue
+            temp_path = path + '.gz.tmp'
+            with open(path, 'rb') as source, gzip.open(temp_path, 'wb') as target:
+                target.write(source.read())
+            os.replace(temp_path, path + '.gz')
+            os.remove(path)
+            count += 1
+        return count
+
+def get_audit_log():
+    """Get the audit log for the current app, or None if AUDIT_LOG_ENABLED is off"""
+    if not current_app.config.get('AUDIT_LOG_ENABLED', True):
+        return None
+    audit_log = current_app.extensions.get('audit_log')
+    if audit_log is None:
+        audit_log = AuditLog(current_app.config['AUDIT_LOG_DIR'])
+        current_app.extensions['audit_log'] = audit_log
+    return audit_log
@@ -0,0 +1,462 @@
+import os
+import copy
+import sqlite3
+import threading
+from collections import OrderedDict
+from flask import current_app
+from app.models.annotation_store import get_annotation_store
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS annotation_index (
+    patient_id TEXT NOT NULL,
+    study_id TEXT NOT NULL,
+    series_name TEXT NOT NULL,
+    annotation_id TEXT NOT NULL,
+    finding TEXT,
+    value TEXT,
+    level TEXT,
+    side TEXT,
+    annotator TEXT,
+    annotated_at TEXT,
+    PRIMARY KEY (patient_id, study_id, series_name, annotation_id)
+);
+CREATE INDEX IF NOT EXISTS idx_index_finding ON annotation_index (finding, level, value);
+CREATE INDEX IF NOT EXISTS idx_index_level ON annotation_index (level, value);
+CREATE INDEX IF NOT EXISTS idx_index_side ON annotation_index (side);
+CREATE INDEX IF NOT EXISTS idx_index_annotator ON annotation_index (annotator, annotated_at);
+CREATE INDEX IF NOT EXISTS idx_index_annotated_at ON annotation_index (annotated_at);
+CREATE TABLE IF NOT EXISTS series_counts (
+    patient_id TEXT NOT NULL,
+    study_id TEXT NOT NULL,
+    series_name TEXT NOT NULL,
+    finding TEXT NOT NULL,
+    count INTEGER NOT NULL,
+    PRIMARY KEY (patient_id, study_id, series_name, finding)
+);
+CREATE TABLE IF NOT EXISTS series_versions (
+    patient_id TEXT NOT NULL,
+    study_id TEXT NOT NULL,
+    series_name TEXT NOT NULL,
+    version INTEGER NOT NULL,
+    PRIMARY KEY (patient_id, study_id, series_name)
+);
+CREATE TABLE IF NOT EXISTS study_versions (
+    patient_id TEXT NOT NULL,
+    study_id TEXT NOT NULL,
+    version INTEGER NOT NULL,
+    PRIMARY KEY (patient_id, study_id)
+);
+CREATE INDEX IF NOT EXISTS idx_study_versions_version ON study_versions (version);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+# Query terms and the indexed column each one matches exactly
+QUERY_TERMS = ('finding', 'value', 'level', 'side', 'annotator')
+
+RESULT_COLUMNS = ('patient_id', 'study_id', 'series_name', 'annotation_id') + QUERY_TERMS + ('annotated_at',)
+
+MAX_PER_PAGE = 500
+
+# Bump when the tables derived from the index change, so existing indexes get rebuilt
+INDEX_FORMAT = 3
+
+# Study summaries kept in memory per process
+SUMMARY_CACHE_SIZE = 10000
+
+def _index_row(patient_id, study_id, series_name, position, annotation):
+    # Annotations saved before IDs were assigned are keyed by their list position
+    annotation_id = annotation.get('id') or f"#{position}"
+    return (patient_id, study_id, series_name, str(annotation_id),
+            annotation.get('finding'), annotation.get('value'), annotation.get('level'), annotation.get('side'),
+            annotation.get('created_by'), annotation.get('updated_at') or annotation.get('created_at'))
+
+class AnnotationIndex:
+    """
+    Inverted index of annotations, kept in its own SQLite database
+
+    One row per annotation holds the terms supervisors query on: finding,
+    value, level, side, annotator (created_by) and annotated_at (last change).
+    B-tree indexes on those columns turn a cohort-wide question into index
+    range scans instead of a walk over every series. The index works with
+    either annotation backend: app.models.annotation updates it after every
+    annotation write, and it is rebuilt from the annotation store when it has
+    never been built or an update failed.
+
+    Writes reach the index in whatever order their requests finish, so it
+    records the annotation store version of every series it holds and
+    applies each write's changes only on top of the version before it (see
+    _apply_write).
+
+    Alongside the index, series_counts holds the number of annotations per
+    series and finding, recounted for a series whenever it is written, so
+    study pages never read annotation lists. Every write also stamps the
+    study in study_versions with a new value of a counter that only grows;
+    study summaries are cached in memory and revalidated against that stamp
+    with one primary key lookup, so writes from other processes are seen.
+    """
+
+    def __init__(self, db_path, summary_cache_size=SUMMARY_CACHE_SIZE):
+        self.db_path = db_path
+        self.summary_cache_size = summary_cache_size
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self._local = threading.local()
+        self._summaries = OrderedDict()
+        self._summary_lock = threading.Lock()
+        self._building = False
+        self._build_lock = threading.Lock()
+
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        with self._connect() as conn:
+            conn.executescript(SCHEMA)
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    # Maintenance
+
+    def is_built(self):
+        conn = self._connect()
+        built = conn.execute("SELECT value FROM meta WHERE key = 'built'").fetchone()
+        index_format = conn.execute("SELECT value FROM meta WHERE key = 'format'").fetchone()
+        return built is not None and index_format is not None and int(index_format[0]) == INDEX_FORMAT
+
+    def invalidate(self):
+        """Mark the index as out of date, so it is rebuilt in the background on its next use"""
+        with self._connect() as conn:
+            conn.execute("DELETE FROM meta WHERE key = 'built'")
+
+    def rebuild(self, annotation_store, force=True):
+        """
+        Replace the index with the contents of an annotation store
+
+        The store is read without holding the index's write lock; only the
+        swap into the index runs in one write transaction. Series whose
+        version moved while the store was read are then re-read, so writes
+        made meanwhile are kept, and index updates waiting on the lock apply
+        on top of the rebuilt index in version order.
+
+        Args:
+            force: Rebuild even if the index is found built once the write
+                   lock is taken (e.g. by another process in the meantime)
+
+        Returns:
+            Number of annotations indexed, or None if it was already built
+        """
+        # Versions are read first, so each series' content is at least as new as its recorded version
+        states = annotation_store.series_states()
+        rows = [_index_row(patient_id, study_id, series_name, position, annotation)
+                for patient_id, study_id, series_name, annotations in annotation_store.iter_series()
+                for position, annotation in enumerate(annotations)]
+
+        conn = self._connect()
+        with conn:
+            conn.execute('BEGIN IMMEDIATE')
+            if not force and self.is_built():
+                return None
+            conn.execute('DELETE FROM annotation_index')
+            self._insert_rows(conn, rows)
+            conn.execute('DELETE FROM series_versions')
+            conn.executemany('INSERT INTO series_versions (patient_id, study_id, series_name, version) '
+                             'VALUES (?, ?, ?, ?)', [key + (version,) for key, (_, version) in states.items()])
+            for key, (_, version) in annotation_store.series_states().items():
+                if states.get(key, (None, 0))[1] != version:
+                    self._reindex_series(conn, annotation_store, *key)
+            (count,) = conn.execute('SELECT COUNT(*) FROM annotation_index').fetchone()
+
+            conn.execute('DELETE FROM series_counts')
+            conn.execute("INSERT INTO series_counts (patient_id, study_id, series_name, finding, count) "
+                         "SELECT patient_id, study_id, series_name, COALESCE(finding, ''), COUNT(*) "
+                         "FROM annotation_index GROUP BY patient_id, study_id, series_name, COALESCE(finding, '')")
+            # Restamp every study, including ones that no longer have annotations
+            version = self._next_version(conn)
+            conn.execute('UPDATE study_versions SET version = ?', (version,))
+            conn.execute('INSERT OR IGNORE INTO study_versions (patient_id, study_id, version) '
+                         'SELECT DISTINCT patient_id, study_id, ? FROM series_counts', (version,))
+            conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('built', ?)", (str(count),))
+            conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('format', ?)", (str(INDEX_FORMAT),))
+        self.analyze()
+        return count
+
+    def build_in_background(self):
+        """Start a thread that builds the index from the annotation store, unless one is already running"""
+        with self._build_lock:
+            if self._building:
+                return
+            self._building = True
+        app = current_app._get_current_object()
+        threading.Thread(target=self._build_thread, args=(app,), daemon=True,
+                         name='annotation-index-build').start()
+
+    def _build_thread(self, app):
+        try:
+            with app.app_context():
+                count = self.rebuild(get_annotation_store(), force=False)
+                if count is not None:
+                    app.logger.info(f"Annotation index rebuilt with {count} annotations")
+        except Exception as e:
+            app.logger.error(f"Error rebuilding the annotation index: {e}")
+        finally:
+            with self._build_lock:
+                self._building = False
+
+    def analyze(self):
+        """
+        Refresh the query planner statistics
+
+        Without them SQLite may pick a poorly selective index, e.g. annotator
+        when one annotator did most of the work, instead of finding/level/value.
+        """
+        conn = self._connect()
+        with conn:
+            (count,) = conn.execute('SELECT COUNT(*) FROM annotation_index').fetchone()
+            conn.execute('ANALYZE')
+            conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('analyzed_rows', ?)", (str(count),))
+
+    def analyze_if_grown(self):
+        """Refresh the planner statistics if the index has doubled in size since they were taken"""
+        conn = self._connect()
+        row = conn.execute("SELECT value FROM meta WHERE key = 'analyzed_rows'").fetchone()
+        (count,) = conn.execute('SELECT COUNT(*) FROM annotation_index').fetchone()
+        if row is None or count > 2 * max(int(row[0]), 100):
+            self.analyze()
+
+    def _insert(self, conn, patient_id, study_id, series_name, annotations):
+        self._insert_rows(conn, [_index_row(patient_id, study_id, series_name, position, annotation)
+                                 for position, annotation in enumerate(annotations)])
+
+    def _insert_rows(self, conn, rows):
+        conn.executemany(
+            'INSERT OR REPLACE INTO annotation_index (patient_id, study_id, series_name, annotation_id, '
+            'finding, value, level, side, annotator, annotated_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', rows)
+
+    def _delete_series(self, conn, patient_id, study_id, series_name):
+        conn.execute('DELETE FROM annotation_index WHERE patient_id = ? AND study_id = ? AND series_name = ?',
+                     (patient_id, study_id, series_name))
+
+    def _set_series_version(self, conn, patient_id, study_id, series_name, version):
+        conn.execute('INSERT OR REPLACE INTO series_versions (patient_id, study_id, series_name, version) '
+                     'VALUES (?, ?, ?, ?)', (patient_id, study_id, series_name, version))
+
+    def _reindex_series(self, conn, annotation_store, patient_id, study_id, series_name):
+        """Index a series as the annotation store holds it now, with its version (write transaction held)"""
+        annotations, version = annotation_store.get_series_versioned(patient_id, study_id, series_name)
+        self._delete_series(conn, patient_id, study_id, series_name)
+        self._insert(conn, patient_id, study_id, series_name, annotations)
+        self._set_series_version(conn, patient_id, study_id, series_name, version)
+
+    def _next_version(self, conn):
+        row = conn.execute("SELECT value FROM meta WHERE key = 'summary_version'").fetchone()
+        version = (int(row[0]) if row else 0) + 1
+        conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('summary_version', ?)", (str(version),))
+        return version
+
+    def _recount_series(self, conn, patient_id, study_id, series_name):
+        """Recount a written series into series_counts and restamp its study"""
+        key = (patient_id, study_id, series_name)
+        conn.execute('DELETE FROM series_counts WHERE patient_id = ? AND study_id = ? AND series_name = ?', key)
+        conn.execute("INSERT INTO series_counts (patient_id, study_id, series_name, finding, count) "
+                     "SELECT patient_id, study_id, series_name, COALESCE(finding, ''), COUNT(*) "
+                     "FROM annotation_index WHERE patient_id = ? AND study_id = ? AND series_name = ? "
+                     "GROUP BY COALESCE(finding, '')", key)
+        conn.execute('INSERT OR REPLACE INTO study_versions (patient_id, study_id, version) VALUES (?, ?, ?)',
+                     (patient_id, study_id, self._next_version(conn)))
+
+    # Updates, one per kind of annotation write
+
+    def _apply_write(self, patient_id, study_id, series_name, version, apply, whole_series=False):
+        """
+        Apply the index changes of an annotation write that left a series at version
+
+        A write the index already reflects (version not above the indexed
+        one) is ignored. apply(conn) runs only for the write right after the
+        indexed version, or for one that replaces the whole series; if a write
+        in between has not reached the index yet, the series is re-read from
+        the annotation store instead, and that write is ignored when it comes.
+        """
+        key = (patient_id, study_id, series_name)
+        conn = self._connect()
+        with conn:
+            conn.execute('BEGIN IMMEDIATE')
+            row = conn.execute('SELECT version FROM series_versions '
+                               'WHERE patient_id = ? AND study_id = ? AND series_name = ?', key).fetchone()
+            indexed = row[0] if row else 0
+            if version <= indexed:
+                return
+            if whole_series or version == indexed + 1:
+                apply(conn)
+                self._set_series_version(conn, *key, version)
+            else:
+                self._reindex_series(conn, get_annotation_store(), *key)
+            self._recount_series(conn, *key)
+
+    def replace_series(self, patient_id, study_id, series_name, annotations, version):
+        """Re-index a series after its whole annotation list was replaced"""
+        def apply(conn):
+            self._delete_series(conn, patient_id, study_id, series_name)
+            self._insert(conn, patient_id, study_id, series_name, annotations)
+        self._apply_write(patient_id, study_id, series_name, version, apply, whole_series=True)
+
+    def upsert(self, patient_id, study_id, series_name, annotations, version):
+        """Index added or changed annotations of a series"""
+        self._apply_write(patient_id, study_id, series_name, version,
+                          lambda conn: self._insert(conn, patient_id, study_id, series_name, annotations))
+
+    def remove(self, patient_id, study_id, series_name, annotation_id, version):
+        """Drop a deleted annotation from the index"""
+        self._apply_write(patient_id, study_id, series_name, version, lambda conn: conn.execute(
+            'DELETE FROM annotation_index WHERE patient_id = ? AND study_id = ? AND series_name = ? '
+            'AND annotation_id = ?', (patient_id, study_id, series_name, annotation_id)))
+
+    # Study summaries
+
+    def study_summary(self, patient_id, study_id):
+        """
+        Annotation counts of a study, per series and per finding
+
+        Returns:
+            {'total': n, 'findings': {finding: n},
+             'series': {series_name: {'total': n, 'findings': {finding: n}}}}.
+            Annotations without a finding are counted under ''.
+        """
+        key = (patient_id, study_id)
+        conn = self._connect()
+        row = conn.execute('SELECT version FROM study_versions WHERE patient_id = ? AND study_id = ?',
+                           key).fetchone()
+        version = row[0] if row else 0
+
+        with self._summary_lock:
+            cached = self._summaries.get(key)
+            if cached is not None and cached[0] == version:
+                self._summaries.move_to_end(key)
+                self.cache_hits += 1
+                return copy.deepcopy(cached[1])
+            self.cache_misses += 1
+
+        summary = {'total': 0, 'findings': {}, 'series': {}}
+        rows = conn.execute('SELECT series_name, finding, count FROM series_counts '
+                            'WHERE patient_id = ? AND study_id = ?', key)
+        for series_name, finding, count in rows:
+            series = summary['series'].setdefault(series_name, {'total': 0, 'findings': {}})
+            series['total'] += count
+            series['findings'][finding] = count
+            summary['total'] += count
+            summary['findings'][finding] = summary['findings'].get(finding, 0) + count
+
+        with self._summary_lock:
+            self._summaries[key] = (version, summary)
+            self._summaries.move_to_end(key)
+            while len(self._summaries) > self.summary_cache_size:
+                self._summaries.popitem(last=False)
+        return copy.deepcopy(summary)
+
+    def changed_studies(self, since_version=0):
+        """
+        Studies written since a study_versions stamp
+
+        Returns:
+            (studies, version): list of (patient_id, study_id) stamped after
+            since_version, and the highest stamp seen (since_version if none)
+        """
+        rows = self._connect().execute('SELECT patient_id, study_id, version FROM study_versions '
+                                       'WHERE version > ?', (since_version,)).fetchall()
+        return [(patient_id, study_id) for patient_id, study_id, _ in rows], max(
+            [since_version] + [version for _, _, version in rows])
+
+    def iter_ratings(self, patient_id=None, study_id=None):
+        """Rows of (patient_id, study_id, level, finding, value, annotator) for every annotation, or one study's"""
+        sql = 'SELECT patient_id, study_id, level, finding, value, annotator FROM annotation_index'
+        if patient_id is not None:
+            return self._connect().execute(sql + ' WHERE patient_id = ? AND study_id = ?', (patient_id, study_id))
+        return self._connect().execute(sql)
+
+    # Queries
+
+    def query(self, finding=None, value=None, level=None, side=None, annotator=None,
+              since=None, until=None, group_by=None, page=1, per_page=50):
+        """
+        Find annotations, or the studies that have them, matching all given terms
+
+        Args:
+            finding, value, level, side, annotator: Exact matches (None matches anything)
+            since, until: Inclusive range on the last change time (ISO date or datetime)
+            group_by: None for one result per annotation, 'study' for one per
+                      study with the number of matching annotations
+            page, per_page: 1-based page number and page size (at most MAX_PER_PAGE)
+
+        Returns:
+            {'total': matching results, 'results': list of dicts for the page}
+        """
+        terms = {'finding': finding, 'value': value, 'level': level, 'side': side, 'annotator': annotator}
+        conditions = [f"{column} = ?" for column, term in terms.items() if term is not None]
+        params = [term for term in terms.values() if term is not None]
+        if since is not None:
+            conditions.append('annotated_at >= ?')
+            params.append(since)
+        if until is not None:
+            # Timestamps starting with the bound sort below bound + U+FFFF, so a
+            # date bound includes the whole day and the index range still applies
+            conditions.append('annotated_at <= ?')
+            params.append(until + '\uffff')
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+
+        per_page = max(1, min(per_page, MAX_PER_PAGE))
+        offset = (max(page, 1) - 1) * per_page
+        conn = self._connect()
+
+        if group_by == 'study':
+            (total,) = conn.execute(
+                f'SELECT COUNT(*) FROM (SELECT DISTINCT patient_id, study_id FROM annotation_index {where})',
+                params).fetchone()
+            rows = conn.execute(
+                f'SELECT patient_id, study_id, COUNT(*) FROM annotation_index {where} '
+                'GROUP BY patient_id, study_id ORDER BY patient_id, study_id LIMIT ? OFFSET ?',
+                params + [per_page, offset])
+            results = [{'patient_id': patient_id, 'study_id': study_id, 'matches': matches}
+                       for patient_id, study_id, matches in rows]
+        else:
+            (total,) = conn.execute(f'SELECT COUNT(*) FROM annotation_index {where}', params).fetchone()
+            rows = conn.execute(
+                f"SELECT {', '.join(RESULT_COLUMNS)} FROM annotation_index {where} "
+                'ORDER BY patient_id, study_id, series_name, annotation_id LIMIT ? OFFSET ?',
+                params + [per_page, offset])
+            results = [dict(zip(RESULT_COLUMNS, row)) for row in rows]
+
+        return {'total': total, 'results': results}
+
+def get_annotation_index(wait=False):
+    """
+    Get the annotation index for the current app
+
+    An index that has never been built, or was invalidated by a failed
+    update, is built from the annotation store by a background thread, so
+    requests never wait for it; until then is_built() is False and readers
+    fall back or report it as unavailable.
+
+    Args:
+        wait: Build a missing index in this thread instead (for scripts)
+    """
+    index = current_app.extensions.get('annotation_index')
+    if index is None:
+        index = AnnotationIndex(current_app.config['ANNOTATION_INDEX_FILE'])
+        # The index grows through writes after it was built; keep the planner statistics in step
+        index.analyze_if_grown()
+        current_app.extensions['annotation_index'] = index
+
+    if not index.is_built():
+        if wait:
+            count = index.rebuild(get_annotation_store(), force=False)
+            if count is not None:
+                current_app.logger.info(f"Annotation index rebuilt with {count} annotations")
+        else:
+            index.build_in_background()
+    return index
@@ -0,0 +1,594 @@
+import os
+import json
+import sqlite3
+import threading
+from flask import current_app
+
+class AnnotationStore:
+    """
+    Interface of the annotation backends
+
+    Annotations are stored per series as an ordered list of dicts, as in
+    the original ANNOTATION_DATA_DIR/<patient>/<study>/<series>.json layout.
+    Backends raise OSError or sqlite3.Error when a write fails; callers in
+    app.models.annotation log the error and report failure.
+
+    Every series has a version number (0 until its first write) that each
+    successful write increments. Writes take an optional expected_version
+    and raise SeriesVersionConflict instead of writing if the series has
+    moved on, so concurrent editors cannot silently overwrite each other.
+    """
+
+    def get_series(self, patient_id, study_id, series_name):
+        """Return the annotations of a series (empty list if none)"""
+        raise NotImplementedError
+
+    def get_series_versioned(self, patient_id, study_id, series_name):
+        """Return (annotations, version) of a series, read consistently"""
+        raise NotImplementedError
+
+    def get_annotation(self, patient_id, study_id, series_name, annotation_id):
+        """Return one annotation of a series by ID, or None if there is none"""
+        return next((a for a in self.get_series(patient_id, study_id, series_name)
+                     if a.get('id') == annotation_id), None)
+
+    def save_series(self, patient_id, study_id, series_name, annotations, expected_version=None):
+        """Replace the annotations of a series; returns the new version"""
+        raise NotImplementedError
+
+    def insert(self, patient_id, study_id, series_name, annotation, expected_version=None):
+        """Append one annotation, assigning it the series' next ID; returns (annotation, version)"""
+        raise NotImplementedError
+
+    def insert_many(self, patient_id, study_id, series_name, annotations, expected_version=None):
+        """Append several annotations in one write, assigning consecutive IDs; returns (annotations, version)"""
+        raise NotImplementedError
+
+    def update(self, patient_id, study_id, series_name, annotation_id, fields, expected_version=None):
+        """
+        Merge fields into one annotation
+
+        Returns (before, after, version); before and after are None if not found
+        """
+        raise NotImplementedError
+
+    def delete(self, patient_id, study_id, series_name, annotation_id, expected_version=None):
+        """
+        Delete an annotation by ID
+
+        Returns (removed, version); removed lists (position, annotation) of every
+        annotation deleted (more than one only for duplicate IDs in older data),
+        and is empty if none had the ID
+        """
+        raise NotImplementedError
+
+    def series_states(self):
+        """
+        Return {(patient_id, study_id, series_name): (next_id, version)} for every
+        series with a recorded state, including series whose annotations were all deleted
+        """
+        raise NotImplementedError
+
+    def restore_series(self, patient_id, study_id, series_name, annotations, next_id, version):
+        """
+        Replace a series with the given annotations, next free ID and version, e.g.
+        when copying it from another backend; next_id is raised past any ID in use
+        """
+        raise NotImplementedError
+
+    def get_patient(self, patient_id):
+        """Return {study_id: {series_name: [annotations]}} for a patient"""
+        raise NotImplementedError
+
+    def study_has_annotations(self, patient_id, study_id):
+        """Check whether any series of a study has at least one annotation"""
+        raise NotImplementedError
+
+    def iter_series(self):
+        """Yield (patient_id, study_id, series_name, annotations) for every stored series"""
+        raise NotImplementedError
+
+    def iter_annotations(self, finding=None, level=None):
+        """Yield (patient_id, study_id, series_name, annotation) for every stored annotation, optionally filtered"""
+        for patient_id, study_id, series_name, annotations in self.iter_series():
+            for annotation in annotations:
+                if finding is not None and annotation.get('finding') != finding:
+                    continue
+                if level is not None and annotation.get('level') != level:
+                    continue
+                yield patient_id, study_id, series_name, annotation
+
+class SeriesVersionConflict(Exception):
+    """A conditional write found the series at a different version than expected"""
+
+    def __init__(self, version, annotations):
+        super().__init__(f"series is at version {version}")
+        self.version = version
+        self.annotations = annotations
+
+def check_version(expected_version, version, annotations):
+    """Raise SeriesVersionConflict if expected_version is given and differs from version"""
+    if expected_version is not None and expected_version != version:
+        raise SeriesVersionConflict(version, annotations)
+
+def numeric_id(annotation):
+    """The annotation's ID as an int, or None if it has no numeric ID"""
+    try:
+        return int(annotation.get('id'))
+    except (TypeError, ValueError):
+        return None
+
+def assign_ids(annotations, next_id):
+    """
+    Give annotations without an ID the next free IDs of their series
+
+    IDs are never reused: next_id only grows, and it is moved past any numeric
+    ID already present in annotations.
+
+    Returns:
+        The series' next free ID afterwards
+    """
+    for annotation in annotations:
+        value = numeric_id(annotation)
+        if value is not None and value >= next_id:
+            next_id = value + 1
+    for annotation in annotations:
+        if not annotation.get('id'):
+            annotation['id'] = str(next_id)
+            next_id += 1
+    return next_id
+
+class FileAnnotationStore(AnnotationStore):
+    """
+    Annotation store using one JSON file per series under data_dir (the original layout)
+
+    The next free annotation ID and the version of a series are kept in a
+    <series>.meta file next to it, so IDs stay monotonic after deletes.
+    Version checks are serialized by a per-process lock, so they protect
+    concurrent editors served by one process. Single-annotation writes
+    still rewrite the series file; use the SQLite backend for writes whose
+    cost does not depend on the series size.
+    """
+
+    backend = 'files'
+
+    def __init__(self, data_dir):
+        self.data_dir = data_dir
+        self._lock = threading.Lock()
+
+    def series_path(self, patient_id, study_id, series_name):
+        """Get the path of a series' annotations file, creating its study directory"""
+        # Create a nested structure: patient_id/study_id/series_name.json
+        annotations_dir = os.path.join(self.data_dir, patient_id, study_id)
+
+        # Create directory if it doesn't exist
+        os.makedirs(annotations_dir, exist_ok=True)
+
+        return os.path.join(annotations_dir, f"{series_name}.json")
+
+    def _read_file(self, file_path):
+        try:
+            with open(file_path, 'r') as f:
+                return json.load(f)
+        except (json.JSONDecodeError, IOError) as e:
+            current_app.logger.error(f"Error loading annotations from {file_path}: {e}")
+            return []
+
+    def get_series(self, patient_id, study_id, series_name):
+        file_path = self.series_path(patient_id, study_id, series_name)
+        if not os.path.exists(file_path):
+            return []
+        return self._read_file(file_path)
+
+    def _read_meta(self, file_path):
+        try:
+            with open(os.path.splitext(file_path)[0] + '.meta', 'r') as f:
+                return json.load(f)
+        except (IOError, ValueError):
+            return {}
+
+    def get_series_versioned(self, patient_id, study_id, series_name):
+        file_path = self.series_path(patient_id, study_id, series_name)
+        with self._lock:
+            annotations = self.get_series(patient_id, study_id, series_name)
+            return annotations, self._read_meta(file_path).get('version', 0)
+
+    def _load(self, file_path, patient_id, study_id, series_name, expected_version):
+        """Read a series for a write: (annotations, next_id, version), checking expected_version"""
+        annotations = self.get_series(patient_id, study_id, series_name)
+        meta = self._read_meta(file_path)
+        # Series written before IDs were tracked have no meta file
+        next_id = assign_ids(annotations, meta.get('next_id', 1))
+        version = meta.get('version', 0)
+        check_version(expected_version, version, annotations)
+        return annotations, next_id, version
+
+    def _write(self, file_path, annotations, next_id, version):
+        with open(file_path, 'w') as f:
+            json.dump(annotations, f, indent=2)
+        with open(os.path.splitext(file_path)[0] + '.meta', 'w') as f:
+            json.dump({'next_id': next_id, 'version': version}, f)
+
+    def save_series(self, patient_id, study_id, series_name, annotations, expected_version=None):
+        file_path = self.series_path(patient_id, study_id, series_name)
+        with self._lock:
+            _, next_id, version = self._load(file_path, patient_id, study_id, series_name, expected_version)
+            next_id = assign_ids(annotations, next_id)
+            self._write(file_path, annotations, next_id, version + 1)
+        return version + 1
+
+    def insert(self, patient_id, study_id, series_name, annotation, expected_version=None):
+        file_path = self.series_path(patient_id, study_id, series_name)
+        with self._lock:
+            annotations, next_id, version = self._load(file_path, patient_id, study_id, series_name,
+                                                       expected_version)
+            annotation['id'] = str(next_id)
+            annotations.append(annotation)
+            self._write(file_path, annotations, next_id + 1, version + 1)
+        return annotation, version + 1
+
+    def insert_many(self, patient_id, study_id, series_name, annotations, expected_version=None):
+        file_path = self.series_path(patient_id, study_id, series_name)
+        with self._lock:
+            stored, next_id, version = self._load(file_path, patient_id, study_id, series_name, expected_version)
+            for annotation in annotations:
+                annotation['id'] = str(next_id)
+                next_id += 1
+            self._write(file_path, stored + list(annotations), next_id, version + 1)
+        return annotations, version + 1
+
+    def update(self, patient_id, study_id, series_name, annotation_id, fields, expected_version=None):
+        file_path = self.series_path(patient_id, study_id, series_name)
+        with self._lock:
+            annotations, next_id, version = self._load(file_path, patient_id, study_id, series_name,
+                                                        expected_version)
+            annotation = next((a for a in annotations if a.get('id') == annotation_id), None)
+            if annotation is None:
+                return None, None, version
+            before = dict(annotation)
+            annotation.update(fields)
+            self._write(file_path, annotations, next_id, version + 1)
+        return before, annotation, version + 1
+
+    def delete(self, patient_id, study_id, series_name, annotation_id, expected_version=None):
+        file_path = self.series_path(patient_id, study_id, series_name)
+        with self._lock:
+            annotations, next_id, version = self._load(file_path, patient_id, study_id, series_name,
+                                                        expected_version)
+            removed = [(position, a) for position, a in enumerate(annotations) if a.get('id') == annotation_id]
+            if not removed:
+                return [], version
+            remaining = [a for a in annotations if a.get('id') != annotation_id]
+            self._write(file_path, remaining, next_id, version + 1)
+        return removed, version + 1
+
+    def series_states(self):
+        states = {}
+        if not os.path.isdir(self.data_dir):
+            return states
+        for patient_id in os.listdir(self.data_dir):
+            patient_dir = os.path.join(self.data_dir, patient_id)
+            if not os.path.isdir(patient_dir):
+                continue
+            for study_id in os.listdir(patient_dir):
+                study_dir = os.path.join(patient_dir, study_id)
+                if not os.path.isdir(study_dir):
+                    continue
+                for filename in os.listdir(study_dir):
+                    if filename.endswith('.meta'):
+                        meta = self._read_meta(os.path.join(study_dir, filename))
+                        states[(patient_id, study_id, os.path.splitext(filename)[0])] = (
+                            meta.get('next_id', 1), meta.get('version', 0))
+        return states
+
+    def restore_series(self, patient_id, study_id, series_name, annotations, next_id, version):
+        file_path = self.series_path(patient_id, study_id, series_name)
+        with self._lock:
+            self._write(file_path, annotations, assign_ids(annotations, next_id), version)
+
+    def _study_files(self, patient_id, study_id):
+        """Yield (series_name, file_path) for the annotation files of a study"""
+        study_dir = os.path.join(self.data_dir, patient_id, study_id)
+        if not os.path.isdir(study_dir):
+            return
+        for filename in os.listdir(study_dir):
+            if filename.endswith('.json'):
+                yield os.path.splitext(filename)[0], os.path.join(study_dir, filename)
+
+    def get_patient(self, patient_id):
+        annotations_dir = os.path.join(self.data_dir, patient_id)
+        if not os.path.exists(annotations_dir):
+            return {}
+
+        all_annotations = {}
+        for study_id in os.listdir(annotations_dir):
+            if os.path.isdir(os.path.join(annotations_dir, study_id)):
+                all_annotations[study_id] = {
+                    series_name: self._read_file(file_path)
+                    for series_name, file_path in self._study_files(patient_id, study_id)
+                }
+        return all_annotations
+
+    def study_has_annotations(self, patient_id, study_id):
+        return any(self._read_file(file_path) for _, file_path in self._study_files(patient_id, study_id))
+
+    def iter_series(self):
+        if not os.path.isdir(self.data_dir):
+            return
+        for patient_id in sorted(os.listdir(self.data_dir)):
+            if not os.path.isdir(os.path.join(self.data_dir, patient_id)):
+                # e.g. spinenet_results.json
+                continue
+            for study_id, series in sorted(self.get_patient(patient_id).items()):
+                for series_name, annotations in sorted(series.items()):
+                    yield patient_id, study_id, series_name, annotations
+
+SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS annotations (
+    patient_id TEXT NOT NULL,
+    study_id TEXT NOT NULL,
+    series_name TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    annotation_id TEXT,
+    level TEXT,
+    finding TEXT,
+    data TEXT NOT NULL,
+    PRIMARY KEY (patient_id, study_id, series_name, position)
+);
+CREATE INDEX IF NOT EXISTS idx_annotations_id ON annotations (patient_id, study_id, series_name, annotation_id);
+CREATE INDEX IF NOT EXISTS idx_annotations_level ON annotations (level);
+CREATE INDEX IF NOT EXISTS idx_annotations_finding ON annotations (finding);
+CREATE TABLE IF NOT EXISTS series_ids (
+    patient_id TEXT NOT NULL,
+    study_id TEXT NOT NULL,
+    series_name TEXT NOT NULL,
+    next_id INTEGER NOT NULL,
+    version INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (patient_id, study_id, series_name)
+);
+"""
+
+class SQLiteAnnotationStore(AnnotationStore):
+    """
+    Annotation store backed by a SQLite database in WAL mode
+
+    One row per annotation holds the full annotation as JSON plus its list
+    position and the indexed columns. The primary key indexes patient, study
+    and series, so a series or a whole patient is read with a single range
+    query; level and finding have their own indexes. Single-annotation
+    inserts, updates and deletes touch one row through indexed lookups, so
+    their cost does not grow with the series. The next free ID and the
+    version of each series are kept in series_ids; writes read and bump
+    them inside a BEGIN IMMEDIATE transaction, so version checks hold
+    across processes.
+    """
+
+    backend = 'sqlite'
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self._local = threading.local()
+
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        with self._connect() as conn:
+            conn.executescript(SQLITE_SCHEMA)
+            columns = [row[1] for row in conn.execute('PRAGMA table_info(series_ids)')]
+            if 'version' not in columns:
+                # Databases created before series versions were tracked
+                conn.execute('ALTER TABLE series_ids ADD COLUMN version INTEGER NOT NULL DEFAULT 0')
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    def get_series(self, patient_id, study_id, series_name):
+        rows = self._connect().execute(
+            'SELECT data FROM annotations WHERE patient_id = ? AND study_id = ? AND series_name = ? '
+            'ORDER BY position', (patient_id, study_id, series_name))
+        return [json.loads(data) for (data,) in rows]
+
+    def get_series_versioned(self, patient_id, study_id, series_name):
+        conn = self._connect()
+        with conn:
+            # One read transaction, so the version matches the annotations
+            conn.execute('BEGIN')
+            annotations = self.get_series(patient_id, study_id, series_name)
+            return annotations, self._series_state(conn, patient_id, study_id, series_name)[1]
+
+    def get_annotation(self, patient_id, study_id, series_name, annotation_id):
+        row = self._connect().execute(
+            'SELECT data FROM annotations WHERE patient_id = ? AND study_id = ? AND series_name = ? '
+            'AND annotation_id = ? ORDER BY position LIMIT 1',
+            (patient_id, study_id, series_name, annotation_id)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def _series_state(self, conn, patient_id, study_id, series_name):
+        """(next_id, version) of a series"""
+        row = conn.execute('SELECT next_id, version FROM series_ids '
+                           'WHERE patient_id = ? AND study_id = ? AND series_name = ?',
+                           (patient_id, study_id, series_name)).fetchone()
+        if row is not None:
+            return row
+        # Series imported or written before IDs were tracked
+        row = conn.execute('SELECT MAX(CAST(annotation_id AS INTEGER)) FROM annotations '
+                           'WHERE patient_id = ? AND study_id = ? AND series_name = ?',
+                           (patient_id, study_id, series_name)).fetchone()
+        return (row[0] or 0) + 1, 0
+
+    def _begin_write(self, conn, patient_id, study_id, series_name, expected_version):
+        """Start a write transaction on a series: (next_id, version), checking expected_version"""
+        # Take the write lock before reading the series state, so concurrent
+        # writers get distinct IDs and versions
+        conn.execute('BEGIN IMMEDIATE')
+        next_id, version = self._series_state(conn, patient_id, study_id, series_name)
+        if expected_version is not None and expected_version != version:
+            raise SeriesVersionConflict(version, self.get_series(patient_id, study_id, series_name))
+        return next_id, version
+
+    def _set_state(self, conn, patient_id, study_id, series_name, next_id, version):
+        conn.execute('INSERT OR REPLACE INTO series_ids (patient_id, study_id, series_name, next_id, version) '
+                     'VALUES (?, ?, ?, ?, ?)', (patient_id, study_id, series_name, next_id, version))
+
+    _INSERT = ('INSERT INTO annotations (patient_id, study_id, series_name, position, annotation_id, '
+               'level, finding, data) VALUES (?, ?, ?, ?, ?, ?, ?, ?)')
+
+    @staticmethod
+    def _row(patient_id, study_id, series_name, position, annotation):
+        return (patient_id, study_id, series_name, position,
+                str(annotation['id']) if annotation.get('id') is not None else None,
+                annotation.get('level'), annotation.get('finding'), json.dumps(annotation))
+
+    def save_series(self, patient_id, study_id, series_name, annotations, expected_version=None):
+        conn = self._connect()
+        with conn:
+            next_id, version = self._begin_write(conn, patient_id, study_id, series_name, expected_version)
+            next_id = assign_ids(annotations, next_id)
+            conn.execute('DELETE FROM annotations WHERE patient_id = ? AND study_id = ? AND series_name = ?',
+                         (patient_id, study_id, series_name))
+            conn.executemany(self._INSERT, [self._row(patient_id, study_id, series_name, position, a)
+                                            for position, a in enumerate(annotations)])
+            self._set_state(conn, patient_id, study_id, series_name, next_id, version + 1)
+        return version + 1
+
+    def insert(self, patient_id, study_id, series_name, annotation, expected_version=None):
+        conn = self._connect()
+        with conn:
+            next_id, version = self._begin_write(conn, patient_id, study_id, series_name, expected_version)
+            row = conn.execute('SELECT MAX(position) FROM annotations '
+                               'WHERE patient_id = ? AND study_id = ? AND series_name = ?',
+                               (patient_id, study_id, series_name)).fetchone()
+            position = 0 if row[0] is None else row[0] + 1
+            annotation['id'] = str(next_id)
+            conn.execute(self._INSERT, self._row(patient_id, study_id, series_name, position, annotation))
+            self._set_state(conn, patient_id, study_id, series_name, next_id + 1, version + 1)
+        return annotation, version + 1
+
+    def insert_many(self, patient_id, study_id, series_name, annotations, expected_version=None):
+        conn = self._connect()
+        with conn:
+            next_id, version = self._begin_write(conn, patient_id, study_id, series_name, expected_version)
+            row = conn.execute('SELECT MAX(position) FROM annotations '
+                               'WHERE patient_id = ? AND study_id = ? AND series_name = ?',
+                               (patient_id, study_id, series_name)).fetchone()
+            position = 0 if row[0] is None else row[0] + 1
+            for offset, annotation in enumerate(annotations):
+                annotation['id'] = str(next_id + offset)
+            conn.executemany(self._INSERT, [self._row(patient_id, study_id, series_name, position + offset, a)
+                                            for offset, a in enumerate(annotations)])
+            self._set_state(conn, patient_id, study_id, series_name, next_id + len(annotations), version + 1)
+        return annotations, version + 1
+
+    def update(self, patient_id, study_id, series_name, annotation_id, fields, expected_version=None):
+        conn = self._connect()
+        with conn:
+            next_id, version = self._begin_write(conn, patient_id, study_id, series_name, expected_version)
+            row = conn.execute('SELECT rowid, data FROM annotations WHERE patient_id = ? AND study_id = ? '
+                               'AND series_name = ? AND annotation_id = ?',
+                               (patient_id, study_id, series_name, annotation_id)).fetchone()
+            if row is None:
+                return None, None, version
+            before = json.loads(row[1])
+            annotation = dict(before, **fields)
+            conn.execute('UPDATE annotations SET level = ?, finding = ?, data = ? WHERE rowid = ?',
+                         (annotation.get('level'), annotation.get('finding'), json.dumps(annotation), row[0]))
+            self._set_state(conn, patient_id, study_id, series_name, next_id, version + 1)
+        return before, annotation, version + 1
+
+    def delete(self, patient_id, study_id, series_name, annotation_id, expected_version=None):
+        conn = self._connect()
+        with conn:
+            next_id, version = self._begin_write(conn, patient_id, study_id, series_name, expected_version)
+            key = (patient_id, study_id, series_name)
+            rows = conn.execute(
+                'SELECT rowid, data, (SELECT COUNT(*) FROM annotations AS earlier WHERE earlier.patient_id = ? '
+                'AND earlier.study_id = ? AND earlier.series_name = ? AND earlier.position < annotations.position) '
+                'FROM annotations WHERE patient_id = ? AND study_id = ? AND series_name = ? AND annotation_id = ? '
+                'ORDER BY position', key + key + (annotation_id,)).fetchall()
+            if not rows:
+                return [], version
+            conn.executemany('DELETE FROM annotations WHERE rowid = ?', [(rowid,) for rowid, _, _ in rows])
+            self._set_state(conn, patient_id, study_id, series_name, next_id, version + 1)
+        return [(position, json.loads(data)) for _, data, position in rows], version + 1
+
+    def series_states(self):
+        rows = self._connect().execute('SELECT patient_id, study_id, series_name, next_id, version FROM series_ids')
+        return {(patient_id, study_id, series_name): (next_id, version)
+                for patient_id, study_id, series_name, next_id, version in rows}
+
+    def restore_series(self, patient_id, study_id, series_name, annotations, next_id, version):
+        conn = self._connect()
+        with conn:
+            conn.execute('BEGIN IMMEDIATE')
+            next_id = assign_ids(annotations, next_id)
+            conn.execute('DELETE FROM annotations WHERE patient_id = ? AND study_id = ? AND series_name = ?',
+                         (patient_id, study_id, series_name))
+            conn.executemany(self._INSERT, [self._row(patient_id, study_id, series_name, position, a)
+                                            for position, a in enumerate(annotations)])
+            self._set_state(conn, patient_id, study_id, series_name, next_id, version)
+
+    def get_patient(self, patient_id):
+        all_annotations = {}
+        rows = self._connect().execute(
+            'SELECT study_id, series_name, data FROM annotations WHERE patient_id = ? '
+            'ORDER BY study_id, series_name, position', (patient_id,))
+        for study_id, series_name, data in rows:
+            all_annotations.setdefault(study_id, {}).setdefault(series_name, []).append(json.loads(data))
+        return all_annotations
+
+    def study_has_annotations(self, patient_id, study_id):
+        row = self._connect().execute('SELECT 1 FROM annotations WHERE patient_id = ? AND study_id = ? LIMIT 1',
+                                      (patient_id, study_id)).fetchone()
+        return row is not None
+
+    def iter_series(self):
+        rows = self._connect().execute(
+            'SELECT patient_id, study_id, series_name, data FROM annotations '
+            'ORDER BY patient_id, study_id, series_name, position')
+        current, annotations = None, []
+        for patient_id, study_id, series_name, data in rows:
+            key = (patient_id, study_id, series_name)
+            if key != current:
+                if current is not None:
+                    yield current + (annotations,)
+                current, annotations = key, []
+            annotations.append(json.loads(data))
+        if current is not None:
+            yield current + (annotations,)
+
+    def iter_annotations(self, finding=None, level=None):
+        # Filters run in SQL against the finding and level indexes
+        conditions, params = [], []
+        if finding is not None:
+            conditions.append('finding = ?')
+            params.append(finding)
+        if level is not None:
+            conditions.append('level = ?')
+            params.append(level)
+        where = f"WHERE {' AND '.join(conditions)} " if conditions else ''
+        rows = self._connect().execute(
+            f'SELECT patient_id, study_id, series_name, data FROM annotations {where}'
+            'ORDER BY patient_id, study_id, series_name, position', params)
+        for patient_id, study_id, series_name, data in rows:
+            yield patient_id, study_id, series_name, json.loads(data)
+
+def create_annotation_store(config):
+    """Create the annotation store selected by ANNOTATION_BACKEND ('files' or 'sqlite')"""
+    backend = config.get('ANNOTATION_BACKEND', 'files')
+    if backend == 'sqlite':
+        return SQLiteAnnotationStore(config['ANNOTATION_DB_FILE'])
+    if backend == 'files':
+        return FileAnnotationStore(config['ANNOTATION_DATA_DIR'])
+    raise ValueError(f"Unknown annotation backend: {backend}")
+
+def get_annotation_store():
+    """Get the annotation store for the current app"""
+    store = current_app.extensions.get('annotation_store')
+    if store is None:
+        store = create_annotation_store(current_app.config)
+        current_app.extensions['annotation_store'] = store
+    return store
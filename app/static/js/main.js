@@ -71,6 +71,27 @@ function updatePatientStatus(patientId, status) {
     });
 }
 
+/**
+ * Update many patient and study statuses in a single request
+ * @param {Array<Object>} updates - Items of {patient_id, status, study_id (optional)}
+ * @returns {Promise<Object>} - Resolves with the server response ({success, updated, patients})
+ */
+function updateStatuses(updates) {
+    return fetch('/api/update_statuses', {
+        method: 'POST',
+        headers: {
+            'Content-Type': 'application/json',
+        },
+        body: JSON.stringify({ updates: updates })
+    })
+    .then(response => response.json().then(data => {
+        if (!response.ok || !data.success) {
+            throw new Error(data.error || 'Failed to update statuses');
+        }
+        return data;
+    }));
+}
+
 /**
  * Handle DICOM viewer interactions (placeholder)
  * In a real implementation, this would interact with a DICOM viewer library
@@ -172,4 +193,121 @@ class DicomViewer {
         // In a real implementation, you would render the current DICOM image
         console.log(`Rendering image ${this.currentIndex + 1} of ${this.images.length}`);
     }
-}
\ No newline at end of file
+}
+/**
+ * Read a series bundle response (see iter_series_bundle in app/main/utils.py)
+ * progressively, calling onSlice as soon as each slice has fully arrived
+ * @param {Response} response - Fetch response for /dicom-series/...
+ * @param {function} onSlice - Called as onSlice(blob, index, total, fileName);
+ *                             blob is null for slices the server could not render
+ * @returns {Promise<number>} - Resolves with the number of slices once the stream ends
+ */
+async function readSeriesBundle(response, onSlice) {
+    const reader = response.body.getReader();
+    let buffer = new Uint8Array(0);
+    let offset = 0;
+    let total = null;
+    let index = 0;
+    const decoder = new TextDecoder();
+
+    // Wait until at least n unread bytes are buffered; false if the stream ended first
+    const ensure = async (n) => {
+        while (buffer.length - offset < n) {
+            const { done, value } = await reader.read();
+            if (done) return false;
+            const merged = new Uint8Array(buffer.length - offset + value.length);
+            merged.set(buffer.subarray(offset), 0);
+            merged.set(value, buffer.length - offset);
+            buffer = merged;
+            offset = 0;
+        }
+        return true;
+    };
+    const take = (n) => {
+        const bytes = buffer.subarray(offset, offset + n);
+        offset += n;
+        return bytes;
+    };
+    const readUint = (n) => {
+        const view = new DataView(buffer.buffer, buffer.byteOffset + offset, n);
+        offset += n;
+        return n === 2 ? view.getUint16(0) : view.getUint32(0);
+    };
+
+    if (!(await ensure(8)) || decoder.decode(take(4)) !== 'DSB1') {
+        throw new Error('Invalid series bundle');
+    }
+    total = readUint(4);
+
+    while (index < total) {
+        if (!(await ensure(2))) break;
+        const nameLength = readUint(2);
+        if (!(await ensure(nameLength + 4))) break;
+        const fileName = decoder.decode(take(nameLength));
+        const dataLength = readUint(4);
+        if (!(await ensure(dataLength))) break;
+        const blob = dataLength > 0 ? new Blob([take(dataLength).slice()], { type: 'image/jpeg' }) : null;
+        onSlice(blob, index, total, fileName);
+        index++;
+    }
+
+    if (index < total) {
+        throw new Error(`Series bundle ended after ${index} of ${total} slices`);
+    }
+    return total;
+}
+
+/**
+ * Fetch a series as a raw 16-bit volume (see iter_series_volume in app/main/utils.py)
+ * @param {string} patientId - The patient ID
+ * @param {string} studyId - The study ID
+ * @param {string} seriesName - The series name
+ * @returns {Promise<{header: Object, data: Uint16Array|Int16Array}>} - Volume header and pixel data
+ */
+function fetchDicomVolume(patientId, studyId, seriesName) {
+    return fetch(`/api/dicom-volume/${patientId}/${studyId}/${seriesName}`)
+        .then(response => {
+            if (!response.ok) {
+                throw new Error('Failed to fetch DICOM volume');
+            }
+            return response.arrayBuffer();
+        })
+        .then(buffer => {
+            const headerLength = new DataView(buffer).getUint32(0, true);
+            const header = JSON.parse(new TextDecoder().decode(new Uint8Array(buffer, 4, headerLength)));
+            const [slices, rows, columns] = header.shape;
+            const ArrayType = header.dtype === 'int16' ? Int16Array : Uint16Array;
+            const data = new ArrayType(buffer, 4 + headerLength, slices * rows * columns);
+            return { header, data };
+        });
+}
+
+/**
+ * Apply a window/level to one slice of a raw volume, writing grayscale pixels into imageData
+ * @param {Object} volume - Volume returned by fetchDicomVolume
+ * @param {number} index - Slice index
+ * @param {number} center - Window center, in rescaled (modality) units
+ * @param {number} width - Window width, in rescaled (modality) units
+ * @param {ImageData} imageData - Target image data of size columns x rows
+ */
+function applyVolumeWindow(volume, index, center, width, imageData) {
+    const [, rows, columns] = volume.header.shape;
+    const slope = volume.header.rescale_slope;
+    const intercept = volume.header.rescale_intercept;
+    const invert = Boolean(volume.header.invert);
+    const sliceSize = rows * columns;
+    const pixels = volume.data.subarray(index * sliceSize, (index + 1) * sliceSize);
+    const out = imageData.data;
+
+    // Map stored values straight to display values: lower/upper bounds of the window
+    const low = center - width / 2;
+    const scale = 255 / Math.max(width, 1);
+
+    for (let i = 0, j = 0; i < sliceSize; i++, j += 4) {
+        let value = ((pixels[i] * slope + intercept) - low) * scale;
+        value = value < 0 ? 0 : (value > 255 ? 255 : value);
+        if (invert) value = 255 - value;
+        out[j] = out[j + 1] = out[j + 2] = value;
+        out[j + 3] = 255;
+    }
+}
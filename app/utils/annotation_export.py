@@ -0,0 +1,259 @@
+import io
+import csv
+import json
+import time
+from datetime import datetime
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+# Output columns and their Parquet types; other annotation fields go to 'extra' as JSON
+EXPORT_COLUMNS = [
+    ('patient_id', 'string'),
+    ('patient_status', 'string'),
+    ('study_id', 'string'),
+    ('study_date', 'string'),
+    ('study_status', 'string'),
+    ('series_name', 'string'),
+    ('series_uid', 'string'),
+    ('instance_count', 'int64'),
+    ('annotation_id', 'string'),
+    ('finding', 'string'),
+    ('value', 'string'),
+    ('level', 'string'),
+    ('side', 'string'),
+    ('relevant_to_decision', 'bool'),
+    ('notes', 'string'),
+    ('created_by', 'string'),
+    ('created_at', 'string'),
+    ('updated_by', 'string'),
+    ('updated_at', 'string'),
+    ('extra', 'string'),
+]
+
+EXPORT_FORMATS = ('parquet', 'csv', 'jsonl')
+
+EXPORT_MIMETYPES = {
+    'parquet': 'application/vnd.apache.parquet',
+    'csv': 'text/csv',
+    'jsonl': 'application/x-ndjson',
+}
+
+# Rows per Parquet row group / per chunk of CSV or JSONL output
+EXPORT_BATCH_SIZE = 10000
+
+# Annotation fields that have their own column
+_ANNOTATION_COLUMNS = {
+    'id', 'finding', 'value', 'level', 'side', 'relevant_to_decision', 'notes',
+    'created_by', 'created_at', 'updated_by', 'updated_at'
+}
+
+def available_formats():
+    """Export formats usable in this environment (Parquet needs pyarrow)"""
+    return [fmt for fmt in EXPORT_FORMATS if fmt != 'parquet' or pyarrow is not None]
+
+def default_format():
+    return 'parquet' if pyarrow is not None else 'csv'
+
+def _study_date(study_id):
+    """ISO date of a YYYYMMDD_* study folder, or None"""
+    try:
+        return datetime.strptime(study_id[:8], '%Y%m%d').date().isoformat()
+    except ValueError:
+        return None
+
+def parse_bound(value):
+    """
+    Validate a since/until bound (ISO date or datetime)
+
+    Returns:
+        The bound, or None if value is empty
+
+    Raises:
+        ValueError: value is not an ISO date or datetime
+    """
+    if not value:
+        return None
+    datetime.fromisoformat(value)
+    return value
+
+def _in_range(timestamp, since, until):
+    """
+    Check an ISO timestamp against an inclusive [since, until] range
+
+    Bounds may be dates or datetimes; comparing against the timestamp's
+    prefix of the same length makes until=2024-05-31 include the whole day.
+    """
+    if since is not None and (not timestamp or timestamp[:len(since)] < since):
+        return False
+    if until is not None and (not timestamp or timestamp[:len(until)] > until):
+        return False
+    return True
+
+def iter_export_rows(annotation_store, status_store=None, catalog=None,
+                     finding=None, level=None, annotator=None, since=None, until=None):
+    """
+    Yield one flat dict per annotation, joined with patient, study and series metadata
+
+    Annotations are read from the store one series (file backend) or one row
+    (SQLite backend) at a time, and status and catalog lookups are cached for
+    the current patient and series only, so memory stays bounded whatever the
+    size of the export.
+
+    Args:
+        annotation_store: AnnotationStore to read
+        status_store: StatusStore for patient and study statuses (columns left empty if None)
+        catalog: ArchiveCatalog for series UID and instance count (columns left empty if None)
+        finding, level: Only annotations with this finding / at this level
+        annotator: Only annotations created by this user
+        since, until: Only annotations last changed within this inclusive range (ISO date or datetime)
+    """
+    patient_key, patient_entry = None, None
+    series_key, series_summary = None, None
+
+    for patient_id, study_id, series_name, annotation in annotation_store.iter_annotations(finding, level):
+        if annotator is not None and annotation.get('created_by') != annotator:
+            continue
+        if not _in_range(annotation.get('updated_at') or annotation.get('created_at'), since, until):
+            continue
+
+        if patient_id != patient_key:
+            patient_key = patient_id
+            patient_entry = (status_store.get_patient(patient_id) if status_store is not None else None) or {}
+        if (patient_id, study_id, series_name) != series_key:
+            series_key = (patient_id, study_id, series_name)
+            series_summary = (catalog.get_series_summary(patient_id, study_id, series_name)
+                              if catalog is not None else None) or {}
+
+        extra = {key: value for key, value in annotation.items() if key not in _ANNOTATION_COLUMNS}
+        relevant = annotation.get('relevant_to_decision')
+        yield {
+            'patient_id': patient_id,
+            'patient_status': patient_entry.get('status'),
+            'study_id': study_id,
+            'study_date': _study_date(study_id),
+            'study_status': patient_entry.get('studies', {}).get(study_id, {}).get('status'),
+            'series_name': series_name,
+            'series_uid': series_summary.get('series_uid'),
+            'instance_count': series_summary.get('instance_count'),
+            'annotation_id': annotation.get('id'),
+            'finding': annotation.get('finding'),
+            'value': annotation.get('value'),
+            'level': annotation.get('level'),
+            'side': annotation.get('side'),
+            'relevant_to_decision': None if relevant is None else bool(relevant),
+            'notes': annotation.get('notes'),
+            'created_by': annotation.get('created_by'),
+            'created_at': annotation.get('created_at'),
+            'updated_by': annotation.get('updated_by'),
+            'updated_at': annotation.get('updated_at'),
+            'extra': json.dumps(extra) if extra else None,
+        }
+
+def _batches(rows, batch_size):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+class _ChunkBuffer(io.RawIOBase):
+    """Write-only file object collecting what was written until drained"""
+
+    def __init__(self):
+        self._chunks = []
+        self._position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+def _iter_parquet(batches):
+    schema = pyarrow.schema([(name, pyarrow.type_for_alias(kind)) for name, kind in EXPORT_COLUMNS])
+    sink = _ChunkBuffer()
+    writer = pyarrow.parquet.ParquetWriter(sink, schema)
+    try:
+        for batch in batches:
+            # One row group per batch, sent as soon as it is written
+            writer.write_table(pyarrow.Table.from_pylist(batch, schema=schema))
+            yield sink.drain()
+    finally:
+        writer.close()
+    yield sink.drain()
+
+def _iter_csv(batches):
+    columns = [name for name, _ in EXPORT_COLUMNS]
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=columns)
+    writer.writeheader()
+    for batch in batches:
+        writer.writerows(batch)
+        yield buffer.getvalue().encode('utf-8')
+        buffer.seek(0)
+        buffer.truncate()
+    yield buffer.getvalue().encode('utf-8')
+
+def _iter_jsonl(batches):
+    for batch in batches:
+        yield ''.join(json.dumps(row) + '\n' for row in batch).encode('utf-8')
+
+def iter_export(rows, fmt, batch_size=EXPORT_BATCH_SIZE, stats=None):
+    """
+    Encode export rows as a stream of byte chunks
+
+    Rows are consumed batch_size at a time, so at most one batch is held in
+    memory. Parquet output has one row group per batch.
+
+    Args:
+        rows: Iterable of dicts from iter_export_rows
+        fmt: One of EXPORT_FORMATS
+        stats: Optional dict, filled with rows, bytes, seconds and rows_per_second
+               once the stream is exhausted
+
+    Raises:
+        ValueError: Unknown format, or 'parquet' without pyarrow installed
+    """
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"Unknown export format: {fmt}")
+    if fmt == 'parquet' and pyarrow is None:
+        raise ValueError("Parquet export needs pyarrow; use csv or jsonl")
+    # Validated here rather than in the generator, so errors surface before streaming starts
+    return _iter_encoded(rows, fmt, batch_size, stats)
+
+def _iter_encoded(rows, fmt, batch_size, stats):
+    counters = {'rows': 0, 'bytes': 0}
+    start = time.time()
+
+    def counted(batches):
+        for batch in batches:
+            counters['rows'] += len(batch)
+            yield batch
+
+    encoders = {'parquet': _iter_parquet, 'csv': _iter_csv, 'jsonl': _iter_jsonl}
+    for chunk in encoders[fmt](counted(_batches(rows, batch_size))):
+        if chunk:
+            counters['bytes'] += len(chunk)
+            yield chunk
+
+    if stats is not None:
+        seconds = time.time() - start
+        stats.update(counters, seconds=seconds,
+                     rows_per_second=counters['rows'] / seconds if seconds > 0 else 0.0)
@@ -0,0 +1,517 @@
+import os
+import time
+import sqlite3
+import threading
+from flask import current_app, has_request_context
+from concurrent.futures import ThreadPoolExecutor
+from app.utils.dicom_header import read_dicom_header
+from app.utils.scanner import DirectoryScanner
+
+# Per-instance header fields stored in the catalog
+INSTANCE_TAGS = ['SeriesInstanceUID', 'InstanceNumber', 'ImagePositionPatient']
+
+# Directory depth of each level below MRI_ROOT_DIR
+DEPTH_ROOT = 0
+DEPTH_PATIENT = 1
+DEPTH_STUDY = 2
+DEPTH_SERIES = 3
+DEPTH_INSTANCE = 4
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS directories (
+    path TEXT PRIMARY KEY,
+    mtime_ns INTEGER
+);
+CREATE TABLE IF NOT EXISTS patients (
+    patient_id TEXT PRIMARY KEY
+);
+CREATE TABLE IF NOT EXISTS studies (
+    patient_id TEXT NOT NULL,
+    study_id TEXT NOT NULL,
+    PRIMARY KEY (patient_id, study_id)
+);
+CREATE TABLE IF NOT EXISTS series (
+    patient_id TEXT NOT NULL,
+    study_id TEXT NOT NULL,
+    series_name TEXT NOT NULL,
+    series_uid TEXT,
+    PRIMARY KEY (patient_id, study_id, series_name)
+);
+CREATE TABLE IF NOT EXISTS instances (
+    patient_id TEXT NOT NULL,
+    study_id TEXT NOT NULL,
+    series_name TEXT NOT NULL,
+    file_name TEXT NOT NULL,
+    instance_number INTEGER,
+    position_x REAL,
+    position_y REAL,
+    position_z REAL,
+    series_uid TEXT,
+    file_size INTEGER,
+    mtime_ns INTEGER,
+    PRIMARY KEY (patient_id, study_id, series_name, file_name)
+);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+def is_valid_study_name(name):
+    """Study folders are named YYYYMMDD_<suffix> (see is_valid_study_folder)"""
+    from app.main.utils import is_valid_study_folder
+    return is_valid_study_folder(name)
+
+def catalog_entry_filter(depth, entry):
+    """
+    Select the directory entries that belong in the catalog
+    
+    Patient, study and series levels keep non-hidden directories (studies must
+    be named like YYYYMMDD_MR); series directories keep their .dcm files.
+    """
+    if entry.name.startswith('.'):
+        return False
+    if depth == DEPTH_SERIES:
+        return entry.name.lower().endswith('.dcm') and entry.is_file()
+    if not entry.is_dir():
+        return False
+    if depth == DEPTH_PATIENT:
+        return is_valid_study_name(entry.name)
+    return True
+
+def is_on_path(rel_path, target):
+    """Check whether rel_path is target, one of its ancestors or below it"""
+    return (rel_path == target or target.startswith(rel_path + '/') or
+            rel_path.startswith(target + '/'))
+
+def read_instance_fields(full_path):
+    """Read the catalogued header fields of a DICOM instance"""
+    fields = {
+        'instance_number': None,
+        'position': (None, None, None),
+        'series_uid': None,
+        'file_size': None,
+        'mtime_ns': None
+    }
+    try:
+        st = os.stat(full_path)
+        fields['file_size'] = st.st_size
+        fields['mtime_ns'] = st.st_mtime_ns
+        
+        ds = read_dicom_header(full_path, INSTANCE_TAGS)
+        if 'InstanceNumber' in ds and ds.InstanceNumber not in (None, ''):
+            fields['instance_number'] = int(ds.InstanceNumber)
+        position = getattr(ds, 'ImagePositionPatient', None)
+        if position is not None and len(position) == 3:
+            fields['position'] = tuple(float(v) for v in position)
+        fields['series_uid'] = str(ds.SeriesInstanceUID) if 'SeriesInstanceUID' in ds else None
+    except Exception:
+        # Unreadable or non-DICOM files are still listed, without header fields
+        pass
+    return fields
+
+class ArchiveCatalog:
+    """
+    SQLite catalog of the patient/study/series/instance tree under MRI_ROOT_DIR
+    
+    The catalog stores the mtime of every directory it has listed. A refresh
+    stats each known directory and only re-lists those whose mtime changed,
+    inserting and deleting the differences; unchanged subtrees cost one stat
+    per directory and no listing at all. The filesystem side of a refresh
+    (stats, listings and header reads of new instances) runs on scan_workers
+    threads; database writes stay on the calling thread.
+    """
+    
+    def __init__(self, db_path, mri_root, scan_workers=8):
+        self.db_path = db_path
+        self.mri_root = mri_root
+        self.scan_workers = scan_workers
+        self.last_scan_stats = None
+        self._local = threading.local()
+        self._refresh_lock = threading.Lock()
+        self._refresher_lock = threading.Lock()
+        self._refresher_started = False
+        
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        with self._connect() as conn:
+            conn.executescript(SCHEMA)
+    
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+    
+    # Queries
+    
+    def list_patients(self):
+        """List all catalogued patient IDs"""
+        rows = self._connect().execute('SELECT patient_id FROM patients ORDER BY patient_id')
+        return [row[0] for row in rows]
+    
+    def list_studies(self, patient_id):
+        """List the study IDs of a patient"""
+        rows = self._connect().execute(
+            'SELECT study_id FROM studies WHERE patient_id = ? ORDER BY study_id', (patient_id,))
+        return [row[0] for row in rows]
+    
+    def list_series(self, patient_id, study_id):
+        """List the series names of a study"""
+        rows = self._connect().execute(
+            'SELECT series_name FROM series WHERE patient_id = ? AND study_id = ? ORDER BY series_name',
+            (patient_id, study_id))
+        return [row[0] for row in rows]
+    
+    def list_instances(self, patient_id, study_id, series_name):
+        """List the DICOM file names of a series, ordered by InstanceNumber then file name"""
+        rows = self._connect().execute(
+            'SELECT file_name FROM instances WHERE patient_id = ? AND study_id = ? AND series_name = ? '
+            'ORDER BY instance_number IS NULL, instance_number, file_name',
+            (patient_id, study_id, series_name))
+        return [row[0] for row in rows]
+    
+    def get_series_summary(self, patient_id, study_id, series_name):
+        """Get {'series_uid', 'instance_count'} of a catalogued series, or None if it is not catalogued"""
+        conn = self._connect()
+        row = conn.execute(
+            'SELECT series_uid FROM series WHERE patient_id = ? AND study_id = ? AND series_name = ?',
+            (patient_id, study_id, series_name)).fetchone()
+        if row is None:
+            return None
+        (count,) = conn.execute(
+            'SELECT COUNT(*) FROM instances WHERE patient_id = ? AND study_id = ? AND series_name = ?',
+            (patient_id, study_id, series_name)).fetchone()
+        return {'series_uid': row[0], 'instance_count': count}
+    
+    def has_directory(self, rel_path):
+        """Check whether a directory (relative to the root) has been listed into the catalog"""
+        row = self._connect().execute('SELECT 1 FROM directories WHERE path = ?', (rel_path,)).fetchone()
+        return row is not None
+    
+    def is_built(self):
+        """Check whether a full refresh of the catalog has finished, so its listings are complete"""
+        return self.get_meta('built_at') is not None
+    
+    def directory_mtime(self, rel_path):
+        """Get the mtime_ns a directory had when it was last listed, or None if it is not catalogued"""
+        row = self._connect().execute('SELECT mtime_ns FROM directories WHERE path = ?', (rel_path,)).fetchone()
+        return row[0] if row else None
+    
+    def list_directories(self, max_depth=DEPTH_SERIES):
+        """List the relative paths of all catalogued directories down to max_depth"""
+        paths = []
+        for (path,) in self._connect().execute('SELECT path FROM directories WHERE path != ?', ('',)):
+            if path.count('/') < max_depth:
+                paths.append(path)
+        return paths
+    
+    def get_meta(self, key, default=None):
+        row = self._connect().execute('SELECT value FROM meta WHERE key = ?', (key,)).fetchone()
+        return row[0] if row else default
+    
+    def set_meta(self, key, value):
+        with self._connect() as conn:
+            conn.execute('INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)', (key, value))
+    
+    def refresh_instance(self, parts):
+        """Re-read the header fields of a single catalogued instance, e.g. after it finished writing"""
+        full_path = os.path.join(self.mri_root, *parts)
+        with self._refresh_lock, self._connect() as conn:
+            known = conn.execute(
+                'SELECT 1 FROM instances WHERE patient_id = ? AND study_id = ? AND series_name = ? AND file_name = ?',
+                parts).fetchone()
+            if known and os.path.isfile(full_path):
+                self._insert_instance(conn, parts, read_instance_fields(full_path))
+    
+    # Refresh
+    
+    def claim_refresh(self, interval):
+        """
+        Claim the periodic refresh if no process has claimed it in the last interval seconds
+        
+        The check and the new last_refresh are written in one BEGIN IMMEDIATE
+        transaction, so of several processes sharing the catalog only one
+        walks the archive per interval.
+        """
+        now = time.time()
+        conn = self._connect()
+        with conn:
+            conn.execute('BEGIN IMMEDIATE')
+            row = conn.execute("SELECT value FROM meta WHERE key = 'last_refresh'").fetchone()
+            if row and now - float(row[0]) < interval:
+                return False
+            conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('last_refresh', ?)", (str(now),))
+        return True
+    
+    def refresh_if_stale(self, interval):
+        """Refresh the catalog if no process has refreshed it in the last interval seconds"""
+        if not self.claim_refresh(interval):
+            return None
+        return self.refresh()
+    
+    def refresh_in_background(self, interval):
+        """Start a thread refreshing the catalog every interval seconds, unless one is already running"""
+        with self._refresher_lock:
+            if self._refresher_started:
+                return
+            self._refresher_started = True
+        app = current_app._get_current_object()
+        threading.Thread(target=self._refresher_thread, args=(app, interval), daemon=True,
+                         name='catalog-refresh').start()
+    
+    def _refresher_thread(self, app, interval):
+        while True:
+            try:
+                with app.app_context():
+                    from app.main.utils import sync_status_with_archive
+                    stats = self.refresh_if_stale(interval)
+                    if stats:
+                        sync_status_with_archive(stats['changes'])
+                    if stats and (stats['added'] or stats['removed']):
+                        app.logger.info(f"Catalog refreshed: {stats['added']} entries added, "
+                                        f"{stats['removed']} removed in {stats['seconds']:.2f}s")
+            except Exception as e:
+                app.logger.error(f"Error refreshing archive catalog: {e}")
+            # Another process may hold the claim; check again well before it expires
+            time.sleep(min(interval, 30))
+    
+    def refresh(self, rel_path='', recursive=True, target=None):
+        """
+        Bring the catalog up to date with the filesystem below rel_path
+        
+        With recursive=False only rel_path itself is checked, plus any
+        directories below it that are new to the catalog; this is enough when
+        the caller knows exactly which directories changed. A target path
+        further restricts those new directories to the ones leading to and
+        below it, so linking one new patient does not walk its new siblings.
+        
+        Returns:
+            dict with the scanner counters (directories scanned and listed,
+            directories per second), entries added and removed, the elapsed
+            time, and under 'changes' the relative paths of added and removed
+            directories and the (patient, study) pairs of added and removed
+            studies and IDs of removed patients
+        """
+        with self._refresh_lock:
+            start = time.time()
+            stats = {
+                'added': 0,
+                'removed': 0,
+                'changes': {
+                    'added_dirs': [],
+                    'removed_dirs': [],
+                    'added_studies': [],
+                    'removed_studies': [],
+                    'removed_patients': []
+                }
+            }
+            conn = self._connect()
+            known_mtimes = dict(conn.execute('SELECT path, mtime_ns FROM directories'))
+            known_children = self._load_known_children(conn)
+            
+            scanner = DirectoryScanner(self.mri_root, max_depth=DEPTH_SERIES,
+                                       max_workers=self.scan_workers, entry_filter=catalog_entry_filter)
+            
+            with conn, ThreadPoolExecutor(max_workers=self.scan_workers) as header_reader:
+                if recursive:
+                    descend_filter = None
+                elif target is None:
+                    descend_filter = lambda rel: rel not in known_mtimes
+                else:
+                    descend_filter = lambda rel: rel not in known_mtimes and is_on_path(rel, target)
+                for result in scanner.walk(rel_path, known_mtimes, lambda rel: known_children.get(rel, ()),
+                                           descend_filter):
+                    self._apply_scan_result(conn, result, header_reader, stats)
+                
+                if rel_path == '' and recursive:
+                    conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('last_refresh', ?)",
+                                 (str(start),))
+                    conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('built_at', ?)",
+                                 (str(time.time()),))
+            
+            stats.update(scanner.stats())
+            stats['seconds'] = time.time() - start
+            self.last_scan_stats = stats
+            return stats
+    
+    def _load_known_children(self, conn):
+        """Map each catalogued root, patient and study path to its child names"""
+        children = {'': []}
+        for (patient_id,) in conn.execute('SELECT patient_id FROM patients'):
+            children[''].append(patient_id)
+        for patient_id, study_id in conn.execute('SELECT patient_id, study_id FROM studies'):
+            children.setdefault(patient_id, []).append(study_id)
+        for patient_id, study_id, series_name in conn.execute('SELECT patient_id, study_id, series_name FROM series'):
+            children.setdefault(f"{patient_id}/{study_id}", []).append(series_name)
+        return children
+    
+    def _apply_scan_result(self, conn, result, header_reader, stats):
+        """Write the differences found for one scanned directory to the catalog"""
+        parts = result.rel_path.split('/') if result.rel_path else []
+        
+        if result.mtime_ns is None:
+            if parts:
+                self.remove_entry(conn, parts)
+                self._record_change(stats, 'removed', parts)
+            return
+        
+        if result.names is None:
+            # Unchanged since the last refresh
+            return
+        
+        current = set(result.names)
+        known = set(self._known_children(conn, parts))
+        
+        for name in known - current:
+            self.remove_entry(conn, parts + [name])
+            self._record_change(stats, 'removed', parts + [name])
+        
+        added = sorted(current - known)
+        if result.depth == DEPTH_SERIES:
+            paths = [os.path.join(self.mri_root, *parts, name) for name in added]
+            for name, fields in zip(added, header_reader.map(read_instance_fields, paths)):
+                self._insert_instance(conn, parts + [name], fields)
+            stats['added'] += len(added)
+        else:
+            for name in added:
+                self._insert_entry(conn, parts + [name])
+                self._record_change(stats, 'added', parts + [name])
+        
+        conn.execute('INSERT OR REPLACE INTO directories (path, mtime_ns) VALUES (?, ?)',
+                     (result.rel_path, result.mtime_ns))
+    
+    def _record_change(self, stats, action, parts):
+        """Count an added or removed entry and record directory-level changes"""
+        stats[action] += 1
+        depth = len(parts)
+        if depth > DEPTH_SERIES:
+            return
+        
+        changes = stats['changes']
+        changes[f'{action}_dirs'].append('/'.join(parts))
+        if depth == DEPTH_STUDY:
+            changes[f'{action}_studies'].append(tuple(parts))
+        elif depth == DEPTH_PATIENT and action == 'removed':
+            changes['removed_patients'].append(parts[0])
+    
+    def _known_children(self, conn, parts):
+        depth = len(parts)
+        if depth == DEPTH_ROOT:
+            query = 'SELECT patient_id FROM patients'
+        elif depth == DEPTH_PATIENT:
+            query = 'SELECT study_id FROM studies WHERE patient_id = ?'
+        elif depth == DEPTH_STUDY:
+            query = 'SELECT series_name FROM series WHERE patient_id = ? AND study_id = ?'
+        else:
+            query = 'SELECT file_name FROM instances WHERE patient_id = ? AND study_id = ? AND series_name = ?'
+        return [row[0] for row in conn.execute(query, parts)]
+    
+    def _insert_entry(self, conn, parts):
+        depth = len(parts)
+        if depth == DEPTH_PATIENT:
+            conn.execute('INSERT OR IGNORE INTO patients (patient_id) VALUES (?)', parts)
+        elif depth == DEPTH_STUDY:
+            conn.execute('INSERT OR IGNORE INTO studies (patient_id, study_id) VALUES (?, ?)', parts)
+        elif depth == DEPTH_SERIES:
+            conn.execute('INSERT OR IGNORE INTO series (patient_id, study_id, series_name) VALUES (?, ?, ?)', parts)
+        else:
+            self._insert_instance(conn, parts, read_instance_fields(os.path.join(self.mri_root, *parts)))
+    
+    def _insert_instance(self, conn, parts, fields):
+        conn.execute(
+            'INSERT OR REPLACE INTO instances (patient_id, study_id, series_name, file_name, instance_number, '
+            'position_x, position_y, position_z, series_uid, file_size, mtime_ns) '
+            'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+            list(parts) + [fields['instance_number'], *fields['position'], fields['series_uid'],
+                           fields['file_size'], fields['mtime_ns']])
+        if fields['series_uid']:
+            conn.execute(
+                'UPDATE series SET series_uid = ? WHERE patient_id = ? AND study_id = ? AND series_name = ? '
+                'AND series_uid IS NULL', [fields['series_uid']] + list(parts[:3]))
+    
+    def remove_entry(self, conn, parts):
+        """Remove a patient, study, series or instance and everything below it"""
+        depth = len(parts)
+        if depth == DEPTH_INSTANCE:
+            conn.execute('DELETE FROM instances WHERE patient_id = ? AND study_id = ? AND series_name = ? '
+                         'AND file_name = ?', parts)
+            return
+        
+        columns = ['patient_id', 'study_id', 'series_name'][:depth]
+        where = ' AND '.join(f'{column} = ?' for column in columns)
+        # Tables from the instance level up to (and including) the level being removed
+        for table in ['instances', 'series', 'studies', 'patients'][:DEPTH_INSTANCE - depth + 1]:
+            conn.execute(f'DELETE FROM {table} WHERE {where}', parts)
+        
+        rel = '/'.join(parts)
+        conn.execute('DELETE FROM directories WHERE path = ? OR substr(path, 1, ?) = ?',
+                     (rel, len(rel) + 1, rel + '/'))
+
+def get_catalog():
+    """
+    Get the archive catalog for the current app
+    
+    Requests only read the catalog. When CATALOG_REFRESH_INTERVAL is set,
+    the first request of a serving process starts a background thread that
+    keeps it fresh; otherwise the watcher or scripts/scan_archive.py builds
+    and refreshes it. Until the first full refresh has finished (is_built())
+    callers list the filesystem.
+    
+    Returns None when the catalog is disabled, in which case callers list
+    the filesystem directly.
+    """
+    if not current_app.config.get('CATALOG_ENABLED', True):
+        return None
+    
+    catalog = current_app.extensions.get('catalog')
+    if catalog is None:
+        catalog = ArchiveCatalog(
+            current_app.config['CATALOG_FILE'],
+            current_app.config['MRI_ROOT_DIR'],
+            scan_workers=current_app.config['CATALOG_SCAN_WORKERS']
+        )
+        current_app.extensions['catalog'] = catalog
+    
+    interval = current_app.config.get('CATALOG_REFRESH_INTERVAL', 0)
+    if interval > 0 and has_request_context():
+        catalog.refresh_in_background(interval)
+    return catalog
+
+def is_valid_path_part(part):
+    """Check that a patient, study or series name names a single directory entry"""
+    return (part not in ('', '.', '..') and os.sep not in part and
+            not (os.altsep and os.altsep in part))
+
+def ensure_catalogued(catalog, *parts):
+    """
+    Make sure a directory is in the catalog if it exists on disk
+    
+    Covers data that arrived since the last refresh, so a freshly exported
+    study can be opened without waiting for the next full refresh. Directories
+    already in the catalog cost a single index lookup and no filesystem access;
+    new ones are linked by listing only their catalogued ancestor and walking
+    the new path itself.
+    
+    Returns:
+        True if the directory is catalogued, False if it does not exist
+    """
+    if not all(is_valid_path_part(part) for part in parts):
+        return False
+    rel_path = '/'.join(parts)
+    if catalog.has_directory(rel_path):
+        return True
+    if not os.path.isdir(os.path.join(catalog.mri_root, *parts)):
+        return False
+    
+    ancestor = list(parts[:-1])
+    while ancestor and not catalog.has_directory('/'.join(ancestor)):
+        ancestor.pop()
+    stats = catalog.refresh('/'.join(ancestor), recursive=False, target=rel_path)
+    
+    # The catalog now records the new mtimes, so later refreshes will not report these changes again
+    from app.main.utils import sync_status_with_archive
+    sync_status_with_archive(stats['changes'])
+    return catalog.has_directory(rel_path)
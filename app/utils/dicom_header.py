@@ -0,0 +1,46 @@
+from pydicom.filereader import read_partial
+from pydicom.tag import Tag
+
+# Tags read by get_series_info
+SERIES_INFO_TAGS = [
+    'SeriesDescription', 'Modality', 'ScanningSequence', 'SequenceVariant',
+    'EchoTime', 'RepetitionTime', 'ImageOrientationPatient'
+]
+
+# Tags read to describe a raw series volume
+VOLUME_HEADER_TAGS = [
+    'Rows', 'Columns', 'PixelRepresentation', 'PixelSpacing', 'SpacingBetweenSlices',
+    'SliceThickness', 'RescaleSlope', 'RescaleIntercept', 'WindowCenter', 'WindowWidth',
+    'PhotometricInterpretation'
+]
+
+# Tags read to resolve the default display window
+WINDOW_TAGS = ['WindowCenter', 'WindowWidth', 'PhotometricInterpretation']
+
+# Tag used to check that a file is a readable DICOM without reading its data set
+VALIDATION_TAGS = ['SOPClassUID']
+
+def read_dicom_header(path, tags):
+    """
+    Read only the given DICOM tags from a file
+    
+    Parsing stops as soon as the data set has passed the highest requested tag
+    (and always before the pixel data); values of other elements on the way are
+    skipped rather than decoded.
+    
+    Args:
+        path: Path to the DICOM file
+        tags: List of tag keywords or tag numbers to read
+        
+    Returns:
+        pydicom FileDataset containing the file meta information and the requested tags
+    """
+    specific_tags = [Tag(t) for t in tags]
+    last_tag = max(specific_tags)
+    pixel_data_tag = Tag('PixelData')
+    
+    def stop_when(tag, vr, length):
+        return tag > last_tag or tag == pixel_data_tag
+    
+    with open(path, 'rb') as f:
+        return read_partial(f, stop_when=stop_when, specific_tags=specific_tags)
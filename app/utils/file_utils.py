@@ -0,0 +1,29 @@
+import os
+import tempfile
+
+def atomic_write(path, data):
+    """
+    Write data to path atomically
+
+    The data is written to a temporary file in the same directory and then
+    renamed over the destination, so readers never observe a partial file.
+
+    Args:
+        path: Destination file path
+        data: bytes or str to write
+    """
+    directory = os.path.dirname(path) or '.'
+    os.makedirs(directory, exist_ok=True)
+
+    mode = 'wb' if isinstance(data, (bytes, bytearray, memoryview)) else 'w'
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.tmp-')
+    try:
+        with os.fdopen(fd, mode) as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+        raise
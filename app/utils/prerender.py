@@ -0,0 +1,286 @@
+import os
+import heapq
+import atexit
+import itertools
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from flask import current_app
+
+# Queue priorities (lower runs first)
+PRIORITY_VIEWING = 0
+PRIORITY_SELECTED = 10
+
+def _init_worker(config):
+    """Create an app context in each worker process so the render code can use current_app"""
+    from app import create_app
+    
+    app = create_app()
+    app.config.update(config)
+    app.config['PRERENDER_ENABLED'] = False
+    app.app_context().push()
+
+def render_series_to_cache(patient_id, study_id, series_name, widths=None):
+    """
+    Render every slice of a series into the render cache at each of the given widths
+    
+    Must run inside an app context (worker processes get one from _init_worker).
+    
+    Returns:
+        dict with the number of slices rendered, the number that failed to
+        render (unreadable files, or an empty render at any width) and the
+        total size of their source files
+    """
+    from app.main.utils import get_dicom_files, render_dicom_file
+    
+    widths = widths or current_app.config['RENDER_PREVIEW_WIDTHS']
+    series_dir = os.path.join(current_app.config['MRI_ROOT_DIR'], patient_id, study_id, series_name)
+    
+    slices = 0
+    failed = 0
+    source_bytes = 0
+    for dicom_file in get_dicom_files(patient_id, study_id, series_name):
+        full_path = os.path.join(series_dir, dicom_file)
+        try:
+            source_bytes += os.path.getsize(full_path)
+            # render_dicom_file returns b'' when the slice cannot be rendered
+            rendered = all([render_dicom_file(full_path, width=width) for width in widths])
+        except Exception as e:
+            current_app.logger.error(f"Error pre-rendering {full_path}: {e}")
+            rendered = False
+        if rendered:
+            slices += 1
+        else:
+            failed += 1
+    
+    return {'slices': slices, 'failed': failed, 'bytes': source_bytes}
+
+def render_series_task(task):
+    """Pool-friendly wrapper around render_series_to_cache taking a (patient, study, series, widths) tuple"""
+    patient_id, study_id, series_name, widths = task
+    result = render_series_to_cache(patient_id, study_id, series_name, widths)
+    result['series'] = [patient_id, study_id, series_name]
+    return result
+
+def _prerender_series(patient_id, study_id, series_name, full):
+    """
+    Render a series into the render cache (runs in a worker process)
+    
+    Renders every slice when full is True, otherwise only the middle slice used
+    as the series preview. Slices already in the cache are skipped by the cache.
+    
+    Returns:
+        Number of slices processed
+    """
+    from app.main.utils import get_dicom_files, render_dicom_file
+    
+    dicom_files = get_dicom_files(patient_id, study_id, series_name)
+    if not full and dicom_files:
+        middle_index = len(dicom_files) // 2
+        dicom_files = dicom_files[middle_index:middle_index + 1]
+    
+    series_dir = os.path.join(current_app.config['MRI_ROOT_DIR'], patient_id, study_id, series_name)
+    for dicom_file in dicom_files:
+        render_dicom_file(os.path.join(series_dir, dicom_file))
+    return len(dicom_files)
+
+class PrerenderService:
+    """
+    Background service that warms the render cache with a process pool
+    
+    Series are queued with a priority and deduplicated: a series that is
+    already queued is only re-queued if the new request has a higher priority
+    (lower number) or asks for the full series instead of just its preview.
+    A full request for a series whose preview is being rendered is kept and
+    queued as soon as the preview is done.
+    A dispatcher thread keeps at most max_in_flight series submitted to the
+    pool at a time, so newly prioritized series are not stuck behind a long
+    backlog already handed to the workers.
+    """
+    
+    def __init__(self, config, max_workers=2, max_in_flight=None):
+        self._config = config
+        self.max_workers = max_workers
+        self.max_in_flight = max_in_flight or max_workers
+        
+        self._heap = []
+        self._queued = {}
+        self._in_flight = {}  # key -> full
+        self._pending_full = {}  # key -> priority of a full render requested while in flight
+        self._counter = itertools.count()
+        self._cond = threading.Condition()
+        self._executor = None
+        self._dispatcher = None
+        self._stopped = False
+        
+        self.completed = 0
+        self.failed = 0
+        self.slices_rendered = 0
+    
+    def enqueue(self, patient_id, study_id, series_name, priority=PRIORITY_SELECTED, full=True):
+        """
+        Queue a series for pre-rendering
+        
+        Returns:
+            True if the series was queued or re-prioritized (or, for a full
+            render of a series whose preview is being rendered, scheduled to
+            follow it), False if it was already queued or running with at
+            least this priority
+        """
+        key = (patient_id, study_id, series_name)
+        with self._cond:
+            if self._stopped:
+                return False
+            if key in self._in_flight:
+                if self._in_flight[key] or not full:
+                    return False
+                pending = self._pending_full.get(key)
+                if pending is not None and pending <= priority:
+                    return False
+                self._pending_full[key] = priority
+                return True
+            
+            current = self._queued.get(key)
+            if current is not None:
+                current_priority, current_full = current
+                if current_priority <= priority and (current_full or not full):
+                    return False
+                priority = min(priority, current_priority)
+                full = full or current_full
+            
+            self._push(key, priority, full)
+            return True
+    
+    def _push(self, key, priority, full):
+        # Caller holds self._cond
+        self._queued[key] = (priority, full)
+        heapq.heappush(self._heap, (priority, next(self._counter), key, full))
+        self._ensure_started()
+        self._cond.notify()
+    
+    def prioritize(self, patient_id, study_id, series_name):
+        """Move a series to the front of the queue, e.g. because a user is viewing it"""
+        return self.enqueue(patient_id, study_id, series_name, priority=PRIORITY_VIEWING, full=True)
+    
+    def _ensure_started(self):
+        if self._dispatcher is None:
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.max_workers,
+                mp_context=multiprocessing.get_context('spawn'),
+                initializer=_init_worker,
+                initargs=(self._config,)
+            )
+            self._dispatcher = threading.Thread(target=self._dispatch_loop, name='prerender-dispatcher', daemon=True)
+            self._dispatcher.start()
+            atexit.register(self.shutdown)
+    
+    def _dispatch_loop(self):
+        while True:
+            with self._cond:
+                while not self._stopped and (not self._heap or len(self._in_flight) >= self.max_in_flight):
+                    self._cond.wait()
+                if self._stopped:
+                    return
+                
+                priority, _, key, full = heapq.heappop(self._heap)
+                
+                # Skip entries superseded by a later re-prioritization
+                if self._queued.get(key) != (priority, full):
+                    continue
+                del self._queued[key]
+                self._in_flight[key] = full
+            
+            try:
+                future = self._executor.submit(_prerender_series, *key, full)
+            except RuntimeError:
+                # Executor shut down
+                return
+            future.add_done_callback(lambda f, key=key: self._on_done(key, f))
+    
+    def _on_done(self, key, future):
+        with self._cond:
+            self._in_flight.pop(key, None)
+            pending = self._pending_full.pop(key, None)
+            if pending is not None and not self._stopped:
+                self._push(key, pending, True)
+            if future.cancelled() or future.exception() is not None:
+                self.failed += 1
+            else:
+                self.completed += 1
+                self.slices_rendered += future.result()
+            self._cond.notify()
+    
+    def shutdown(self):
+        """Stop dispatching and discard any queued work"""
+        with self._cond:
+            self._stopped = True
+            self._heap.clear()
+            self._queued.clear()
+            self._pending_full.clear()
+            self._cond.notify_all()
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+    
+    def stats(self):
+        """Return queue length, in-flight count and completion counters"""
+        with self._cond:
+            return {
+                'queued': len(self._queued) + len(self._pending_full),
+                'in_flight': len(self._in_flight),
+                'completed': self.completed,
+                'failed': self.failed,
+                'slices_rendered': self.slices_rendered,
+                'max_workers': self.max_workers,
+                'max_in_flight': self.max_in_flight
+            }
+
+def get_prerender_service():
+    """Get the pre-render service for the current app, or None if it is disabled"""
+    if not current_app.config.get('PRERENDER_ENABLED') or not current_app.config.get('RENDER_CACHE_ENABLED', True):
+        return None
+    
+    service = current_app.extensions.get('prerender')
+    if service is None:
+        config = {key: value for key, value in current_app.config.items() if key.isupper()}
+        service = PrerenderService(
+            config,
+            max_workers=current_app.config['PRERENDER_WORKERS'],
+            max_in_flight=current_app.config['PRERENDER_MAX_IN_FLIGHT']
+        )
+        current_app.extensions['prerender'] = service
+    return service
+
+def prerender_patients(patient_ids, priority=PRIORITY_SELECTED):
+    """
+    Queue every series of the given patients for pre-rendering
+    
+    Only the preview slice of each series is rendered unless
+    PRERENDER_WHOLE_STUDIES is enabled, in which case all slices are.
+    """
+    service = get_prerender_service()
+    if service is None:
+        return 0
+    
+    from app.main.utils import get_patient_studies, get_study_series
+    
+    full = current_app.config.get('PRERENDER_WHOLE_STUDIES', False)
+    queued = 0
+    for patient_id in patient_ids:
+        for study in get_patient_studies(patient_id):
+            for series_name in get_study_series(patient_id, study['id']):
+                if service.enqueue(patient_id, study['id'], series_name, priority=priority, full=full):
+                    queued += 1
+    return queued
+
+def prerender_study(patient_id, study_id, priority=PRIORITY_VIEWING):
+    """Queue every series of a study for full pre-rendering"""
+    service = get_prerender_service()
+    if service is None:
+        return 0
+    
+    from app.main.utils import get_study_series
+    
+    return sum(
+        1 for series_name in get_study_series(patient_id, study_id)
+        if service.enqueue(patient_id, study_id, series_name, priority=priority, full=True)
+    )
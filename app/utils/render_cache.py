@@ -0,0 +1,166 @@
+import os
+import json
+import hashlib
+import threading
+from flask import current_app
+from app.utils.file_utils import atomic_write
+
+class RenderCache:
+    """
+    Content-addressed on-disk cache for rendered DICOM images
+
+    Entries are keyed by the source file path, its mtime and size, and the
+    render parameters, so a changed source file or different rendering options
+    never return a stale image. The cache is bounded by a byte budget; when it
+    is exceeded the least recently used entries (by file mtime, which is bumped
+    on every hit) are evicted. It is safe to share one cache directory between
+    several worker processes.
+    """
+
+    # Fraction of the budget to shrink to when evicting, to avoid evicting on every write
+    EVICT_TARGET_RATIO = 0.9
+
+    def __init__(self, cache_dir, max_bytes):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._size = None
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self.evictions = 0
+
+    def make_key(self, source_path, params):
+        """Build the cache key for a source file and a dict of render parameters"""
+        st = os.stat(source_path)
+        payload = json.dumps(
+            [os.path.abspath(source_path), st.st_mtime_ns, st.st_size, params],
+            sort_keys=True
+        )
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def _entry_path(self, key):
+        return os.path.join(self.cache_dir, key[:2], key)
+
+    def get(self, key):
+        """Return the cached bytes for key, or None on a miss"""
+        path = self._entry_path(key)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+        except (FileNotFoundError, IsADirectoryError):
+            with self._lock:
+                self.misses += 1
+            return None
+
+        # Bump the mtime so eviction treats this entry as recently used
+        try:
+            os.utime(path, None)
+        except OSError:
+            pass
+
+        with self._lock:
+            self.hits += 1
+        return data
+
+    def put(self, key, data):
+        """Store data under key, evicting old entries if the budget is exceeded"""
+        path = self._entry_path(key)
+        try:
+            previous_size = os.path.getsize(path)
+        except OSError:
+            previous_size = 0
+
+        atomic_write(path, data)
+
+        with self._lock:
+            self.writes += 1
+            if self._size is None:
+                self._size = self._scan_size()
+            else:
+                self._size += len(data) - previous_size
+            over_budget = self.max_bytes and self._size > self.max_bytes
+
+        if over_budget:
+            self.evict()
+
+    def get_or_render(self, source_path, params, render_fn):
+        """Return cached bytes for source_path/params, calling render_fn() on a miss"""
+        key = self.make_key(source_path, params)
+        data = self.get(key)
+        if data is None:
+            data = render_fn()
+            if data:
+                self.put(key, data)
+        return data
+
+    def _iter_entries(self):
+        if not os.path.isdir(self.cache_dir):
+            return
+        for shard in os.scandir(self.cache_dir):
+            if not shard.is_dir():
+                continue
+            for entry in os.scandir(shard.path):
+                if entry.name.startswith('.tmp-') or not entry.is_file():
+                    continue
+                try:
+                    st = entry.stat()
+                except OSError:
+                    continue
+                yield entry.path, st.st_size, st.st_mtime
+
+    def _scan_size(self):
+        return sum(size for _, size, _ in self._iter_entries())
+
+    def evict(self, target_bytes=None):
+        """Remove least recently used entries until the cache fits in target_bytes"""
+        if target_bytes is None:
+            target_bytes = int(self.max_bytes * self.EVICT_TARGET_RATIO)
+
+        # Rescan the directory, since other processes may have written entries too
+        entries = sorted(self._iter_entries(), key=lambda e: e[2])
+        total = sum(size for _, size, _ in entries)
+        removed = 0
+
+        for path, size, _ in entries:
+            if total <= target_bytes:
+                break
+            try:
+                os.unlink(path)
+            except OSError:
+                continue
+            total -= size
+            removed += 1
+
+        with self._lock:
+            self._size = total
+            self.evictions += removed
+        return removed
+
+    def stats(self):
+        """Return hit/miss counters and the current size of the cache"""
+        with self._lock:
+            if self._size is None:
+                self._size = self._scan_size()
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'writes': self.writes,
+                'evictions': self.evictions,
+                'size_bytes': self._size,
+                'max_bytes': self.max_bytes,
+                'cache_dir': self.cache_dir
+            }
+
+def get_render_cache():
+    """Get the render cache for the current app, creating it on first use"""
+    cache = current_app.extensions.get('render_cache')
+    if cache is None:
+        cache = RenderCache(
+            current_app.config['RENDER_CACHE_DIR'],
+            current_app.config['RENDER_CACHE_MAX_BYTES']
+        )
+        current_app.extensions['render_cache'] = cache
+    return cache
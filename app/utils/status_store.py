@@ -0,0 +1,714 @@
+import os
+import copy
+import json
+import sqlite3
+import threading
+from contextlib import contextmanager
+from flask import current_app
+from app.utils.file_utils import atomic_write
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+class StatusStore:
+    """
+    Interface of the annotation status backends
+
+    Status data has the shape of the original annotation_status.json file:
+    {patient_id: {'status', 'annotated_by', 'last_updated',
+                  'studies': {study_id: {'status', 'annotated_by', 'last_updated'}}}}
+
+    All modifications go through update(), which runs a read-modify-write of
+    the requested patients as one transaction, so the status rollup logic in
+    app.main.utils works unchanged on every backend.
+    """
+
+    def load_all(self):
+        """Return the full status dict"""
+        raise NotImplementedError
+
+    def get_patient(self, patient_id):
+        """Return the status entry of one patient, or None"""
+        raise NotImplementedError
+
+    def patient_statuses(self):
+        """Return {patient_id: status} for every patient with a status entry"""
+        raise NotImplementedError
+
+    def update(self, patient_ids, mutate, signatures=None):
+        """
+        Atomically modify the entries of some patients
+
+        Args:
+            patient_ids: IDs of the patients mutate may read or change
+            mutate: Callable receiving {patient_id: entry} for those of
+                    patient_ids that have an entry; it may change entries in
+                    place, add entries for patient_ids and delete entries
+            signatures: Optional dict, filled with the store signature just
+                    'before' and 'after' this write (equal if nothing changed),
+                    both taken while the write holds the store
+
+        Returns:
+            The return value of mutate
+        """
+        raise NotImplementedError
+
+    def replace_all(self, status_data):
+        """Replace the whole status data"""
+        raise NotImplementedError
+
+    def signature(self):
+        """Value that changes whenever the stored data changes, from any process"""
+        raise NotImplementedError
+
+    def stats(self):
+        """Backend name and read cache counters"""
+        return {
+            'backend': self.backend,
+            'cache_hits': self.cache_hits,
+            'cache_misses': self.cache_misses
+        }
+
+class JsonStatusStore(StatusStore):
+    """
+    Status store backed by a single JSON file (the original format)
+
+    The parsed file is cached in memory and only reparsed when its inode,
+    mtime or size changed, so repeated reads within and across requests cost
+    one stat. Changes written by other worker processes change those and are
+    picked up on the next read. Every update rewrites the whole file. Updates
+    are serialised within a process, but concurrent writers in several
+    processes can lose updates; use the SQLite or journal backend for
+    multi-worker deployments.
+    """
+
+    backend = 'json'
+
+    def __init__(self, status_file):
+        self.status_file = status_file
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._cache = None
+        self._cache_signature = None
+        self.cache_hits = 0
+        self.cache_misses = 0
+
+    def _read(self):
+        """Return the parsed status file (shared; callers must not modify it)"""
+        signature = self.signature()
+        with self._lock:
+            if self._cache is not None and signature == self._cache_signature:
+                self.cache_hits += 1
+                return self._cache
+            self.cache_misses += 1
+
+        # Create directory if it doesn't exist
+        os.makedirs(os.path.dirname(self.status_file), exist_ok=True)
+
+        status_data = {}
+        if os.path.exists(self.status_file):
+            try:
+                with open(self.status_file, 'r') as f:
+                    status_data = json.load(f)
+            except json.JSONDecodeError:
+                current_app.logger.error(f"Error decoding JSON from {self.status_file}")
+
+        with self._lock:
+            # Stat was taken before reading, so a concurrent rewrite is noticed on the next read
+            self._cache = status_data
+            self._cache_signature = signature
+        return status_data
+
+    def load_all(self):
+        return copy.deepcopy(self._read())
+
+    def get_patient(self, patient_id):
+        return copy.deepcopy(self._read().get(patient_id))
+
+    def patient_statuses(self):
+        return {patient_id: entry['status'] for patient_id, entry in self._read().items()}
+
+    def update(self, patient_ids, mutate, signatures=None):
+        with self._write_lock:
+            before = self.signature()
+            if signatures is not None:
+                signatures.update(before=before, after=before)
+            status_data = dict(self._read())
+            entries = {p: copy.deepcopy(status_data[p]) for p in patient_ids if p in status_data}
+            original = copy.deepcopy(entries)
+            result = mutate(entries)
+            if entries == original:
+                return result
+            for patient_id in patient_ids:
+                if patient_id in entries:
+                    status_data[patient_id] = entries[patient_id]
+                else:
+                    status_data.pop(patient_id, None)
+            self._write(status_data)
+            if signatures is not None:
+                signatures['after'] = self._cache_signature
+            return result
+
+    def replace_all(self, status_data):
+        with self._write_lock:
+            self._write(copy.deepcopy(status_data))
+
+    def _write(self, status_data):
+        # Written in place rather than atomically: creating a temporary file
+        # would change the mtime of MRI_ROOT_DIR, which signals a patient list change
+        os.makedirs(os.path.dirname(self.status_file), exist_ok=True)
+        with open(self.status_file, 'w') as f:
+            json.dump(status_data, f, indent=2)
+        with self._lock:
+            self._cache = status_data
+            self._cache_signature = self.signature()
+
+    def signature(self):
+        try:
+            st = os.stat(self.status_file)
+        except OSError:
+            return None
+        return (st.st_ino, st.st_mtime_ns, st.st_size)
+
+SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS patient_status (
+    patient_id TEXT PRIMARY KEY,
+    status TEXT NOT NULL,
+    annotated_by TEXT,
+    last_updated TEXT
+);
+CREATE TABLE IF NOT EXISTS study_status (
+    patient_id TEXT NOT NULL,
+    study_id TEXT NOT NULL,
+    status TEXT NOT NULL,
+    annotated_by TEXT,
+    last_updated TEXT,
+    PRIMARY KEY (patient_id, study_id)
+);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+# Entry fields stored as columns
+STATUS_FIELDS = ['status', 'annotated_by', 'last_updated']
+
+def diff_entry(patient_id, old, new):
+    """
+    Yield the row-level changes turning one status entry of a patient into another
+
+    Changes are dicts with an 'op' of 'delete_patient', 'set_patient'
+    (patient-level fields under 'entry'), 'delete_study' or 'set_study'
+    ('study_id' and the study's fields under 'entry'). Each change sets
+    absolute values, so applying one twice is harmless.
+    """
+    if new is None:
+        if old is not None:
+            yield {'op': 'delete_patient', 'patient_id': patient_id}
+        return
+
+    if old is None or any(old.get(f) != new.get(f) for f in STATUS_FIELDS):
+        yield {'op': 'set_patient', 'patient_id': patient_id,
+               'entry': {f: new.get(f) for f in STATUS_FIELDS}}
+
+    old_studies = (old or {}).get('studies', {})
+    new_studies = new.get('studies', {})
+    for study_id in old_studies.keys() - new_studies.keys():
+        yield {'op': 'delete_study', 'patient_id': patient_id, 'study_id': study_id}
+    for study_id, study in new_studies.items():
+        if old_studies.get(study_id) != study:
+            yield {'op': 'set_study', 'patient_id': patient_id, 'study_id': study_id,
+                   'entry': {f: study.get(f) for f in STATUS_FIELDS}}
+
+def apply_change(status_data, change):
+    """Apply one change produced by diff_entry to a full status dict"""
+    op = change['op']
+    patient_id = change['patient_id']
+    if op == 'delete_patient':
+        status_data.pop(patient_id, None)
+    elif op == 'set_patient':
+        entry = status_data.setdefault(patient_id, {'studies': {}})
+        entry.update(change['entry'])
+    elif op == 'delete_study':
+        status_data.get(patient_id, {}).get('studies', {}).pop(change['study_id'], None)
+    elif op == 'set_study':
+        entry = status_data.setdefault(patient_id, {'status': None, 'annotated_by': None,
+                                                    'last_updated': None, 'studies': {}})
+        entry.setdefault('studies', {})[change['study_id']] = dict(change['entry'])
+
+class SQLiteStatusStore(StatusStore):
+    """
+    Status store backed by a SQLite database in WAL mode
+
+    update() runs inside a BEGIN IMMEDIATE transaction, so concurrent writers
+    in different processes are serialised by SQLite instead of overwriting each
+    other. Only the patient and study rows that actually changed are upserted
+    or deleted. Readers never block writers. A version counter in the meta
+    table is bumped by every write and serves as the signature; full reads
+    are cached per version, so they are only rebuilt after a write.
+    """
+
+    backend = 'sqlite'
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self._local = threading.local()
+        self._cache_lock = threading.Lock()
+        self._cache = None
+        self._cache_version = None
+        self.cache_hits = 0
+        self.cache_misses = 0
+
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        conn = self._connect()
+        conn.executescript(SQLITE_SCHEMA)
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            # Autocommit mode; transactions are opened explicitly
+            conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    # Reads
+
+    def _load(self, conn, patient_ids=None):
+        """Build status entries from the tables, for all patients or the given ones"""
+        entries = {}
+        if patient_ids is None:
+            patient_rows = conn.execute('SELECT patient_id, status, annotated_by, last_updated FROM patient_status')
+            study_rows = conn.execute(
+                'SELECT patient_id, study_id, status, annotated_by, last_updated FROM study_status')
+        else:
+            patient_ids = list(patient_ids)
+            placeholders = ','.join('?' * len(patient_ids))
+            patient_rows = conn.execute(
+                'SELECT patient_id, status, annotated_by, last_updated FROM patient_status '
+                f'WHERE patient_id IN ({placeholders})', patient_ids)
+            study_rows = conn.execute(
+                'SELECT patient_id, study_id, status, annotated_by, last_updated FROM study_status '
+                f'WHERE patient_id IN ({placeholders})', patient_ids)
+
+        for patient_id, *values in patient_rows.fetchall():
+            entries[patient_id] = dict(zip(STATUS_FIELDS, values), studies={})
+        for patient_id, study_id, *values in study_rows.fetchall():
+            if patient_id in entries:
+                entries[patient_id]['studies'][study_id] = dict(zip(STATUS_FIELDS, values))
+        return entries
+
+    def _read_all(self):
+        """
+        Return all status entries (shared; callers must not modify them)
+
+        The result is cached per version counter, so it is rebuilt only after
+        a write by any process.
+        """
+        version = self.signature()
+        with self._cache_lock:
+            if self._cache is not None and self._cache_version == version:
+                self.cache_hits += 1
+                return self._cache
+            self.cache_misses += 1
+
+        conn = self._connect()
+        conn.execute('BEGIN')
+        try:
+            # Version and data from the same read transaction
+            version = self.signature()
+            entries = self._load(conn)
+        finally:
+            conn.execute('COMMIT')
+
+        with self._cache_lock:
+            self._cache = entries
+            self._cache_version = version
+        return entries
+
+    def load_all(self):
+        return copy.deepcopy(self._read_all())
+
+    def get_patient(self, patient_id):
+        with self._cache_lock:
+            cache, cache_version = self._cache, self._cache_version
+        if cache is not None and cache_version == self.signature():
+            self.cache_hits += 1
+            return copy.deepcopy(cache.get(patient_id))
+
+        # One indexed lookup is cheaper than rebuilding the whole cache
+        conn = self._connect()
+        conn.execute('BEGIN')
+        try:
+            return self._load(conn, [patient_id]).get(patient_id)
+        finally:
+            conn.execute('COMMIT')
+
+    def patient_statuses(self):
+        return {patient_id: entry['status'] for patient_id, entry in self._read_all().items()}
+
+    def signature(self):
+        row = self._connect().execute("SELECT value FROM meta WHERE key = 'version'").fetchone()
+        return int(row[0]) if row else 0
+
+    # Writes
+
+    def update(self, patient_ids, mutate, signatures=None):
+        patient_ids = list(dict.fromkeys(patient_ids))
+        conn = self._connect()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            before = self.signature()
+            entries = self._load(conn, patient_ids)
+            original = copy.deepcopy(entries)
+            result = mutate(entries)
+            changed = False
+            for patient_id in patient_ids:
+                changed |= self._write_patient(conn, patient_id, original.get(patient_id), entries.get(patient_id))
+            if changed:
+                self._bump_version(conn)
+            after = self.signature()
+            conn.execute('COMMIT')
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        if signatures is not None:
+            signatures.update(before=before, after=after)
+        return result
+
+    def replace_all(self, status_data):
+        conn = self._connect()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            conn.execute('DELETE FROM study_status')
+            conn.execute('DELETE FROM patient_status')
+            for patient_id, entry in status_data.items():
+                self._write_patient(conn, patient_id, None, entry)
+            self._bump_version(conn)
+            conn.execute('COMMIT')
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+
+    def _write_patient(self, conn, patient_id, old, new):
+        """Write the row-level differences between two entries of a patient; True if anything changed"""
+        changed = False
+        for change in diff_entry(patient_id, old, new):
+            op = change['op']
+            if op == 'delete_patient':
+                conn.execute('DELETE FROM study_status WHERE patient_id = ?', (patient_id,))
+                conn.execute('DELETE FROM patient_status WHERE patient_id = ?', (patient_id,))
+            elif op == 'set_patient':
+                conn.execute(
+                    'INSERT INTO patient_status (patient_id, status, annotated_by, last_updated) VALUES (?, ?, ?, ?) '
+                    'ON CONFLICT (patient_id) DO UPDATE SET status = excluded.status, '
+                    'annotated_by = excluded.annotated_by, last_updated = excluded.last_updated',
+                    [patient_id] + [change['entry'].get(f) for f in STATUS_FIELDS])
+            elif op == 'delete_study':
+                conn.execute('DELETE FROM study_status WHERE patient_id = ? AND study_id = ?',
+                             (patient_id, change['study_id']))
+            else:
+                conn.execute(
+                    'INSERT INTO study_status (patient_id, study_id, status, annotated_by, last_updated) '
+                    'VALUES (?, ?, ?, ?, ?) '
+                    'ON CONFLICT (patient_id, study_id) DO UPDATE SET status = excluded.status, '
+                    'annotated_by = excluded.annotated_by, last_updated = excluded.last_updated',
+                    [patient_id, change['study_id']] + [change['entry'].get(f) for f in STATUS_FIELDS])
+            changed = True
+        return changed
+
+    def _bump_version(self, conn):
+        conn.execute("INSERT INTO meta (key, value) VALUES ('version', 1) "
+                     "ON CONFLICT (key) DO UPDATE SET value = CAST(value AS INTEGER) + 1")
+
+class JournalStatusStore(StatusStore):
+    """
+    Status store backed by a JSON snapshot plus an append-only JSONL journal
+
+    Every update appends one line per changed patient or study (see
+    diff_entry) to the journal, so a write costs O(1) regardless of how many
+    patients exist. The in-memory state is the snapshot with the journal
+    replayed on top; each process replays only the journal lines appended
+    since it last looked. The snapshot is ANNOTATION_STATUS_FILE in the
+    original format, so switching from the JSON backend needs no migration.
+
+    Once the journal grows past compact_bytes, a background thread writes a
+    new snapshot and starts a new journal holding only the lines appended
+    meanwhile. Journal appends and the snapshot swap hold an exclusive
+    fcntl lock on a lock file, which serialises them across worker processes.
+    Without fcntl (Windows) only threads within a process are serialised.
+    """
+
+    backend = 'journal'
+
+    def __init__(self, snapshot_file, journal_file, compact_bytes=4 * 1024 ** 2):
+        self.snapshot_file = snapshot_file
+        self.journal_file = journal_file
+        self.lock_file = journal_file + '.lock'
+        self.compact_bytes = compact_bytes
+        self.compactions = 0
+        self._lock = threading.RLock()
+        self._state = None
+        self._snapshot_id = None
+        self._journal_id = None
+        self._offset = 0
+        self._compacting = False
+        self.cache_hits = 0
+        self.cache_misses = 0
+
+        os.makedirs(os.path.dirname(os.path.abspath(journal_file)), exist_ok=True)
+
+    @contextmanager
+    def _file_lock(self, exclusive):
+        """Hold the in-process lock and, where available, the cross-process file lock"""
+        with self._lock:
+            if fcntl is None:
+                yield
+                return
+            with open(self.lock_file, 'a') as f:
+                fcntl.flock(f, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _current_snapshot_id(self):
+        """Identity of the snapshot file; changes when it is replaced or rewritten"""
+        try:
+            st = os.stat(self.snapshot_file)
+        except OSError:
+            return None
+        return (st.st_ino, st.st_mtime_ns, st.st_size)
+
+    def _current_journal_id(self):
+        """Inode of the journal file; changes only when a compaction replaces it"""
+        try:
+            return os.stat(self.journal_file).st_ino
+        except OSError:
+            return None
+
+    # Replay
+
+    def _catch_up(self):
+        """Bring the in-memory state up to date with the snapshot and journal (file lock held)"""
+        snapshot_id = self._current_snapshot_id()
+        try:
+            st = os.stat(self.journal_file)
+            journal_id, journal_size = st.st_ino, st.st_size
+        except OSError:
+            journal_id, journal_size = None, 0
+        if self._state is None or snapshot_id != self._snapshot_id or journal_id != self._journal_id:
+            # First load, or another process compacted: start over from the new snapshot
+            self._state = self._read_snapshot()
+            self._snapshot_id = snapshot_id
+            self._journal_id = journal_id
+            self._offset = 0
+            self.cache_misses += 1
+        elif journal_size == self._offset:
+            self.cache_hits += 1
+        if journal_size > self._offset:
+            self._replay()
+
+    def _read_snapshot(self):
+        if not os.path.exists(self.snapshot_file):
+            return {}
+        try:
+            with open(self.snapshot_file, 'r') as f:
+                return json.load(f)
+        except json.JSONDecodeError:
+            current_app.logger.error(f"Error decoding JSON from {self.snapshot_file}")
+            return {}
+
+    def _replay(self):
+        """Apply the journal lines appended since the last replay"""
+        try:
+            with open(self.journal_file, 'rb') as f:
+                f.seek(self._offset)
+                data = f.read()
+        except FileNotFoundError:
+            return
+
+        # A line without its newline is still being written (or was torn by a crash); leave it
+        end = data.rfind(b'\n') + 1
+        for line in data[:end].splitlines():
+            if not line.strip():
+                continue
+            try:
+                apply_change(self._state, json.loads(line))
+            except (ValueError, KeyError) as e:
+                current_app.logger.error(f"Skipping bad status journal line in {self.journal_file}: {e}")
+        self._offset += end
+
+    # Reads
+
+    def load_all(self):
+        with self._file_lock(exclusive=False):
+            self._catch_up()
+            return copy.deepcopy(self._state)
+
+    def get_patient(self, patient_id):
+        with self._file_lock(exclusive=False):
+            self._catch_up()
+            return copy.deepcopy(self._state.get(patient_id))
+
+    def patient_statuses(self):
+        with self._file_lock(exclusive=False):
+            self._catch_up()
+            return {patient_id: entry.get('status') for patient_id, entry in self._state.items()}
+
+    def signature(self):
+        try:
+            size = os.path.getsize(self.journal_file)
+        except OSError:
+            size = None
+        return (self._current_snapshot_id(), self._current_journal_id(), size)
+
+    # Writes
+
+    def update(self, patient_ids, mutate, signatures=None):
+        with self._file_lock(exclusive=True):
+            self._catch_up()
+            before = self.signature()
+            entries = {p: copy.deepcopy(self._state[p]) for p in patient_ids if p in self._state}
+            original = copy.deepcopy(entries)
+            result = mutate(entries)
+
+            changes = []
+            for patient_id in dict.fromkeys(patient_ids):
+                changes.extend(diff_entry(patient_id, original.get(patient_id), entries.get(patient_id)))
+            if changes:
+                self._append(changes)
+            journal_size = self._offset
+            if signatures is not None:
+                signatures.update(before=before, after=self.signature())
+
+        if journal_size > self.compact_bytes:
+            self.compact_in_background()
+        return result
+
+    def _append(self, changes):
+        """Append changes to the journal and apply them to the in-memory state (file lock held)"""
+        data = ''.join(json.dumps(change, separators=(',', ':')) + '\n' for change in changes).encode('utf-8')
+        fd = os.open(self.journal_file, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            os.write(fd, data)
+        finally:
+            os.close(fd)
+        for change in changes:
+            apply_change(self._state, change)
+        self._offset += len(data)
+        self._journal_id = self._current_journal_id()
+
+    def replace_all(self, status_data):
+        with self._file_lock(exclusive=True):
+            self._swap_snapshot(status_data, b'')
+
+    # Compaction
+
+    def compact_in_background(self):
+        """Start a compaction thread unless one is already running"""
+        with self._lock:
+            if self._compacting:
+                return
+            self._compacting = True
+        app = current_app._get_current_object()
+        threading.Thread(target=self._compact_thread, args=(app,), daemon=True,
+                         name='status-journal-compaction').start()
+
+    def _compact_thread(self, app):
+        try:
+            with app.app_context():
+                self.compact()
+        except Exception as e:
+            app.logger.error(f"Error compacting status journal: {e}")
+        finally:
+            with self._lock:
+                self._compacting = False
+
+    def compact(self):
+        """
+        Fold the journal into a new snapshot
+
+        The snapshot is serialised from a copy of the state without holding
+        the file lock; only the swap of snapshot and journal, which carries
+        over lines appended in the meantime, runs under the exclusive lock.
+        """
+        with self._file_lock(exclusive=False):
+            self._catch_up()
+            state = copy.deepcopy(self._state)
+            offset = self._offset
+            snapshot_id = self._snapshot_id
+            journal_id = self._journal_id
+        if journal_id is None:
+            # Nothing journalled yet
+            return False
+        snapshot_data = json.dumps(state, separators=(',', ':'))
+
+        with self._file_lock(exclusive=True):
+            # Inodes can be reused, so compare both files
+            if self._current_snapshot_id() != snapshot_id or self._current_journal_id() != journal_id:
+                # Another process compacted in the meantime
+                return False
+            with open(self.journal_file, 'rb') as f:
+                f.seek(offset)
+                tail = f.read()
+            self._swap_snapshot(None, tail, snapshot_data)
+        self.compactions += 1
+        return True
+
+    def _swap_snapshot(self, status_data, journal_tail, snapshot_data=None):
+        """Install a new snapshot and a new journal holding journal_tail (exclusive file lock held)"""
+        if snapshot_data is None:
+            snapshot_data = json.dumps(status_data, separators=(',', ':'))
+        # The snapshot is rewritten in place, like JsonStatusStore does: a
+        # temporary file next to it would change the mtime of MRI_ROOT_DIR,
+        # which signals a patient list change. Readers hold the shared lock,
+        # so none of them sees it half written.
+        os.makedirs(os.path.dirname(os.path.abspath(self.snapshot_file)), exist_ok=True)
+        with open(self.snapshot_file, 'w') as f:
+            f.write(snapshot_data)
+            f.flush()
+            os.fsync(f.fileno())
+        atomic_write(self.journal_file, journal_tail)
+        # Reload from the files just written so the tail is replayed onto the new snapshot
+        self._state = None
+        self._catch_up()
+
+    def stats(self):
+        """Journal size, compaction and read cache counters"""
+        try:
+            journal_bytes = os.path.getsize(self.journal_file)
+        except OSError:
+            journal_bytes = 0
+        stats = super().stats()
+        stats.update({
+            'journal_bytes': journal_bytes,
+            'compact_bytes': self.compact_bytes,
+            'compactions': self.compactions,
+            'compacting': self._compacting
+        })
+        return stats
+
+def create_status_store(config):
+    """Create the status store selected by STATUS_STORE_BACKEND ('json', 'journal' or 'sqlite')"""
+    backend = config.get('STATUS_STORE_BACKEND', 'json')
+    if backend == 'sqlite':
+        return SQLiteStatusStore(config['STATUS_STORE_FILE'])
+    if backend == 'journal':
+        return JournalStatusStore(config['ANNOTATION_STATUS_FILE'], config['STATUS_JOURNAL_FILE'],
+                                  compact_bytes=config['STATUS_JOURNAL_COMPACT_BYTES'])
+    if backend == 'json':
+        return JsonStatusStore(config['ANNOTATION_STATUS_FILE'])
+    raise ValueError(f"Unknown status store backend: {backend}")
+
+def get_status_store():
+    """Get the annotation status store for the current app"""
+    store = current_app.extensions.get('status_store')
+    if store is None:
+        store = create_status_store(current_app.config)
+        current_app.extensions['status_store'] = store
+    return store
@@ -0,0 +1,268 @@
+import os
+import json
+import time
+import threading
+from app.utils.catalog import DEPTH_SERIES
+
+try:
+    from inotify_simple import INotify, flags as inotify_flags
+except ImportError:
+    INotify = None
+
+class ArchiveWatcher:
+    """
+    Keeps the archive catalog and the derived annotation status in sync with MRI_ROOT_DIR
+    
+    Uses inotify watches on every patient, study and series directory when
+    the inotify_simple package is installed and the watches can be created,
+    and otherwise polls the catalog's incremental refresh. Change events are
+    batched for batch_interval seconds; each batch re-lists only the
+    directories that reported changes (and any new directories below them)
+    and then updates the annotation status for added and removed studies.
+    
+    Note that inotify only sees changes made through the local kernel; for
+    network filesystems written by other hosts use mode='poll'.
+    """
+    
+    def __init__(self, app, catalog, mode='auto', batch_interval=2.0, poll_interval=60.0):
+        self.app = app
+        self.catalog = catalog
+        self.requested_mode = mode
+        self.mode = None
+        self.batch_interval = batch_interval
+        self.poll_interval = poll_interval
+        
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._pending = {}
+        self._pending_instances = {}
+        self._full_refresh_since = None
+        self._wd_to_rel = {}
+        
+        self.events_received = 0
+        self.batches_applied = 0
+        self.last_batch_at = None
+        self.last_batch_seconds = 0.0
+        self.last_batch_lag = 0.0
+        self.last_batch_changes = 0
+    
+    def start(self):
+        """Start watching in a background thread"""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self.run, name='archive-watcher', daemon=True)
+            self._thread.start()
+    
+    def stop(self):
+        self._stop.set()
+    
+    def run(self):
+        """Watch until stop() is called (blocks)"""
+        with self.app.app_context():
+            inotify = None
+            if self.requested_mode in ('auto', 'inotify') and INotify is not None:
+                try:
+                    inotify = self._setup_inotify()
+                except OSError as e:
+                    # Typically ENOSPC: more directories than fs.inotify.max_user_watches
+                    self.app.logger.warning(f"Could not set up inotify watches, falling back to polling: {e}")
+                    inotify = None
+            elif self.requested_mode == 'inotify':
+                self.app.logger.warning("inotify_simple is not installed, falling back to polling")
+            
+            self.mode = 'inotify' if inotify is not None else 'poll'
+            self.app.logger.info(f"Archive watcher started in {self.mode} mode")
+            
+            if inotify is not None:
+                self._run_inotify(inotify)
+            else:
+                self._run_polling()
+    
+    # inotify mode
+    
+    def _watch_mask(self):
+        return (inotify_flags.CREATE | inotify_flags.DELETE | inotify_flags.MOVED_FROM |
+                inotify_flags.MOVED_TO | inotify_flags.DELETE_SELF | inotify_flags.CLOSE_WRITE |
+                inotify_flags.ONLYDIR)
+    
+    def _add_watch(self, inotify, rel_path):
+        full_path = os.path.join(self.catalog.mri_root, rel_path) if rel_path else self.catalog.mri_root
+        try:
+            wd = inotify.add_watch(full_path, self._watch_mask())
+        except FileNotFoundError:
+            return
+        self._wd_to_rel[wd] = rel_path
+    
+    def _setup_inotify(self):
+        inotify = INotify()
+        
+        # Make sure the catalog exists before mirroring its directories as watches
+        if not self.catalog.is_built():
+            from app.main.utils import sync_status_with_archive
+            sync_status_with_archive(self.catalog.refresh()['changes'])
+        
+        self._add_watch(inotify, '')
+        for rel_path in self.catalog.list_directories(max_depth=DEPTH_SERIES):
+            self._add_watch(inotify, rel_path)
+        return inotify
+    
+    def _run_inotify(self, inotify):
+        timeout_ms = int(self.batch_interval * 1000)
+        
+        while not self._stop.is_set():
+            for event in inotify.read(timeout=timeout_ms):
+                self._handle_event(event)
+            
+            oldest = self._oldest_pending()
+            if oldest is not None and time.time() - oldest >= self.batch_interval:
+                self.apply_batch(inotify)
+    
+    def _handle_event(self, event):
+        if event.mask & inotify_flags.Q_OVERFLOW:
+            # Events were lost; refresh everything
+            self.mark_full_refresh()
+            return
+        
+        rel_path = self._wd_to_rel.get(event.wd)
+        if rel_path is None:
+            return
+        if event.mask & inotify_flags.IGNORED:
+            del self._wd_to_rel[event.wd]
+            return
+        
+        parts = rel_path.split('/') if rel_path else []
+        if event.mask & inotify_flags.CLOSE_WRITE:
+            # A DICOM file finished writing; its header fields may not have been readable on creation
+            if len(parts) == DEPTH_SERIES:
+                self.mark_instance_written(parts + [event.name])
+        else:
+            self.mark_changed(rel_path)
+    
+    # Polling mode
+    
+    def _run_polling(self):
+        if not self.catalog.is_built():
+            self.mark_full_refresh()
+            self.apply_batch()
+        while not self._stop.wait(self.poll_interval):
+            self.mark_full_refresh()
+            self.apply_batch()
+    
+    # Batching
+    
+    def mark_changed(self, rel_path):
+        """Record that the children of a directory changed"""
+        with self._lock:
+            self.events_received += 1
+            self._pending.setdefault(rel_path, time.time())
+    
+    def mark_full_refresh(self):
+        """Record that the whole catalog needs an incremental refresh"""
+        with self._lock:
+            self.events_received += 1
+            if self._full_refresh_since is None:
+                self._full_refresh_since = time.time()
+    
+    def mark_instance_written(self, parts):
+        """Record that a DICOM file finished writing and its header fields should be re-read"""
+        with self._lock:
+            self.events_received += 1
+            self._pending_instances.setdefault(tuple(parts), time.time())
+    
+    def _pending_times(self):
+        times = list(self._pending.values()) + list(self._pending_instances.values())
+        if self._full_refresh_since is not None:
+            times.append(self._full_refresh_since)
+        return times
+    
+    def _oldest_pending(self):
+        with self._lock:
+            times = self._pending_times()
+        return min(times) if times else None
+    
+    def apply_batch(self, inotify=None):
+        """Apply all pending changes to the catalog and the annotation status"""
+        from app.main.utils import sync_status_with_archive
+        
+        with self._lock:
+            oldest = min(self._pending_times(), default=None)
+            pending, self._pending = self._pending, {}
+            pending_instances, self._pending_instances = self._pending_instances, {}
+            full_refresh, self._full_refresh_since = self._full_refresh_since is not None, None
+        if oldest is None:
+            return
+        
+        started = time.time()
+        changes = {}
+        change_count = 0
+        try:
+            if full_refresh:
+                refreshes = [self.catalog.refresh('')]
+            else:
+                # Parents first, so new directories are linked before their contents are listed
+                refreshes = [self.catalog.refresh(rel_path, recursive=False)
+                             for rel_path in sorted(pending, key=lambda rel: rel.count('/') if rel else -1)]
+            
+            for stats in refreshes:
+                change_count += stats['added'] + stats['removed']
+                for key, values in stats['changes'].items():
+                    changes.setdefault(key, []).extend(values)
+            
+            for parts in pending_instances:
+                self.catalog.refresh_instance(list(parts))
+            
+            sync_status_with_archive(changes)
+        except Exception as e:
+            self.app.logger.error(f"Error applying archive changes: {e}")
+        
+        if inotify is not None:
+            for rel_path in changes.get('added_dirs', []):
+                self._add_watch(inotify, rel_path)
+        
+        now = time.time()
+        with self._lock:
+            self.batches_applied += 1
+            self.last_batch_at = now
+            self.last_batch_seconds = now - started
+            self.last_batch_lag = now - oldest
+            self.last_batch_changes = change_count
+        
+        self.catalog.set_meta('watcher_stats', json.dumps(self.stats()))
+    
+    def stats(self):
+        """Return backlog and lag metrics"""
+        with self._lock:
+            times = self._pending_times()
+            return {
+                'mode': self.mode,
+                'watches': len(self._wd_to_rel),
+                'backlog': len(times),
+                'lag_seconds': time.time() - min(times) if times else 0.0,
+                'events_received': self.events_received,
+                'batches_applied': self.batches_applied,
+                'last_batch_at': self.last_batch_at,
+                'last_batch_seconds': self.last_batch_seconds,
+                'last_batch_lag_seconds': self.last_batch_lag,
+                'last_batch_changes': self.last_batch_changes
+            }
+
+def start_watcher(app):
+    """Start the archive watcher in a background thread (used by run.py when WATCHER_ENABLED is set)"""
+    from app.utils.catalog import get_catalog
+    
+    with app.app_context():
+        catalog = get_catalog()
+    if catalog is None:
+        app.logger.warning("Archive watcher needs the catalog; set CATALOG_ENABLED")
+        return None
+    
+    watcher = ArchiveWatcher(
+        app,
+        catalog,
+        mode=app.config['WATCHER_MODE'],
+        batch_interval=app.config['WATCHER_BATCH_INTERVAL'],
+        poll_interval=app.config['WATCHER_POLL_INTERVAL']
+    )
+    app.extensions['archive_watcher'] = watcher
+    watcher.start()
+    return watcher
@@ -0,0 +1,219 @@
+import os
+import json
+import hashlib
+import threading
+from functools import lru_cache
+import numpy as np
+import pydicom
+from flask import current_app
+from app.utils.file_utils import atomic_write
+from app.utils.dicom_header import read_dicom_header, WINDOW_TAGS
+
+# Percentiles used for the robust per-series default window
+SERIES_WINDOW_PERCENTILES = (0.5, 99.5)
+
+# Maximum number of slices sampled when computing series statistics
+SERIES_STATS_SAMPLE_SLICES = 16
+
+# Pixel stride used when sampling a slice for series statistics
+SERIES_STATS_PIXEL_STRIDE = 2
+
+_series_stats_memo = {}
+_series_stats_lock = threading.Lock()
+
+@lru_cache(maxsize=256)
+def window_lut(center, width, slope=1.0, intercept=0.0, signed=False, bits=16, invert=False):
+    """
+    Build a lookup table mapping every stored pixel value to an 8-bit display value
+    
+    Applies the modality rescale (slope/intercept) followed by the DICOM linear
+    VOI window function (PS3.3 C.11.2.1.2). For signed data the table is indexed
+    by the unsigned view of the stored values, so it can be applied with
+    lut[pixels.view(uint)] without any arithmetic on the image itself.
+    
+    Returns:
+        numpy uint8 array with 2**bits entries
+    """
+    stored = np.arange(2 ** bits, dtype=np.int64)
+    if signed:
+        stored = np.where(stored >= 2 ** (bits - 1), stored - 2 ** bits, stored)
+    
+    values = stored * slope + intercept
+    width = max(float(width), 1.0)
+    lut = ((values - (center - 0.5)) / (width - 1 if width > 1 else 1) + 0.5) * 255
+    lut = np.clip(lut, 0, 255).astype(np.uint8)
+    
+    if invert:
+        lut = 255 - lut
+    lut.flags.writeable = False
+    return lut
+
+def apply_window(pixel_array, center, width, slope=1.0, intercept=0.0, invert=False):
+    """
+    Map a pixel array to 8-bit display values with the given window
+    
+    8- and 16-bit integer data goes through a cached lookup table; any other data
+    type is windowed with a single vectorized float32 pass.
+    """
+    dtype = pixel_array.dtype
+    
+    if dtype.kind in 'ui' and dtype.itemsize in (1, 2):
+        bits = dtype.itemsize * 8
+        lut = window_lut(float(center), float(width), float(slope), float(intercept),
+                         dtype.kind == 'i', bits, invert)
+        if dtype.kind == 'i':
+            pixel_array = pixel_array.view(np.dtype(f'u{dtype.itemsize}'))
+        return lut[pixel_array]
+    
+    values = pixel_array.astype(np.float32) * np.float32(slope) + np.float32(intercept)
+    width = max(float(width), 1.0)
+    values -= np.float32(center - 0.5)
+    values *= np.float32(255 / (width - 1 if width > 1 else 1))
+    values += np.float32(127.5)
+    np.clip(values, 0, 255, out=values)
+    result = values.astype(np.uint8)
+    if invert:
+        np.subtract(255, result, out=result)
+    return result
+
+def get_dicom_window(ds):
+    """Get the (center, width) window from the WindowCenter/WindowWidth tags, or None"""
+    center = getattr(ds, 'WindowCenter', None)
+    width = getattr(ds, 'WindowWidth', None)
+    if center is None or width is None:
+        return None
+    
+    try:
+        # Multi-valued tags list several presets; the first one is the default
+        if not isinstance(center, (int, float)):
+            center = center[0]
+        if not isinstance(width, (int, float)):
+            width = width[0]
+        center, width = float(center), float(width)
+    except (TypeError, ValueError, IndexError):
+        return None
+    
+    if width <= 0:
+        return None
+    return center, width
+
+def get_default_window(full_path):
+    """
+    Resolve the default display window for a DICOM file without decoding its pixels
+    
+    Uses the WindowCenter/WindowWidth tags when present and otherwise the
+    robust per-series statistics, so all slices of a series share one window.
+    
+    Returns:
+        tuple of (center, width, invert), or None if no window could be determined
+    """
+    ds = read_dicom_header(full_path, WINDOW_TAGS)
+    invert = getattr(ds, 'PhotometricInterpretation', '') == 'MONOCHROME1'
+    
+    window = get_dicom_window(ds)
+    if window:
+        return window[0], window[1], invert
+    
+    stats = get_series_stats(os.path.dirname(full_path))
+    if stats:
+        return stats['center'], stats['width'], invert
+    return None
+
+def compute_series_stats(dicom_paths):
+    """
+    Compute robust intensity statistics for a series
+    
+    Up to SERIES_STATS_SAMPLE_SLICES evenly spaced slices are decoded and
+    subsampled; the window spans the SERIES_WINDOW_PERCENTILES of their
+    rescaled values.
+    """
+    step = max(1, len(dicom_paths) // SERIES_STATS_SAMPLE_SLICES)
+    sample_paths = dicom_paths[::step][:SERIES_STATS_SAMPLE_SLICES]
+    
+    samples = []
+    for path in sample_paths:
+        try:
+            ds = pydicom.dcmread(path)
+            pixels = ds.pixel_array
+        except Exception as e:
+            current_app.logger.warning(f"Skipping {path} in series statistics: {e}")
+            continue
+        
+        if pixels.ndim != 2:
+            continue
+        slope = float(getattr(ds, 'RescaleSlope', 1) or 1)
+        intercept = float(getattr(ds, 'RescaleIntercept', 0) or 0)
+        strided = pixels[::SERIES_STATS_PIXEL_STRIDE, ::SERIES_STATS_PIXEL_STRIDE]
+        samples.append(strided.astype(np.float32).ravel() * slope + intercept)
+    
+    if not samples:
+        return None
+    
+    values = np.concatenate(samples)
+    low, high = np.percentile(values, SERIES_WINDOW_PERCENTILES)
+    low, high = float(low), float(high)
+    if high <= low:
+        high = low + 1
+    
+    return {
+        'low': low,
+        'high': high,
+        'center': (low + high) / 2,
+        'width': high - low,
+        'min': float(values.min()),
+        'max': float(values.max()),
+        'sampled_slices': len(samples)
+    }
+
+def _series_stats_path(series_dir):
+    digest = hashlib.sha256(os.path.abspath(series_dir).encode('utf-8')).hexdigest()
+    return os.path.join(current_app.config['SERIES_STATS_DIR'], digest[:2], f"{digest}.json")
+
+def series_stats_signature(series_dir):
+    """Value the series statistics are recomputed on: the series directory mtime, or None if it is missing"""
+    try:
+        return os.stat(series_dir).st_mtime_ns
+    except OSError:
+        return None
+
+def get_series_stats(series_dir, dicom_files=None):
+    """
+    Get intensity statistics for a series, computing and persisting them once
+    
+    Statistics are stored per series in SERIES_STATS_DIR together with the
+    series directory mtime (which changes whenever slices are added or removed),
+    and are only recomputed when it changes. dicom_files is only needed, and
+    only listed when omitted, if the statistics have to be computed.
+    """
+    signature = series_stats_signature(series_dir)
+    if signature is None:
+        return None
+    
+    memo_key = os.path.abspath(series_dir)
+    with _series_stats_lock:
+        cached = _series_stats_memo.get(memo_key)
+    if cached and cached['signature'] == signature:
+        return cached['stats']
+    
+    stats_path = _series_stats_path(series_dir)
+    stored = None
+    try:
+        with open(stats_path, 'r') as f:
+            stored = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        pass
+    
+    if not stored or stored.get('signature') != signature:
+        if dicom_files is None:
+            dicom_files = [f for f in os.listdir(series_dir) if f.lower().endswith('.dcm')]
+        stats = compute_series_stats([os.path.join(series_dir, f) for f in sorted(dicom_files)])
+        stored = {'signature': signature, 'stats': stats}
+        if stats:
+            try:
+                atomic_write(stats_path, json.dumps(stored))
+            except OSError as e:
+                current_app.logger.warning(f"Could not persist series statistics to {stats_path}: {e}")
+    
+    with _series_stats_lock:
+        _series_stats_memo[memo_key] = stored
+    return stored['stats']
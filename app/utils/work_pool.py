@@ -0,0 +1,52 @@
+import random
+
+class IncompletePatientPool:
+    """
+    Set of patient IDs that still need annotation, indexed for random selection
+
+    Members are kept in a list together with a dict mapping each ID to its list
+    position. Adding appends; removing moves the last member into the freed
+    slot. Both are O(1), and sample() draws from the list directly, so picking
+    work costs time proportional to the requested count, not the pool size.
+
+    signature is an opaque value the owner uses to tell whether the pool still
+    matches the data it was built from.
+    """
+
+    def __init__(self, patient_ids=(), signature=None):
+        self._items = []
+        self._index = {}
+        self.signature = signature
+        for patient_id in patient_ids:
+            self.add(patient_id)
+
+    def __len__(self):
+        return len(self._items)
+
+    def __contains__(self, patient_id):
+        return patient_id in self._index
+
+    def __iter__(self):
+        return iter(list(self._items))
+
+    def add(self, patient_id):
+        """Add a patient to the pool (no-op if already present)"""
+        if patient_id not in self._index:
+            self._index[patient_id] = len(self._items)
+            self._items.append(patient_id)
+
+    def discard(self, patient_id):
+        """Remove a patient from the pool (no-op if absent)"""
+        position = self._index.pop(patient_id, None)
+        if position is None:
+            return
+        last = self._items.pop()
+        if position < len(self._items):
+            self._items[position] = last
+            self._index[last] = position
+
+    def sample(self, count):
+        """Return up to count distinct patients chosen at random"""
+        if len(self._items) <= count:
+            return list(self._items)
+        return random.sample(self._items, count)
@@ -1,6 +1,12 @@
+import os
 from app import create_app
 
 app = create_app()
 
 if __name__ == '__main__':
+    # Only the development server runs the archive watcher itself, and only in
+    # the reloader's serving process; otherwise use scripts/watch_archive.py
+    if app.config.get('WATCHER_ENABLED') and os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        from app.utils.watcher import start_watcher
+        start_watcher(app)
     app.run(debug=True)
@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+"""
+Inter-rater agreement utility for MRI Annotation Tool
+
+Prints Cohen's kappa of every rater pair and Fleiss' kappa of all raters,
+per finding over all levels and, with --levels, per finding and level, on
+the studies read by at least two of the raters.
+
+Usage:
+    python agreement.py [--raters A,B,...] [--findings F,...] [--levels] [--json]
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+
+# Make the app package importable when run from the scripts directory
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import create_app
+from app.models.annotation import ANNOTATION_TYPES
+from app.models.annotation_agreement import AgreementEngine
+from app.models.annotation_index import get_annotation_index
+
+def _format(kappa):
+    return '-' if kappa is None else f"{kappa:.3f}"
+
+def print_row(label, stats):
+    pairs = '  '.join(f"{'/'.join(pair['raters'])}={_format(pair['kappa'])} (n={pair['studies']})"
+                      for pair in stats['cohen'])
+    print(f"{label:<30} fleiss={_format(stats['fleiss']):>6}  observed={_format(stats['observed']):>6}  {pairs}")
+
+def main():
+    """Main function"""
+    app = create_app()
+
+    parser = argparse.ArgumentParser(description="Cohen's and Fleiss' kappa per finding and level")
+    parser.add_argument('--raters', help='Comma-separated annotators to compare (default: all)')
+    parser.add_argument('--findings', help='Comma-separated findings to report (default: all)')
+    parser.add_argument('--levels', action='store_true', help='Also report every level')
+    parser.add_argument('--json', action='store_true', help='Print the full result as JSON')
+    args = parser.parse_args()
+
+    raters = args.raters.split(',') if args.raters else None
+    findings = args.findings.split(',') if args.findings else None
+    for finding in findings or []:
+        if finding not in ANNOTATION_TYPES:
+            print(f"Error: unknown finding {finding}")
+            return 1
+
+    with app.app_context():
+        get_annotation_index(wait=True)
+        start = time.time()
+        result = AgreementEngine().agreement(raters=raters, findings=findings)
+        elapsed = time.time() - start
+
+    if args.json:
+        print(json.dumps(result, indent=2))
+        return 0
+
+    print(f"{result['studies']} studies read by two or more of: {', '.join(result['raters'])}")
+    for finding, stats in result['findings'].items():
+        print_row(finding, stats)
+        if args.levels:
+            for level, level_stats in stats['levels'].items():
+                print_row(f"  {level}", level_stats)
+    print(f"Computed in {elapsed:.2f}s", file=sys.stderr)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,69 @@
+#!/usr/bin/env python
+"""
+Annotation index utility for MRI Annotation Tool
+
+The annotation index (ANNOTATION_INDEX_FILE) is kept current by annotation
+writes made through the app. Rebuild it after changing annotations behind
+the app's back, e.g. after scripts/convert_annotations.py into a store
+that already held other data, or after restoring a backup.
+
+Usage:
+    python annotation_index.py rebuild                           - Rebuild the index from the annotation store
+    python annotation_index.py query [--finding F] [--value V] [--level L] [--side S]
+                                     [--annotator USER] [--since DATE] [--until DATE]
+                                     [--by-study] [--page N] [--per-page N]
+"""
+
+import os
+import sys
+import time
+import argparse
+
+# Make the app package importable when run from the scripts directory
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import create_app
+from app.models.annotation_index import AnnotationIndex, get_annotation_index
+from app.models.annotation_store import get_annotation_store
+from app.utils.annotation_export import parse_bound
+
+def main():
+    """Main function"""
+    app = create_app()
+
+    parser = argparse.ArgumentParser(description='Rebuild or query the annotation index')
+    parser.add_argument('command', choices=['rebuild', 'query'])
+    parser.add_argument('--finding')
+    parser.add_argument('--value')
+    parser.add_argument('--level')
+    parser.add_argument('--side')
+    parser.add_argument('--annotator')
+    parser.add_argument('--since', type=parse_bound)
+    parser.add_argument('--until', type=parse_bound)
+    parser.add_argument('--by-study', action='store_true', help='One result per study')
+    parser.add_argument('--page', type=int, default=1)
+    parser.add_argument('--per-page', type=int, default=50)
+    args = parser.parse_args()
+
+    with app.app_context():
+        if args.command == 'rebuild':
+            start = time.time()
+            count = AnnotationIndex(app.config['ANNOTATION_INDEX_FILE']).rebuild(get_annotation_store())
+            print(f"Indexed {count} annotations in {time.time() - start:.2f}s")
+            return 0
+
+        start = time.time()
+        result = get_annotation_index(wait=True).query(
+            finding=args.finding, value=args.value, level=args.level, side=args.side,
+            annotator=args.annotator, since=args.since, until=args.until,
+            group_by='study' if args.by_study else None, page=args.page, per_page=args.per_page
+        )
+        elapsed = (time.time() - start) * 1000
+
+    for row in result['results']:
+        print('\t'.join('' if value is None else str(value) for value in row.values()))
+    print(f"{len(result['results'])} of {result['total']} results in {elapsed:.1f} ms")
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
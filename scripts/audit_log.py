@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+"""
+Annotation audit log utility for MRI Annotation Tool
+
+The audit log (AUDIT_LOG_DIR) records every annotation write made through
+the app, one segment file per day. Compact gzips the segments of past days.
+
+Usage:
+    python audit_log.py query [--since DATE] [--until DATE] [--patient ID] [--study ID]
+                              [--series NAME] [--user USER] [--op OP]
+    python audit_log.py state PATIENT STUDY SERIES (--at DATE | --version N)
+    python audit_log.py compact [--before YYYYMMDD]
+"""
+
+import os
+import sys
+import json
+import argparse
+
+# Make the app package importable when run from the scripts directory
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import create_app
+from app.models.annotation_audit import AuditLog, AuditHistoryGap, AUDIT_OPERATIONS
+from app.models.annotation_store import get_annotation_store
+from app.utils.annotation_export import parse_bound
+
+def main():
+    """Main function"""
+    app = create_app()
+
+    parser = argparse.ArgumentParser(description='Query, replay or compact the annotation audit log')
+    parser.add_argument('command', choices=['query', 'state', 'compact'])
+    parser.add_argument('location', nargs='*', help='PATIENT STUDY SERIES (state)')
+    parser.add_argument('--since', type=parse_bound)
+    parser.add_argument('--until', type=parse_bound)
+    parser.add_argument('--patient')
+    parser.add_argument('--study')
+    parser.add_argument('--series')
+    parser.add_argument('--user')
+    parser.add_argument('--op', choices=AUDIT_OPERATIONS)
+    parser.add_argument('--at', type=parse_bound, help='State at this ISO date or datetime')
+    parser.add_argument('--version', type=int, help='State at this series version')
+    parser.add_argument('--before', help='Compact segments of days before YYYYMMDD (default: today)')
+    args = parser.parse_args()
+
+    with app.app_context():
+        audit_log = AuditLog(app.config['AUDIT_LOG_DIR'])
+
+        if args.command == 'compact':
+            print(f"Compacted {audit_log.compact(args.before)} segments")
+            return 0
+
+        if args.command == 'state':
+            if len(args.location) != 3 or (args.at is None) == (args.version is None):
+                parser.error('state needs PATIENT STUDY SERIES and one of --at or --version')
+            patient_id, study_id, series_name = args.location
+            annotations, version = get_annotation_store().get_series_versioned(patient_id, study_id, series_name)
+            try:
+                annotations, version = audit_log.state_at(patient_id, study_id, series_name, annotations, version,
+                                                          at=args.at, at_version=args.version)
+            except AuditHistoryGap as e:
+                print(f"Error: {e}")
+                return 1
+            print(json.dumps({'annotations': annotations, 'version': version}, indent=2))
+            return 0
+
+        count = 0
+        for entry in audit_log.iter_entries(since=args.since, until=args.until, patient_id=args.patient,
+                                            study_id=args.study, series_name=args.series,
+                                            username=args.user, op=args.op):
+            print(json.dumps(entry, separators=(',', ':')))
+            count += 1
+    print(f"{count} entries", file=sys.stderr)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
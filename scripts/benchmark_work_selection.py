@@ -0,0 +1,98 @@
+#!/usr/bin/env python
+"""
+Work selection benchmark for MRI Annotation Tool
+
+Compares picking random patients that need annotation by filtering the full
+patient list (the previous approach, one pass over every patient per
+dashboard request) with sampling the indexed IncompletePatientPool. Patient
+IDs and statuses are synthetic and held in memory, so the numbers measure the
+selection itself and not the filesystem.
+
+Usage:
+    python benchmark_work_selection.py [--sizes 10000,100000,1000000] [--count 5] [--completed 0.5] [--repeat 20]
+"""
+
+import os
+import sys
+import time
+import random
+import argparse
+
+# Make the app package importable when run from the scripts directory
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.main.utils import STATUS_PARTIAL, STATUS_COMPLETE
+from app.utils.work_pool import IncompletePatientPool
+
+def make_archive(size, completed_fraction):
+    """Build a synthetic patient list and status dict"""
+    patient_list = [f"P{i:07d}" for i in range(size)]
+    status_data = {}
+    for patient_id in patient_list:
+        r = random.random()
+        if r < completed_fraction:
+            status_data[patient_id] = {'status': STATUS_COMPLETE}
+        elif r < completed_fraction + (1 - completed_fraction) / 2:
+            status_data[patient_id] = {'status': STATUS_PARTIAL}
+        # The rest have no status entry (not annotated)
+    return patient_list, status_data
+
+def select_by_scan(patient_list, status_data, count):
+    """Previous selection: filter every patient, then sample"""
+    patients_needing_work = [p for p in patient_list
+                             if p not in status_data or
+                             status_data[p]['status'] != STATUS_COMPLETE]
+    if len(patients_needing_work) <= count:
+        return patients_needing_work
+    return random.sample(patients_needing_work, count)
+
+def timed(func, repeat):
+    """Best wall-clock time of repeat calls, in milliseconds"""
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        elapsed = (time.perf_counter() - start) * 1000
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+def run(size, count, completed_fraction, repeat):
+    """Benchmark one archive size and print a result row"""
+    patient_list, status_data = make_archive(size, completed_fraction)
+
+    start = time.perf_counter()
+    pool = IncompletePatientPool(p for p in patient_list
+                                 if p not in status_data or status_data[p]['status'] != STATUS_COMPLETE)
+    build_ms = (time.perf_counter() - start) * 1000
+
+    scan_ms = timed(lambda: select_by_scan(patient_list, status_data, count), repeat)
+    pool_ms = timed(lambda: pool.sample(count), repeat)
+
+    # Status changes: complete a random member, then reopen it
+    def update():
+        patient_id = pool.sample(1)[0]
+        pool.discard(patient_id)
+        pool.add(patient_id)
+    update_ms = timed(update, repeat)
+
+    speedup = scan_ms / pool_ms if pool_ms else float('inf')
+    print(f"{size:>10,} {len(pool):>10,} {scan_ms:>12.3f} {pool_ms:>12.4f} {speedup:>10.0f}x "
+          f"{update_ms:>12.4f} {build_ms:>10.1f}")
+
+def main():
+    """Main function"""
+    parser = argparse.ArgumentParser(description='Benchmark random work selection')
+    parser.add_argument('--sizes', default='10000,100000,1000000',
+                        help='Comma separated archive sizes (patients)')
+    parser.add_argument('--count', type=int, default=5, help='Patients to select per request')
+    parser.add_argument('--completed', type=float, default=0.5, help='Fraction of completed patients')
+    parser.add_argument('--repeat', type=int, default=20, help='Repetitions per measurement (best is reported)')
+    args = parser.parse_args()
+
+    print(f"{'patients':>10} {'incomplete':>10} {'scan (ms)':>12} {'pool (ms)':>12} {'speedup':>11} "
+          f"{'update (ms)':>12} {'build (ms)':>10}")
+    for size in [int(s) for s in args.sizes.split(',') if s.strip()]:
+        run(size, args.count, args.completed, args.repeat)
+
+if __name__ == '__main__':
+    main()
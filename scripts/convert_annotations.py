@@ -0,0 +1,71 @@
+#!/usr/bin/env python
+"""
+Annotation conversion utility for MRI Annotation Tool
+
+Converts annotations between the per-series JSON file layout under
+ANNOTATION_DATA_DIR and the indexed SQLite database (ANNOTATION_DB_FILE).
+Import before switching ANNOTATION_BACKEND to 'sqlite'; export to go back to
+the file layout. Series present in the target are replaced, other series in
+the target are left alone, so running it again is safe. Each series keeps its
+version and next free annotation ID, so IDs are not reused after the switch
+and clients holding a series version can keep writing against it.
+
+Usage:
+    python convert_annotations.py import [--dir PATH] [--db PATH]   - JSON files -> SQLite
+    python convert_annotations.py export [--dir PATH] [--db PATH]   - SQLite -> JSON files
+"""
+
+import os
+import sys
+import argparse
+
+# Make the app package importable when run from the scripts directory
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import create_app
+from app.models.annotation_store import FileAnnotationStore, SQLiteAnnotationStore
+
+def convert(source, target):
+    """Copy every series, with its version and next free ID, from the source store to the target store"""
+    series = {(patient_id, study_id, series_name): annotations
+              for patient_id, study_id, series_name, annotations in source.iter_series()}
+    # Series whose annotations were all deleted still carry a state
+    states = source.series_states()
+
+    series_count = 0
+    annotation_count = 0
+    for key in sorted(set(series) | set(states)):
+        annotations = series.get(key, [])
+        next_id, version = states.get(key, (1, 0))
+        target.restore_series(*key, annotations, next_id, version)
+        series_count += 1
+        annotation_count += len(annotations)
+
+    print(f"Converted {annotation_count} annotations in {series_count} series")
+
+def main():
+    """Main function"""
+    app = create_app()
+
+    parser = argparse.ArgumentParser(description='Convert annotations between the file and SQLite backends')
+    parser.add_argument('command', choices=['import', 'export'])
+    parser.add_argument('--dir', default=app.config['ANNOTATION_DATA_DIR'], help='Annotation data directory')
+    parser.add_argument('--db', default=app.config['ANNOTATION_DB_FILE'], help='Annotation SQLite database')
+    args = parser.parse_args()
+
+    with app.app_context():
+        file_store = FileAnnotationStore(args.dir)
+        sqlite_store = SQLiteAnnotationStore(args.db)
+
+        if args.command == 'import':
+            if not os.path.isdir(args.dir):
+                print(f"Error: annotation directory not found: {args.dir}")
+                return 1
+            convert(file_store, sqlite_store)
+        else:
+            convert(sqlite_store, file_store)
+
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+"""
+Annotation export utility for MRI Annotation Tool
+
+Streams every annotation, joined with patient and study status and the
+series UID and instance count from the archive catalog, to a Parquet, CSV
+or JSONL file for training pipelines. Memory use is bounded by the batch
+size, not the number of annotations. Parquet needs pyarrow; without it use
+csv or jsonl.
+
+Usage:
+    python export_annotations.py OUTPUT [--format FMT] [--finding F] [--level L]
+                                        [--annotator USER] [--since DATE] [--until DATE]
+                                        [--batch-size N]
+
+The format defaults to the OUTPUT extension; OUTPUT '-' writes to stdout.
+"""
+
+import os
+import sys
+import argparse
+
+# Make the app package importable when run from the scripts directory
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import create_app
+from app.models.annotation import ANNOTATION_TYPES, VERTEBRAL_LEVELS
+from app.models.annotation_store import get_annotation_store
+from app.utils.annotation_export import (
+    iter_export, iter_export_rows, parse_bound, default_format, EXPORT_FORMATS, EXPORT_BATCH_SIZE
+)
+from app.utils.catalog import get_catalog
+from app.utils.status_store import get_status_store
+
+def main():
+    """Main function"""
+    app = create_app()
+
+    parser = argparse.ArgumentParser(description='Export annotations with patient, study and series metadata')
+    parser.add_argument('output', help="Output file, or '-' for stdout")
+    parser.add_argument('--format', choices=EXPORT_FORMATS, help='Output format (default: from the extension)')
+    parser.add_argument('--finding', choices=sorted(ANNOTATION_TYPES), help='Only this finding type')
+    parser.add_argument('--level', choices=VERTEBRAL_LEVELS, help='Only this vertebral level')
+    parser.add_argument('--annotator', help='Only annotations created by this user')
+    parser.add_argument('--since', type=parse_bound, help='Only annotations last changed on or after this date')
+    parser.add_argument('--until', type=parse_bound, help='Only annotations last changed on or before this date')
+    parser.add_argument('--batch-size', type=int, default=EXPORT_BATCH_SIZE,
+                        help='Rows per Parquet row group / write')
+    args = parser.parse_args()
+
+    fmt = args.format
+    if fmt is None:
+        extension = os.path.splitext(args.output)[1].lstrip('.').lower()
+        fmt = extension if extension in EXPORT_FORMATS else default_format()
+
+    with app.app_context():
+        rows = iter_export_rows(get_annotation_store(), get_status_store(), get_catalog(),
+                                finding=args.finding, level=args.level, annotator=args.annotator,
+                                since=args.since, until=args.until)
+        stats = {}
+        try:
+            chunks = iter_export(rows, fmt, batch_size=args.batch_size, stats=stats)
+        except ValueError as e:
+            print(f"Error: {e}", file=sys.stderr)
+            return 1
+
+        output = sys.stdout.buffer if args.output == '-' else open(args.output, 'wb')
+        try:
+            for chunk in chunks:
+                output.write(chunk)
+        finally:
+            if output is not sys.stdout.buffer:
+                output.close()
+
+    print(f"Exported {stats['rows']} annotations ({stats['bytes']} bytes, {fmt}) in {stats['seconds']:.2f}s: "
+          f"{stats['rows_per_second']:.0f} rows/s", file=sys.stderr)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
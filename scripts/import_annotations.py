@@ -0,0 +1,89 @@
+#!/usr/bin/env python
+"""
+Bulk annotation import utility for MRI Annotation Tool
+
+Adds pre-annotations (e.g. from external readers) from a file of records,
+each an annotation plus the patient_id, study_id and series_name it belongs
+to. All records are validated first; the annotations of each series are
+then written at once, and study and patient statuses are updated in a
+single pass at the end.
+
+Usage:
+    python import_annotations.py INPUT [--format FMT] [--user NAME] [--skip-invalid]
+
+INPUT is a JSON list, JSONL or CSV file (format defaults to the extension).
+CSV cells left empty are omitted from the record.
+"""
+
+import os
+import sys
+import csv
+import json
+import argparse
+
+# Make the app package importable when run from the scripts directory
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import create_app
+from app.models.annotation import import_annotations
+
+INPUT_FORMATS = ('json', 'jsonl', 'csv')
+
+def read_records(path, fmt):
+    """Read import records from a JSON, JSONL or CSV file"""
+    with open(path, 'r', newline='' if fmt == 'csv' else None) as f:
+        if fmt == 'json':
+            return json.load(f)
+        if fmt == 'jsonl':
+            return [json.loads(line) for line in f if line.strip()]
+
+        records = []
+        for row in csv.DictReader(f):
+            record = {key: value for key, value in row.items() if value not in (None, '')}
+            if 'relevant_to_decision' in record:
+                record['relevant_to_decision'] = record['relevant_to_decision'].lower() in ('1', 'true', 'yes')
+            records.append(record)
+        return records
+
+def main():
+    """Main function"""
+    app = create_app()
+
+    parser = argparse.ArgumentParser(description='Import annotations in bulk')
+    parser.add_argument('input', help='JSON, JSONL or CSV file of records')
+    parser.add_argument('--format', choices=INPUT_FORMATS, help='Input format (default: from the extension)')
+    parser.add_argument('--user', default='import', help='Username recorded as the annotator')
+    parser.add_argument('--skip-invalid', action='store_true',
+                        help='Import the valid records even if some are invalid')
+    args = parser.parse_args()
+
+    fmt = args.format or os.path.splitext(args.input)[1].lstrip('.').lower()
+    if fmt not in INPUT_FORMATS:
+        print(f"Error: cannot tell the format of {args.input}; use --format")
+        return 1
+
+    try:
+        records = read_records(args.input, fmt)
+    except (IOError, ValueError) as e:
+        print(f"Error: could not read {args.input}: {e}")
+        return 1
+
+    with app.app_context():
+        summary = import_annotations(records, args.user, skip_invalid=args.skip_invalid)
+
+    for error in summary['errors'][:20]:
+        print(f"Record {error['index']}: {'; '.join(error['errors'])}")
+    if len(summary['errors']) > 20:
+        print(f"... and {len(summary['errors']) - 20} more invalid records")
+    if summary['errors'] and not args.skip_invalid:
+        print(f"Nothing imported: {len(summary['errors'])} of {len(records)} records are invalid")
+        return 1
+
+    for failed in summary['failed']:
+        print(f"Failed to write {failed['patient_id']}/{failed['study_id']}/{failed['series_name']}")
+    print(f"Imported {summary['imported']} annotations into {summary['series']} series "
+          f"of {summary['studies']} studies")
+    return 1 if summary['failed'] else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
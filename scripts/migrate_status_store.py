@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+"""
+Annotation status migration utility for MRI Annotation Tool
+
+Copies annotation status between the JSON file backend (ANNOTATION_STATUS_FILE)
+and the SQLite backend (STATUS_STORE_FILE). Import before switching
+STATUS_STORE_BACKEND to 'sqlite'; export to go back to the JSON file. The
+target is replaced in a single transaction, so running it again is safe.
+
+The journal backend uses ANNOTATION_STATUS_FILE as its snapshot, so switching
+to it needs no import. Compact the journal into the snapshot before switching
+back to 'json', or before importing journalled data into SQLite.
+
+Usage:
+    python migrate_status_store.py import [--json PATH] [--db PATH]       - JSON file -> SQLite
+    python migrate_status_store.py export [--json PATH] [--db PATH]       - SQLite -> JSON file
+    python migrate_status_store.py compact [--json PATH] [--journal PATH] - Fold the status journal into the JSON file
+"""
+
+import os
+import sys
+import argparse
+
+# Make the app package importable when run from the scripts directory
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import create_app
+from app.utils.status_store import JsonStatusStore, JournalStatusStore, SQLiteStatusStore
+
+def count_entries(status_data):
+    """Count patients and studies in status data"""
+    return len(status_data), sum(len(entry.get('studies', {})) for entry in status_data.values())
+
+def migrate(source, target):
+    """Replace the target store's data with the source store's data"""
+    status_data = source.load_all()
+    target.replace_all(status_data)
+
+    # Verify the copy
+    copied = target.load_all()
+    if copied != status_data:
+        print("Error: the migrated data does not match the source")
+        return False
+
+    patients, studies = count_entries(status_data)
+    print(f"Migrated {patients} patients and {studies} study statuses")
+    return True
+
+def main():
+    """Main function"""
+    app = create_app()
+
+    parser = argparse.ArgumentParser(description='Move annotation status between the status store backends')
+    parser.add_argument('command', choices=['import', 'export', 'compact'])
+    parser.add_argument('--json', default=app.config['ANNOTATION_STATUS_FILE'], help='Status JSON file')
+    parser.add_argument('--db', default=app.config['STATUS_STORE_FILE'], help='Status SQLite database')
+    parser.add_argument('--journal', default=app.config['STATUS_JOURNAL_FILE'], help='Status journal file')
+    args = parser.parse_args()
+
+    with app.app_context():
+        if args.command == 'compact':
+            journal_store = JournalStatusStore(args.json, args.journal)
+            journal_bytes = journal_store.stats()['journal_bytes']
+            journal_store.compact()
+            patients, studies = count_entries(journal_store.load_all())
+            print(f"Compacted {journal_bytes} journal bytes; the snapshot holds {patients} patients "
+                  f"and {studies} study statuses")
+            return 0
+
+        json_store = JsonStatusStore(args.json)
+        sqlite_store = SQLiteStatusStore(args.db)
+
+        if args.command == 'import':
+            if not os.path.exists(args.json):
+                print(f"Error: status file not found: {args.json}")
+                return 1
+            ok = migrate(json_store, sqlite_store)
+        else:
+            ok = migrate(sqlite_store, json_store)
+
+    return 0 if ok else 1
+
+if __name__ == '__main__':
+    sys.exit(main())
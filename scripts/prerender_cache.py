@@ -0,0 +1,153 @@
+#!/usr/bin/env python
+"""
+Bulk pre-render utility for MRI Annotation Tool
+
+Walks every patient/study/series under MRI_ROOT_DIR and renders all slices
+into the render cache at the configured preview widths, using all CPU cores.
+Completed series are recorded in a manifest so an interrupted run can be
+resumed; series whose directory changed since they were recorded, or that had
+slices fail to render, are redone.
+
+Usage:
+    python prerender_cache.py [--workers N] [--widths 300,600] [--manifest PATH] [--restart]
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import multiprocessing
+
+# Make the app package importable when run from the scripts directory
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import create_app
+from app.main.utils import get_patient_list, get_patient_studies, get_study_series
+from app.utils.prerender import _init_worker, render_series_task
+
+# Default manifest location
+MANIFEST_FILE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'instance', 'prerender_manifest.jsonl')
+
+# Seconds between progress reports
+REPORT_INTERVAL = 5
+
+def load_manifest(manifest_path):
+    """
+    Load the completed series from the manifest as {series path: directory mtime}
+    
+    Series whose latest entry has slices that failed to render are left out,
+    so a resumed run tries them again.
+    """
+    completed = {}
+    if not os.path.exists(manifest_path):
+        return completed
+    
+    with open(manifest_path, 'r') as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError:
+                # Truncated last line of an interrupted run
+                continue
+            key = '/'.join(entry['series'])
+            if entry.get('failed'):
+                completed.pop(key, None)
+            else:
+                completed[key] = entry['mtime']
+    return completed
+
+def series_mtime(mri_root, patient_id, study_id, series_name):
+    """Get the modification time of a series directory"""
+    try:
+        return os.stat(os.path.join(mri_root, patient_id, study_id, series_name)).st_mtime_ns
+    except OSError:
+        return None
+
+def collect_series(mri_root, completed):
+    """Yield (patient, study, series) for every series not yet recorded in the manifest"""
+    for patient_id in sorted(get_patient_list()):
+        for study in get_patient_studies(patient_id):
+            for series_name in sorted(get_study_series(patient_id, study['id'])):
+                key = '/'.join([patient_id, study['id'], series_name])
+                if completed.get(key) == series_mtime(mri_root, patient_id, study['id'], series_name):
+                    continue
+                yield patient_id, study['id'], series_name
+
+def format_rate(slices, source_bytes, elapsed):
+    """Format throughput as slices/s and MB/s"""
+    elapsed = max(elapsed, 1e-9)
+    return f"{slices / elapsed:.1f} slices/s, {source_bytes / elapsed / 1024 ** 2:.1f} MB/s"
+
+def prerender(workers, widths, manifest_path, restart=False):
+    """Render every pending series into the render cache"""
+    app = create_app()
+    
+    with app.app_context():
+        mri_root = app.config['MRI_ROOT_DIR']
+        widths = widths or app.config['RENDER_PREVIEW_WIDTHS']
+        
+        if restart and os.path.exists(manifest_path):
+            os.remove(manifest_path)
+        completed = load_manifest(manifest_path)
+        
+        pending = list(collect_series(mri_root, completed))
+        print(f"{len(pending)} series to render at widths {widths} "
+              f"({len(completed)} already done) with {workers} workers")
+        if not pending:
+            return
+        
+        config = {key: value for key, value in app.config.items() if key.isupper()}
+    
+    os.makedirs(os.path.dirname(manifest_path), exist_ok=True)
+    tasks = [(patient_id, study_id, series_name, widths) for patient_id, study_id, series_name in pending]
+    
+    start = time.time()
+    last_report = start
+    done = slices = failed = source_bytes = 0
+    
+    ctx = multiprocessing.get_context('spawn')
+    with ctx.Pool(processes=workers, initializer=_init_worker, initargs=(config,)) as pool, \
+            open(manifest_path, 'a') as manifest:
+        for result in pool.imap_unordered(render_series_task, tasks):
+            done += 1
+            slices += result['slices']
+            failed += result['failed']
+            source_bytes += result['bytes']
+            
+            mtime = series_mtime(mri_root, *result['series'])
+            manifest.write(json.dumps({'series': result['series'], 'mtime': mtime, 'slices': result['slices'],
+                                       'failed': result['failed']}) + '\n')
+            manifest.flush()
+            
+            now = time.time()
+            if now - last_report >= REPORT_INTERVAL or done == len(tasks):
+                print(f"[{done}/{len(tasks)}] {slices} slices ({failed} failed), {format_rate(slices, source_bytes, now - start)}")
+                last_report = now
+    
+    elapsed = time.time() - start
+    print(f"\nRendered {slices} slices from {done} series in {elapsed:.1f}s "
+          f"({format_rate(slices, source_bytes, elapsed)})")
+    if failed:
+        print(f"{failed} slices could not be rendered; see the log for details")
+
+def main():
+    """Main function"""
+    parser = argparse.ArgumentParser(description='Pre-render all DICOM slices under MRI_ROOT_DIR into the render cache')
+    parser.add_argument('--workers', type=int, default=multiprocessing.cpu_count(),
+                        help='Number of worker processes (default: all cores)')
+    parser.add_argument('--widths', type=lambda s: [int(w) for w in s.split(',')], default=None,
+                        help='Comma-separated image widths (default: RENDER_PREVIEW_WIDTHS)')
+    parser.add_argument('--manifest', default=MANIFEST_FILE,
+                        help='Progress manifest used to resume interrupted runs')
+    parser.add_argument('--restart', action='store_true',
+                        help='Ignore the existing manifest and render everything again')
+    args = parser.parse_args()
+    
+    try:
+        prerender(args.workers, args.widths, args.manifest, args.restart)
+    except KeyboardInterrupt:
+        print("\nInterrupted; run again to resume from the manifest.")
+
+if __name__ == "__main__":
+    main()
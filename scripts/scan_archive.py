@@ -0,0 +1,66 @@
+#!/usr/bin/env python
+"""
+Archive scanner utility for MRI Annotation Tool
+
+Walks MRI_ROOT_DIR with the concurrent scandir scanner and reports how many
+directories per second the storage sustains, to tune the scanner settings.
+
+Usage:
+    python scan_archive.py scan [--workers N] [--depth D]   - Walk the archive without touching the catalog
+    python scan_archive.py refresh [--workers N]            - Incrementally refresh the archive catalog
+"""
+
+import os
+import sys
+import argparse
+
+# Make the app package importable when run from the scripts directory
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import create_app
+from app.utils.catalog import ArchiveCatalog, catalog_entry_filter, DEPTH_SERIES
+from app.utils.scanner import DirectoryScanner
+from app.main.utils import sync_status_with_archive
+
+def print_stats(stats):
+    """Print scanner counters and throughput"""
+    print(f"Scanned {stats['dirs_scanned']} directories ({stats['dirs_listed']} listed, "
+          f"{stats['entries_seen']} entries) in {stats['seconds']:.2f}s: "
+          f"{stats['dirs_per_second']:.0f} dirs/s")
+
+def scan(mri_root, workers, depth):
+    """Walk the whole archive, listing every directory down to depth"""
+    scanner = DirectoryScanner(mri_root, max_depth=depth, max_workers=workers, entry_filter=catalog_entry_filter)
+    for _ in scanner.walk():
+        pass
+    print_stats(scanner.stats())
+
+def refresh(app, workers):
+    """Incrementally refresh the archive catalog and apply added/removed studies to the annotation status"""
+    catalog = ArchiveCatalog(app.config['CATALOG_FILE'], app.config['MRI_ROOT_DIR'], scan_workers=workers)
+    stats = catalog.refresh()
+    changed = sync_status_with_archive(stats['changes'])
+    print_stats(stats)
+    print(f"Catalog: {stats['added']} entries added, {stats['removed']} removed; "
+          f"status updated for {len(changed)} patients")
+
+def main():
+    """Main function"""
+    app = create_app()
+    
+    parser = argparse.ArgumentParser(description='Scan the MRI archive and report throughput')
+    parser.add_argument('command', choices=['scan', 'refresh'])
+    parser.add_argument('--workers', type=int, default=app.config['CATALOG_SCAN_WORKERS'],
+                        help='Concurrent stat/list operations')
+    parser.add_argument('--depth', type=int, default=DEPTH_SERIES,
+                        help='Deepest level to list: 1 patients, 2 studies, 3 series (scan only)')
+    args = parser.parse_args()
+    
+    with app.app_context():
+        if args.command == 'scan':
+            scan(app.config['MRI_ROOT_DIR'], args.workers, args.depth)
+        else:
+            refresh(app, args.workers)
+
+if __name__ == "__main__":
+    main()
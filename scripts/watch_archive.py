@@ -0,0 +1,52 @@
+#!/usr/bin/env python
+"""
+Archive watcher for MRI Annotation Tool
+
+Runs the filesystem watcher in the foreground, keeping the archive catalog
+and annotation status in sync with new and removed studies in MRI_ROOT_DIR.
+
+Usage:
+    python watch_archive.py [--mode auto|inotify|poll]
+"""
+
+import os
+import sys
+import argparse
+
+# Make the app package importable when run from the scripts directory
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import create_app
+from app.utils.catalog import get_catalog
+from app.utils.watcher import ArchiveWatcher
+
+def main():
+    """Main function"""
+    app = create_app()
+    
+    parser = argparse.ArgumentParser(description='Watch MRI_ROOT_DIR and keep the archive catalog up to date')
+    parser.add_argument('--mode', choices=['auto', 'inotify', 'poll'], default=app.config['WATCHER_MODE'])
+    args = parser.parse_args()
+    
+    with app.app_context():
+        catalog = get_catalog()
+    if catalog is None:
+        print("The archive catalog is disabled (CATALOG_ENABLED=0); nothing to watch.")
+        return
+    
+    watcher = ArchiveWatcher(
+        app,
+        catalog,
+        mode=args.mode,
+        batch_interval=app.config['WATCHER_BATCH_INTERVAL'],
+        poll_interval=app.config['WATCHER_POLL_INTERVAL']
+    )
+    
+    print(f"Watching {app.config['MRI_ROOT_DIR']} (Ctrl+C to stop)")
+    try:
+        watcher.run()
+    except KeyboardInterrupt:
+        print(f"\nStopped. {watcher.stats()}")
+
+if __name__ == "__main__":
+    main()